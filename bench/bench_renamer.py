@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""Throughput benchmarks for renamer functions and CLI commands.
+
+Every case runs in its own process on a freshly generated synthetic tree (in
+/dev/shm when available), and reports files/sec, read/write syscalls (from
+/proc/self/io, Linux only) and the peak RSS of the process.
+
+i.e.: python bench/bench_renamer.py -n 20000 -s flat -s duplicates -o bench.json
+"""
+import os, sys, json, time, shutil, random, tempfile, resource, logging, multiprocessing, click
+from pathlib import Path
+from click.testing import CliRunner
+from renamer import functions as func
+from renamer.renamer_cli import cli
+
+shapes = ["flat", "deep", "wide", "duplicates", "long_names"]
+
+
+# Synthetic trees
+
+def generate_tree(base: Path, shape: str, count: int, seed: int = 42) -> Path:
+    """Creates `count` small files under base/shape, names look like IMG_<n>_<date>.jpg"""
+    rnd = random.Random(seed)
+    root = base.joinpath(shape)
+    root.mkdir(parents=True)
+    for i in range(count):
+        if shape == "deep":
+            folder = root.joinpath(*[f"d{(i >> s) % 4}" for s in range(0, 24, 2)])
+        elif shape == "wide":
+            folder = root.joinpath(f"w{i % 1000:04d}")
+        else:
+            folder = root.joinpath(f"f{i // 5000:03d}")
+        name = f"IMG_{i:08d}_2026{rnd.randint(1, 12):02d}{rnd.randint(1, 28):02d}.jpg"
+        if shape == "long_names":
+            name = f"{'x' * 180}_{name}"
+        folder.mkdir(parents=True, exist_ok=True)
+        if shape == "duplicates":
+            content = f"dup-{i % (count // 10 or 1)}".encode() * rnd.randint(1, 4)
+        else:
+            content = f"file-{i}".encode()
+        folder.joinpath(name).write_bytes(content)
+    return root
+
+
+# Cases: each one gets a fresh tree and returns the number of processed files
+
+def case_find_files(root: Path, count: int) -> int:
+    return sum(1 for _ in func.find_files(root))
+
+
+def case_rename_filename(root: Path, count: int) -> int:
+    matcher = func.compile_matcher("_2026", False)
+    return len([func.rename_filename(f, matcher, "_X") for f in func.find_files(root, matcher)])
+
+
+def case_rename_filename_regex(root: Path, count: int) -> int:
+    matcher = func.compile_matcher("(.*)IMG_([0-9]+)_([0-9]+)(.*)", True)
+    return len([func.rename_filename_regex(f, matcher, "$1$3_$2$4") for f in func.find_files(root, matcher)])
+
+
+def case_manage_name_conflicts(root: Path, count: int) -> int:
+    files = list(func.find_files(root))
+    rename_map = {f: f.parent.joinpath(f"same_{i % 10}.jpg") for i, f in enumerate(files)}
+    return len(func.manage_name_conflicts(rename_map))
+
+
+def case_find_duplicates(root: Path, count: int) -> int:
+    func.find_duplicates([root])
+    return count
+
+
+def _invoke(*args) -> None:
+    result = CliRunner().invoke(cli, list(args), catch_exceptions=False)
+    if result.exit_code != 0:
+        raise Exception(f"{' '.join(args)} failed: {result.output}")
+
+
+def case_cmd_rename(root: Path, count: int) -> int:
+    _invoke("rename", "-q", "-c", str(root), "_2026", "_X")
+    return count
+
+
+def case_cmd_rename_regex(root: Path, count: int) -> int:
+    _invoke("rename", "-q", "-c", "-e", str(root), "(.*)IMG_([0-9]+)_([0-9]+)(.*)", "$1$3_$2$4")
+    return count
+
+
+def case_cmd_prepend(root: Path, count: int) -> int:
+    _invoke("prepend", "-q", "-c", str(root), ".*IMG", "P_")
+    return count
+
+
+def case_cmd_organize(root: Path, count: int) -> int:
+    _invoke("organize", "-q", "-c", "-e", "_2026([0-9]{2})", str(root))
+    return count
+
+
+def case_cmd_rename_restore(root: Path, count: int) -> int:
+    _invoke("rename", "-q", "--journal-format", "rnj", str(root), "_2026", "_X")
+    _invoke("restore", "-q", str(next(root.glob("rename-journal_*"))))
+    return count
+
+
+def case_cmd_find_duplicates(root: Path, count: int) -> int:
+    _invoke("find-duplicates", "-c", str(root), str(root))
+    return count
+
+
+cases = {name[len("case_"):]: fn for name, fn in globals().items() if name.startswith("case_")}
+
+
+# Runner
+
+def _proc_io() -> dict:
+    try:
+        with open("/proc/self/io") as f:
+            return {k: int(v) for k, v in (line.split(":") for line in f)}
+    except OSError:
+        return {}
+
+
+def _run_case(name: str, shape: str, count: int, base: str, queue) -> None:
+    logging.disable(logging.CRITICAL)
+    workdir = Path(tempfile.mkdtemp(prefix="renamer-bench-", dir=base))
+    try:
+        root = generate_tree(workdir, shape, count)
+        io_before = _proc_io()
+        started = time.perf_counter()
+        processed = cases[name](root, count)
+        elapsed = time.perf_counter() - started
+        io_after = _proc_io()
+        syscalls = None
+        if io_before and io_after:
+            syscalls = (io_after["syscr"] - io_before["syscr"]) + (io_after["syscw"] - io_before["syscw"])
+        queue.put({
+            "case": name,
+            "shape": shape,
+            "files": count,
+            "seconds": round(elapsed, 4),
+            "files_per_sec": round(processed / elapsed, 1) if elapsed else None,
+            "rw_syscalls": syscalls,
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        })
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_case(name: str, shape: str, count: int, base: str) -> dict:
+    """Runs a case in a fresh process, so that peak RSS is the one of that case"""
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run_case, args=(name, shape, count, base, queue))
+    proc.start()
+    proc.join()
+    if proc.exitcode != 0:
+        return {"case": name, "shape": shape, "files": count, "error": f"exit code {proc.exitcode}"}
+    return queue.get()
+
+
+@click.command()
+@click.option('-n', '--files', 'counts', type=int, multiple=True, default=[10000], show_default=True,
+    help='Number of files of the synthetic trees. Can be repeated')
+@click.option('-s', '--shape', 'tree_shapes', type=click.Choice(shapes), multiple=True,
+    help='Tree shapes to generate (default: all). Can be repeated')
+@click.option('-k', '--case', 'case_names', type=click.Choice(sorted(cases)), multiple=True,
+    help='Cases to run (default: all). Can be repeated')
+@click.option('-b', '--base', type=click.Path(file_okay=False), help='Folder for the trees (default: /dev/shm or tmp)')
+@click.option('-o', '--output', type=click.Path(dir_okay=False), help='Write results as JSON to this file')
+def main(counts, tree_shapes, case_names, base, output):
+    base = base or ("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir())
+    results = []
+    for count in counts:
+        for shape in tree_shapes or shapes:
+            for name in case_names or sorted(cases):
+                res = run_case(name, shape, count, base)
+                results.append(res)
+                click.echo(f"{name:24} {shape:11} {count:>9} files  " + (
+                    res.get("error") or
+                    f"{res['seconds']:>9.3f}s {res['files_per_sec']:>12.1f} files/s "
+                    f"{res['rw_syscalls'] or '-':>9} syscalls {res['peak_rss_kb']:>9} KB rss"))
+
+    if output:
+        with open(output, "w", encoding="utf-8") as out_file:
+            json.dump({"python": sys.version.split()[0], "results": results}, out_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+"""File renaming, prepending and organizing with restorable journals.
+
+The library API (renamer.api) is available from the package itself, i.e.
+`renamer.scan`, `renamer.plan`, `renamer.validate`, `renamer.apply`: it is
+imported on first use, so importing `renamer` (and the CLI startup) stays light.
+"""
+
+__all__ = ["scan", "plan", "validate", "apply", "restore", "to_async", "scan_async", "validate_async",
+           "apply_async", "MoveResult", "RenamePlan", "RenameRule", "PrependRule", "OrganizeRule", "load_rules",
+           "WalkFilter", "make_walk_filter", "find_duplicates", "iter_duplicates"]
+
+
+def __getattr__(name: str):
+    if name in __all__:
+        from renamer import api
+        return getattr(api, name)
+    raise AttributeError(f"module 'renamer' has no attribute '{name}'")
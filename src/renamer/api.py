@@ -0,0 +1,135 @@
+"""Library API: the pipeline behind the rename, prepend, organize and run commands.
+
+    files = api.scan(directory, rule.matcher)         # Path generator
+    moves = api.plan(files, [rule])                   # (source, target) generator
+    plan = api.validate(moves)                        # RenamePlan, conflicts resolved
+    for result in api.apply(plan, jobs=4):            # MoveResult generator
+        ...
+
+Every step is lazy: the tree is walked while moves are planned and files are moved
+while results are consumed, at most jobs * executor.WINDOW moves ahead of the consumer.
+The *_async variants run the same generators in an executor, a batch at a time, so
+an event loop never waits on the filesystem.
+"""
+import functools, itertools, re
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import AsyncIterator, Iterable, Iterator
+from renamer import functions as func
+from renamer import journal as jrn
+from renamer import executor
+from renamer import media
+from renamer.cache import HashCache
+from renamer.executor import MoveResult
+from renamer.functions import RenamePlan, WalkFilter, find_duplicates, iter_duplicates, make_walk_filter
+from renamer.metadata import MetaStore
+from renamer.metrics import metrics
+from renamer.pathmap import PathMap
+from renamer.rules import RenameRule, PrependRule, OrganizeRule, load_rules, final_path
+
+__all__ = ["scan", "plan", "validate", "apply", "restore", "to_async", "scan_async", "validate_async",
+           "apply_async", "MoveResult", "RenamePlan", "RenameRule", "PrependRule", "OrganizeRule", "load_rules",
+           "WalkFilter", "make_walk_filter", "find_duplicates", "iter_duplicates"]
+
+ASYNC_BATCH = 256
+
+
+def scan(directory: Path, pattern: re.Pattern = None, walk_filter: WalkFilter = None,
+         store: MetaStore = None) -> Iterator[Path]:
+    """Yields the files of `directory` (recursively) whose name matches `pattern`,
+    recording their metadata in `store` (needed by rules with `needs_stat`)"""
+    if pattern is None:
+        return func.find_files(directory, store=store, walk_filter=walk_filter)
+    return func.find_files(directory, pattern, store, walk_filter)
+
+
+def plan(files: Iterable[Path], rules: list, store: MetaStore = None, jobs: int = 1,
+         cache: HashCache = None) -> Iterator[tuple[Path, Path]]:
+    """Yields (source, final path) of the files the rules chain changes. Capture
+    dates are read first (`jobs` threads, `cache`) when an organize rule uses them."""
+    if store is None and any(r.needs_stat for r in rules):
+        store = MetaStore()
+    if any(getattr(r, "uses_media", False) for r in rules):
+        files = media.with_capture_times(iter(files), store, jobs, cache)
+    for f in files:
+        r = final_path(f, rules, store)
+        if r != f:
+            yield f, r
+
+
+def validate(moves: Iterable[tuple[Path, Path]], spill_after: int = None, check_disk: bool = True) -> RenamePlan:
+    """Collects the moves and resolves their conflicts (see functions.plan_renames)"""
+    rename_map = PathMap(spill_after=spill_after)
+    try:
+        with metrics.phase("scan"):
+            for src, dst in moves:
+                rename_map.add(src, dst)
+        metrics.add("files_matched", len(rename_map))
+        return func.plan_renames(rename_map, check_disk)
+    finally:
+        rename_map.close()
+
+
+def apply(plan: RenamePlan, jobs: int = 1, journal=None, verify: bool = False, quiet: bool = True,
+          intents: bool = False) -> Iterator[MoveResult]:
+    """Creates the missing target folders, then moves the files (see executor.iter_plan).
+    With `intents` the whole plan is first written to the (binary) journal, so that an
+    interrupted run can be resumed."""
+    executor.make_folders(plan.moves.target_folders(moved_only=True), jobs, quiet, journal)
+    if intents and journal:
+        journal.write_intents(plan)
+    yield from executor.iter_plan(plan, jobs, quiet, journal, verify)
+
+
+def restore(journal: Path, jobs: int = 1, quiet: bool = True, dryrun: bool = False) -> int:
+    """Restores the files moved by a run from its journal, returns how many were restored"""
+    moves, folders = jrn.read_restore(Path(journal))
+    restored = executor.restore_moves(moves, jobs, quiet, dryrun)
+    executor.remove_folders(folders, quiet, dryrun)
+    return restored
+
+
+async def to_async(items: Iterable, pool: Executor = None, batch: int = ASYNC_BATCH) -> AsyncIterator:
+    """Iterates a blocking iterable (i.e. one of the generators above) in `pool`
+    (the loop default executor if None), `batch` items at a time. A batch is produced
+    only when the previous one was consumed: a slow consumer slows the pipeline down."""
+    import asyncio  # only needed by the async variants, the commands don't load it
+    loop = asyncio.get_running_loop()
+    items = iter(items)
+    pending = None
+    try:
+        while True:
+            pending = loop.run_in_executor(pool, _take, items, batch)
+            chunk = await asyncio.shield(pending)
+            if not chunk:
+                return
+            for item in chunk:
+                yield item
+    finally:
+        # a generator can't be closed while a batch is running in the pool
+        if pending is not None and not pending.done():
+            await asyncio.wait([pending])
+        if hasattr(items, "close"):
+            await loop.run_in_executor(pool, items.close)
+
+
+def _take(items: Iterator, n: int) -> list:
+    return list(itertools.islice(items, n))
+
+
+def scan_async(directory: Path, pattern: re.Pattern = None, walk_filter: WalkFilter = None,
+               store: MetaStore = None, pool: Executor = None) -> AsyncIterator[Path]:
+    return to_async(scan(directory, pattern, walk_filter, store), pool)
+
+
+async def validate_async(moves: Iterable[tuple[Path, Path]], spill_after: int = None, check_disk: bool = True,
+                         pool: Executor = None) -> RenamePlan:
+    """validate in `pool`: `moves` can be a lazy scan/plan pipeline, it runs there as well"""
+    import asyncio
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool, functools.partial(validate, moves, spill_after, check_disk))
+
+
+def apply_async(plan: RenamePlan, jobs: int = 1, journal=None, verify: bool = False, intents: bool = False,
+                pool: Executor = None, batch: int = ASYNC_BATCH) -> AsyncIterator[MoveResult]:
+    return to_async(apply(plan, jobs, journal, verify, True, intents), pool, batch)
@@ -0,0 +1,89 @@
+import sqlite3, logging
+from pathlib import Path
+from renamer.defaults import DEFAULT_MAX_ENTRIES
+
+log = logging.getLogger(__name__)
+
+WRITE_BATCH = 10_000
+
+
+class HashCache:
+    """Persistent SQLite cache of file digests.
+
+    Rows are keyed by (device, inode, kind, algorithm) and are valid only while
+    size and mtime_ns are unchanged: a modified file is a cache miss and its row
+    is overwritten. Every run gets a sequence number stored on the rows it reads
+    or writes; rows beyond `max_entries` are evicted least recently used first.
+    """
+
+    def __init__(self, path: Path, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._pending = []
+        self._touched = []
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS digests (
+            dev INTEGER, ino INTEGER, kind TEXT, algorithm TEXT,
+            size INTEGER, mtime_ns INTEGER, digest TEXT, used INTEGER,
+            PRIMARY KEY (dev, ino, kind, algorithm))""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS digests_used ON digests (used)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'run'").fetchone()
+        self.run = (row[0] if row else 0) + 1
+        self._db.execute("INSERT OR REPLACE INTO meta VALUES ('run', ?)", (self.run,))
+
+    def get(self, signature: tuple, kind: str, algorithm: str) -> str:
+        """Returns the cached digest for signature (dev, ino, size, mtime_ns) or None"""
+        dev, ino, size, mtime_ns = signature
+        row = self._db.execute(
+            "SELECT size, mtime_ns, digest FROM digests WHERE dev = ? AND ino = ? AND kind = ? AND algorithm = ?",
+            (dev, ino, kind, algorithm)).fetchone()
+        if row is None or row[0] != size or row[1] != mtime_ns:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touched.append((self.run, dev, ino, kind, algorithm))
+        if len(self._touched) >= WRITE_BATCH:
+            self.flush()
+        return row[2]
+
+    def put(self, signature: tuple, kind: str, algorithm: str, digest: str):
+        dev, ino, size, mtime_ns = signature
+        self._pending.append((dev, ino, kind, algorithm, size, mtime_ns, digest, self.run))
+        if len(self._pending) >= WRITE_BATCH:
+            self.flush()
+
+    def flush(self):
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self._pending)
+            self._db.executemany(
+                "UPDATE digests SET used = ? WHERE dev = ? AND ino = ? AND kind = ? AND algorithm = ?", self._touched)
+        self._pending.clear()
+        self._touched.clear()
+
+    def evict(self):
+        """Drops least recently used rows beyond max_entries"""
+        count = self._db.execute("SELECT COUNT(*) FROM digests").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            with self._db:
+                self._db.execute(
+                    "DELETE FROM digests WHERE rowid IN (SELECT rowid FROM digests ORDER BY used LIMIT ?)", (excess,))
+            log.debug(f"evicted {excess} entries from hash cache {self.path}")
+
+    def close(self):
+        self.flush()
+        self.evict()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,13 @@
+"""CLI subcommands. Modules are imported by renamer_cli.cli only when their command
+is invoked; library modules are imported by the command bodies, so --help and usage
+errors stay cheap."""
+import click
+
+
+class Command(click.Command):
+    """A command that configures logging right before running (not for --help)"""
+
+    def invoke(self, ctx):
+        from renamer.renamer_cli import setup_logging
+        setup_logging(ctx.find_root().params.get("log_config"))
+        return super().invoke(ctx)
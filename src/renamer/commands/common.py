@@ -0,0 +1,69 @@
+"""Helpers shared by the commands, imported when a command runs"""
+import re, time, logging, contextlib, collections
+from pathlib import Path
+from typing import Iterator
+from renamer import functions as func
+from renamer import journal as jrn
+from renamer import watch
+from renamer.executor import MoveResult
+from renamer.metadata import MetaStore
+
+log = logging.getLogger(__name__)
+
+
+def open_run_journal(directory: Path, operation: str, journal_format: str, clean: bool, wal: bool):
+    """Returns the journal path and a context manager for the run journal (a null one for 'clean' runs)"""
+    if wal and clean:
+        log.error("options --wal and -c/--clean are mutually exclusive")
+        exit(2)
+    if wal and journal_format == "yaml":
+        journal_format = "rnj"  # intents are only supported by binary journals
+    journal_path = jrn.journal_path(directory, operation, journal_format, int(time.time()))
+    return journal_path, contextlib.nullcontext() if clean else jrn.open_journal(journal_path, journal_format)
+
+
+def open_watch_state(state_path: str, watch_mode: bool) -> watch.WatchState:
+    """State of incremental runs (--state, --watch), None for full scans"""
+    if not state_path and not watch_mode:
+        return None
+    return watch.WatchState(Path(state_path) if state_path else None)
+
+
+def file_batches(directory: Path, pattern: re.Pattern, store: MetaStore, state: watch.WatchState,
+                 watch_mode: bool, interval: float, journal_path: Path, walk_filter: func.WalkFilter = None):
+    """The files to process: the whole tree, only the new ones with a state or,
+    with --watch, batches of new files as they arrive (never ending).
+    The run journals, written in the tree, are left out (the one of this run
+    and the ones of earlier runs), as the folders pruned by `walk_filter`."""
+    journal_path = journal_path.resolve()
+    if state:
+        state.ignore.add(str(journal_path))
+        state.journals.add(str(journal_path.parent))
+    if watch_mode:
+        log.info(f"watching '{directory}' for new files, CTRL+C to stop")
+        return watch.watch(directory, pattern, state, interval, walk_filter=walk_filter, store=store)
+    if state:
+        return [watch.new_files(directory, pattern, state, walk_filter, store)]
+    return [skip_journals(func.find_files(directory, pattern, store, walk_filter), journal_path)]
+
+
+def skip_journals(files: Iterator[Path], journal_path: Path) -> Iterator[Path]:
+    """`files` without the run journals of the folder `journal_path` is written in:
+    the one of this run and the ones of earlier runs, that restore still needs"""
+    folder = journal_path.resolve().parent
+    return (f for f in files if not (jrn.is_journal(f) and f.parent.resolve() == folder))
+
+
+def end_batch(state: watch.WatchState, store: MetaStore, results: Iterator[MoveResult]):
+    """Runs a batch to completion, consuming its `results` (None for dry runs), and
+    records the files written in the incremental state. Dry runs don't save it,
+    the files will be new for the next run as well."""
+    written = (r.dst for r in results if r.done) if results is not None else ()
+    if not state:
+        collections.deque(written, maxlen=0)
+        return
+    if results is not None:
+        state.record_outputs(written)
+        state.save()
+    if store is not None:
+        store.clear()
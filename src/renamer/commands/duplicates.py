@@ -0,0 +1,142 @@
+"""find-duplicates and dedupe commands"""
+import logging, contextlib, click
+from renamer import options as opt
+from renamer import defaults
+from renamer.commands import Command
+
+log = logging.getLogger(__name__)
+
+
+@click.command(name="find-duplicates", cls=Command, help="""Find duplicates in one or more folders\n
+Candidates are grouped by size, then by a partial hash of head/tail, then by a full content hash.
+The -m option tells at which stage to stop (size, partial, full).
+With -m dhash or -m phash similar images (resized, re-encoded...) are grouped instead: their perceptual
+hashes differ by at most --threshold bits (requires numpy and Pillow).
+All the folders are compared together: a group lists every copy, whatever folder it is in.
+
+i.e.: python renamer.py find-duplicates ./test ./test-2 /mnt/disk-3
+""")
+@click.argument("directories", nargs=-1, required=True, type=click.Path(exists=True, file_okay=False))
+@click.option('-e', '--exclude', help='folder/file names to exclude (part of the path). Can be repeated', multiple=True)
+@opt.walk_filter_opts()
+@click.option('-m', '--hash-mode', type=click.Choice(defaults.hash_modes + defaults.similar_modes, case_sensitive=False),
+    default="full", show_default=True, help='Last comparison stage: size only, partial (head/tail) hash or full hash; '
+    'dhash/phash for similar images')
+@click.option('--threshold', type=click.IntRange(min=0, max=16), default=6, show_default=True,
+    help='With -m dhash/phash, max number of different bits between similar images')
+@click.option('-a', '--algorithm', type=click.Choice(defaults.hash_algorithms, case_sensitive=False),
+    default="blake2b", show_default=True, help='Hash algorithm (xxhash requires the xxhash package)')
+@click.option('--cache', 'cache_path', type=click.Path(dir_okay=False), help='SQLite file caching digests between runs')
+@click.option('--cache-size', type=click.IntRange(min=1), default=defaults.DEFAULT_MAX_ENTRIES, show_default=True,
+    help='Max number of cached digests (least recently used are evicted)')
+@click.option('--shards', type=click.IntRange(min=1), default=1, show_default=True,
+    help='Hash candidates one size range at a time (N ranges), the walk is kept in a temporary file: '
+    'bounded memory for huge trees')
+@click.option('--processes', is_flag=True, default=False, help='Hash on a process pool instead of threads (CPU bound hashing)')
+@click.option('-o', '--output', type=click.Path(dir_okay=False), default="./diff.yaml", show_default=True,
+    help='Report file, a record per file of each group, written as groups are found')
+@click.option('-f', '--format', 'fmt', type=click.Choice(defaults.report_formats),
+    help='Report format (default: from OUTPUT extension, text otherwise: a line of paths per group)')
+@opt.jobs_opt()
+# @click.option('-s', '--show', type=click.Choice(["a", "b"], case_sensitive=False), default="b")
+@opt.clean_opt()
+def find_duplicates_command(
+    directories: tuple,
+    exclude: tuple,
+    exclude_dir: tuple,
+    include_dir: tuple,
+    names: tuple,
+    max_depth: int,
+    hash_mode: str,
+    threshold: int,
+    algorithm: str,
+    cache_path: str,
+    cache_size: int,
+    shards: int,
+    processes: bool,
+    output: str,
+    fmt: str,
+    jobs: int,
+    #show: str,
+    clean: bool
+):
+    from pathlib import Path
+    from renamer import functions as func
+    from renamer import hashing
+    from renamer import report
+    from renamer.cache import HashCache
+    from renamer.metadata import MetaStore
+
+    #filter = Path(directory_b) if show.lower() == "b" else Path(directory_a)
+    hash_mode = hash_mode.lower()
+    stats = hashing.HashStats()
+    cm = HashCache(Path(cache_path), cache_size) if cache_path else contextlib.nullcontext()
+    walk_filter = func.make_walk_filter(exclude_dir, include_dir, names, max_depth)
+    # sizes and inodes of the report come from the walk, files are stat'ed once
+    store = MetaStore()
+    try:
+        roots = func.distinct_roots(directories)
+        # No file for 'clean' runs
+        writer = report.ReportWriter(None if clean else Path(output), report.report_format(output, fmt), roots,
+            store)
+    except Exception as e:
+        log.error(str(e))
+        exit(2)
+    if clean: log.warning("CLEAN active: no journal created.")
+
+    with cm as cache, writer:
+        if hash_mode in hashing.similar_modes:
+            from renamer import similar
+            try:
+                groups = similar.find_similar(roots, exclude, hash_mode, threshold, stats, cache, jobs,
+                    walk_filter, store).items()
+            except Exception as e:
+                log.error(str(e))
+                exit(2)
+        else:
+            groups = func.iter_duplicates(roots, exclude, hash_mode, algorithm.lower(), stats, cache, jobs,
+                processes, store, walk_filter, shards)
+        # groups are written as they come, never collected
+        for (_, digest), files in groups:
+            log.debug(f"DUPLICATES: {', '.join(str(f) for f in files)}")
+            writer.write(hash_mode, digest, files)
+
+    if not clean:
+        log.info(f"report path: {output}")
+    log.info(f"HASH STATS [{hash_mode}]: {stats}")
+    log.info(f"DUPLICATES: {writer.groups} groups")
+    for root in roots:
+        root = str(root)
+        log.info(f" - {root}: {writer.copies[root]} copies, {writer.wasted[root]} bytes wasted")
+
+
+@click.command(name="dedupe", cls=Command, help="""Replaces duplicates with hardlinks or reflinks, from a find-duplicates report\n
+The report must be in jsonl or csv format and made with -m full: in each group the first file is
+kept, the other ones are replaced if they didn't change since the report and have the same bytes.
+Hardlinks only work within a filesystem, reflinks need Btrfs, XFS or another filesystem with clones.
+
+i.e.: python renamer.py dedupe --mode reflink ./duplicates.jsonl
+""")
+@click.argument("report_file", type=click.Path(exists=True, dir_okay=False))
+@click.option('--mode', type=click.Choice(defaults.dedupe_modes, case_sensitive=False), default="hardlink", show_default=True,
+    help='hardlink: copies become links to the kept file, reflink: copy on write clones (metadata kept)')
+@opt.dryrun_opt()
+@opt.quiet_opt()
+def dedupe_command(
+    report_file: str,
+    mode: str,
+    dryrun: bool,
+    quiet: bool,
+):
+    from pathlib import Path
+    from renamer import dedupe
+    from renamer import report
+
+    if dryrun:
+        log.warning("DRY_RUN active: nothing is replaced.")
+    try:
+        stats = dedupe.dedupe(report.read_report(Path(report_file)), mode.lower(), dryrun, quiet)
+    except Exception as e:
+        log.error(str(e))
+        exit(2)
+    log.info(f"DEDUPE STATS [{mode}]: {stats}")
@@ -0,0 +1,190 @@
+"""organize and run commands"""
+import re, logging, contextlib, click
+from renamer import options as opt
+from renamer import defaults
+from renamer.commands import Command
+
+log = logging.getLogger(__name__)
+
+
+@click.command(name="organize", cls=Command, help="""Creates folders based on:\n
+- time (if -t is set), with -s media the capture date of photos and videos
+- a piece of filename (if -e is set), several -e expressions are tried in order
+
+Files are moved in created folder, across filesystems they are copied (see --verify) then removed.
+Use restore with the journal to move them back and remove the created folders.
+
+i.e.: python renamer.py organize -d ./test -t MONTH
+""")
+@click.argument("directory", type=click.Path(exists=True, file_okay=False))
+@click.option('-o', '--output-folder', type=str, required=False, help='Output root folder (default is DIRECTORY value for in-place organization)')
+@click.option('-t', '--time-granularity', type=click.Choice(defaults.folder_time_matchers, 
+    case_sensitive=False), help='MONTH for YYYY/MM folders, YEAR for YYYY folders')
+@click.option('-e', '--expression', multiple=True,
+    help='The piece of file-name to use as folder-name. Can be repeated: the first matching expression wins')
+@click.option('-s', '--time-source', type=click.Choice(["birthtime", "media"], case_sensitive=False), default="birthtime",
+    show_default=True, help='media: capture date from JPEG/HEIC/MP4 headers when available, birthtime otherwise')
+@click.option('--cache', 'cache_path', type=click.Path(dir_okay=False), help='SQLite file caching capture dates between runs')
+@opt.quiet_opt()
+@opt.dryrun_opt()
+@opt.clean_opt()
+@opt.jobs_opt()
+@opt.journal_format_opt()
+@opt.wal_opt()
+@opt.spill_opt()
+@opt.state_opt()
+@opt.watch_opt()
+@opt.interval_opt()
+@opt.walk_filter_opts()
+@opt.verify_opt()
+def organize_folders_command(
+    directory: str,
+    output_folder: str,
+    dryrun: bool,
+    quiet: bool,
+    time_granularity: str,
+    expression: tuple,
+    time_source: str,
+    cache_path: str,
+    clean: bool,
+    jobs: int,
+    journal_format: str,
+    wal: bool,
+    spill_after: int,
+    verify: bool,
+    state_path: str,
+    watch_mode: bool,
+    interval: float,
+    exclude_dir: tuple,
+    include_dir: tuple,
+    names: tuple,
+    max_depth: int,
+):
+    from pathlib import Path
+    from renamer import api
+    from renamer.metadata import MetaStore
+    from renamer.cache import HashCache
+    from renamer.commands.common import open_run_journal, open_watch_state, file_batches, end_batch
+
+    directory = Path(directory)
+    output_folder = directory if not output_folder else Path(output_folder)
+    
+    if not time_granularity and not expression:
+        log.error(f"at least one of -t/--time-granularity or -e/--expression options must be set")
+        exit(2)
+    elif time_granularity and expression:
+        log.error(f"options -t/--time-granularity and -e/--expression are mutually exclusive")
+        exit(2)
+
+    criteria = "time" if time_granularity else "regex"
+    try:
+        # expressions are compiled once, as a single alternation
+        rule = api.OrganizeRule(output_folder, time_granularity, expression, time_source.lower())
+    except Exception as e:
+        log.error(str(e))
+        exit(2)
+
+    if not quiet:
+        log.info(f"you asked to create folders for  '{directory}' using method [{criteria}: {time_granularity or ', '.join(expression)}'] in target folder '{output_folder}'")
+
+    store = MetaStore() if rule.needs_stat else None
+    state = open_watch_state(state_path, watch_mode)
+    walk_filter = api.make_walk_filter(exclude_dir, include_dir, names, max_depth)
+    if dryrun:
+        log.warning("DRY_RUN active: only journal will be created")
+
+    journal_path, cm = open_run_journal(directory.resolve(), "organize", journal_format, clean, wal)
+    if clean: log.warning("CLEAN active: no journal created.")
+    cache_cm = HashCache(Path(cache_path)) if rule.uses_media and cache_path else contextlib.nullcontext()
+
+    with cm as out_file, cache_cm as cache:
+        for files in file_batches(directory, re.compile(".*"), store, state, watch_mode, interval, journal_path, walk_filter):
+            plan = api.validate(api.plan(files, [rule], store, jobs, cache), spill_after)
+
+            if not quiet:
+                log.debug("MATCHED FILES:")
+                for f,r in plan.changes():
+                    log.debug(f" - {f}: {r.parent.absolute()}")
+
+            if not quiet: log.info("STARTING ORGANIZATION:")
+            results = None
+            if dryrun:
+                for f, r in plan.changes():
+                    if not quiet: log.info(f" - moving {f.name} -> {r.parent.absolute()}")
+                    if out_file: out_file.append(f, r)
+            else:
+                # folders are created once, before any move
+                results = api.apply(plan, jobs, out_file, verify, quiet, intents=wal)
+            end_batch(state, store, results)
+        if not quiet: log.info(f"journal path: {journal_path}")
+
+
+@click.command(name="run", cls=Command, help="""Applies an ordered list of rename/prepend/organize rules (TOML file)\n
+The tree is walked once, each file goes through the whole chain of rules and is moved once
+to its final destination. Conflicts are resolved on the final names, one journal is written.
+
+i.e.: python renamer.py run ./nightly.toml ./test
+""")
+@click.argument("rules_file", type=click.Path(exists=True, dir_okay=False))
+@click.argument("directory", type=click.Path(exists=True, file_okay=False), required=False)
+@click.option('--cache', 'cache_path', type=click.Path(dir_okay=False), help='SQLite file caching capture dates between runs')
+@opt.quiet_opt()
+@opt.dryrun_opt()
+@opt.clean_opt()
+@opt.jobs_opt()
+@opt.journal_format_opt()
+@opt.wal_opt()
+@opt.spill_opt()
+@opt.verify_opt()
+def run_rules_command(
+    rules_file: str,
+    directory: str,
+    cache_path: str,
+    dryrun: bool,
+    quiet: bool,
+    clean: bool,
+    jobs: int,
+    journal_format: str,
+    wal: bool,
+    spill_after: int,
+    verify: bool,
+):
+    from pathlib import Path
+    from renamer import api
+    from renamer.metadata import MetaStore
+    from renamer.cache import HashCache
+    from renamer.commands.common import open_run_journal, skip_journals, end_batch
+
+    try:
+        directory, rules = api.load_rules(Path(rules_file), Path(directory) if directory else None)
+    except Exception as e:
+        log.error(str(e))
+        exit(2)
+    if not quiet:
+        log.info(f"you asked to apply {len(rules)} rules from '{rules_file}' to '{directory}'")
+
+    store = MetaStore() if any(r.needs_stat for r in rules) else None
+    use_media = any(getattr(r, "uses_media", False) for r in rules)
+    journal_path, cm = open_run_journal(directory, "run", journal_format, clean, wal)
+    if clean: log.warning("CLEAN active: no journal created, no rollback available.")
+    cache_cm = HashCache(Path(cache_path)) if use_media and cache_path else contextlib.nullcontext()
+
+    with cm as journal, cache_cm as cache:
+        files = skip_journals(api.scan(directory, store=store), journal_path)
+        plan = api.validate(api.plan(files, rules, store, jobs, cache), spill_after)
+        if not quiet:
+            log.debug("MATCHED FILES:")
+            for f, r in plan.changes():
+                log.debug(f" - {f} -> {r}")
+
+        if dryrun:
+            log.warning("DRY_RUN active: only journal created, no rename done.")
+            if journal:
+                for f, r in plan.changes():
+                    journal.append(f, r)
+        else:
+            if not quiet:
+                log.info("STARTING RULES:")
+            end_batch(None, None, api.apply(plan, jobs, journal, verify, quiet, intents=wal))
+    if not clean and not quiet:
+        log.info(f"journal path: {journal_path}")
@@ -0,0 +1,171 @@
+"""rename and prepend commands"""
+import logging, click
+from renamer import options as opt
+from renamer.commands import Command
+
+log = logging.getLogger(__name__)
+
+
+@click.command(name="rename", cls=Command, help="""Rename files given a matching-pattern and a replace-string\n
+With -e the replace-string can use $N or ${N} for regexp groups ($0 is the filename) and the tokens
+${date}, ${mtime}, ${size}, ${ext} and ${counter}; ${token:N} zero-pads to N digits.
+
+i.e.: python renamer.py rename -d ./test '_[0-9]{8}' 'some_string'
+""")
+@click.argument("directory", type=click.Path(exists=True, file_okay=False),)
+@click.argument("matcher", type=str)
+@click.argument("replace", type=str)
+@opt.regexp_option()
+@opt.clean_opt()
+@opt.dryrun_opt()
+@opt.quiet_opt()
+@opt.jobs_opt()
+@opt.journal_format_opt()
+@opt.wal_opt()
+@opt.spill_opt()
+@opt.state_opt()
+@opt.watch_opt()
+@opt.interval_opt()
+@opt.walk_filter_opts()
+def rename_files_command(
+    directory: str, 
+    matcher:str,
+    replace:str,
+    regexp: bool,
+    dryrun: bool,
+    quiet: bool,
+    clean: bool,
+    jobs: int,
+    journal_format: str,
+    wal: bool,
+    spill_after: int,
+    state_path: str,
+    watch_mode: bool,
+    interval: float,
+    exclude_dir: tuple,
+    include_dir: tuple,
+    names: tuple,
+    max_depth: int,
+):
+    from pathlib import Path
+    from renamer import api
+    from renamer.metadata import MetaStore
+    from renamer.commands.common import open_run_journal, open_watch_state, file_batches, end_batch
+
+    directory = Path(directory)
+    log.info(f"you asked to replace [regexp: {regexp}] '{matcher}' with '{replace}' in '{directory.absolute()}'")
+
+    if dryrun: log.warning("DRY_RUN active: only journal created, no rename done.")
+
+    try:
+        rule = api.RenameRule(matcher, replace, regexp)
+    except Exception as e:
+        log.error(str(e))
+        exit(2)
+    # metadata is collected by the walk only when the template needs it
+    store = MetaStore() if rule.needs_stat else None
+    state = open_watch_state(state_path, watch_mode)
+    walk_filter = api.make_walk_filter(exclude_dir, include_dir, names, max_depth)
+    journal_path, cm = open_run_journal(directory, "rename", journal_format, clean, wal)
+    if clean: log.warning("CLEAN active: no journal created, no rollback available.")
+
+    with cm as journal:
+        # files are streamed in sorted path order, no intermediate list
+        for files in file_batches(directory, rule.matcher, store, state, watch_mode, interval, journal_path, walk_filter):
+            plan = api.validate(api.plan(files, [rule], store), spill_after)
+
+            if not quiet:
+                log.debug("MATCHED FILES:")
+                for f, r in plan.changes():
+                    log.debug(f" - {f} -> {r.name}")
+
+            results = None
+            if dryrun:
+                if journal:
+                    for f, r in plan.changes():
+                        journal.append(f, r)
+            else:
+                if not quiet:
+                    log.info("STARTING RENAMING:")
+                results = api.apply(plan, jobs, journal, quiet=quiet, intents=wal)
+            end_batch(state, store, results)
+    if not clean:
+        log.info(f"journal path: {journal_path}")
+
+
+@click.command(name="prepend", cls=Command, help="""Prepends a string to matching filenames (matcher is threated as regexp)\n
+i.e.: python renamer.py prepend -d ./test '_[0-9]{8}' 'a_prefix'
+""")
+@click.argument("directory", type=click.Path(exists=True, file_okay=False),)
+@click.argument("matcher", type=str)
+@click.argument("prefix", type=str)
+@opt.clean_opt()
+@opt.dryrun_opt()
+@opt.quiet_opt()
+@opt.jobs_opt()
+@opt.journal_format_opt()
+@opt.wal_opt()
+@opt.spill_opt()
+@opt.state_opt()
+@opt.watch_opt()
+@opt.interval_opt()
+@opt.walk_filter_opts()
+def prepend_files_command(
+    directory: str, 
+    matcher:str,
+    prefix:str,
+    dryrun: bool,
+    quiet: bool,
+    clean: bool,
+    jobs: int,
+    journal_format: str,
+    wal: bool,
+    spill_after: int,
+    state_path: str,
+    watch_mode: bool,
+    interval: float,
+    exclude_dir: tuple,
+    include_dir: tuple,
+    names: tuple,
+    max_depth: int,
+):
+    from pathlib import Path
+    from renamer import api
+    from renamer.commands.common import open_run_journal, open_watch_state, file_batches, end_batch
+
+    directory = Path(directory)
+
+    if not quiet:
+        log.info(f"you asked to prepend '{prefix}' to '{matcher}' in '{directory.absolute()}'")
+
+    try:
+        rule = api.PrependRule(matcher, prefix)
+    except Exception as e:
+        log.error(str(e))
+        exit(2)
+    state = open_watch_state(state_path, watch_mode)
+    walk_filter = api.make_walk_filter(exclude_dir, include_dir, names, max_depth)
+    journal_path, cm = open_run_journal(directory, "rename", journal_format, clean, wal)
+    if clean: log.warning("CLEAN active: no journal created, no rollback available.")
+
+    with cm as journal:
+        for files in file_batches(directory, rule.matcher, None, state, watch_mode, interval, journal_path, walk_filter):
+            plan = api.validate(api.plan(files, [rule]), spill_after)
+            if not quiet:
+                log.debug("MATCHED FILES:")
+                for f, r in plan.changes():
+                    log.debug(f" - {f} -> {r.name}")
+
+            results = None
+            if dryrun:
+                log.warning("DRY_RUN active: only journal created, no rename done.")
+                if journal:
+                    for f, r in plan.changes():
+                        journal.append(f, r)
+            else:
+                if not quiet:
+                    log.info("STARTING PREPENDING:")
+                results = api.apply(plan, jobs, journal, quiet=quiet, intents=wal)
+            end_batch(state, None, results)
+    if not clean and not quiet:
+        log.info(f"journal path: {journal_path}")
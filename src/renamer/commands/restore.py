@@ -0,0 +1,116 @@
+"""restore, convert-journal and resume commands"""
+import os, logging, click
+from renamer import options as opt
+from renamer import defaults
+from renamer.commands import Command
+
+log = logging.getLogger(__name__)
+
+
+@click.command(name="restore", cls=Command, help="""Restores file renaming based on a journal file (Works only if folder was unmodified)\n
+The journal is read at once and replayed backwards: independent renames run in parallel
+(-j), a file is restored only if its original name is free. Folders created by organize
+are removed when empty. Any journal format is accepted.
+
+i.e.: python renamer.py restore -d ./test/journal.yaml'
+""")
+@opt.click.argument("journal", type=click.Path(exists=True, dir_okay=False))
+@opt.quiet_opt()
+@opt.dryrun_opt()
+@opt.jobs_opt()
+def restore_files_command(
+    journal:str,
+    dryrun: bool,
+    quiet: bool,
+    jobs: int,
+):
+    from renamer import api
+
+    if not quiet:
+        log.info(f"you asked to restore '{journal}' [d:{dryrun}, q:{quiet}]")
+    if not os.path.exists(journal) or os.path.isdir(journal):
+        log.error(f"{journal} is not a valid file!")
+        exit(2)
+
+    if dryrun:
+        log.warning("DRY_RUN active: only journal created, no rename done.")
+
+    api.restore(journal, jobs, quiet, dryrun)
+
+
+@click.command(name="convert-journal", cls=Command, help="""Converts a journal (i.e. a legacy .yaml one) to another format\n
+i.e.: python renamer.py convert-journal ./test/journal.yaml ./test/journal.rnj
+""")
+@click.argument("journal", type=click.Path(exists=True, dir_okay=False))
+@click.argument("output", type=click.Path(dir_okay=False))
+@click.option('-f', '--format', 'fmt', type=click.Choice(defaults.journal_formats),
+    help='Output journal format (default: from OUTPUT extension, rnj otherwise)')
+def convert_journal_command(
+    journal: str,
+    output: str,
+    fmt: str,
+):
+    from pathlib import Path
+    from renamer import journal as jrn
+
+    if not fmt:
+        fmt = next((f for f in jrn.journal_formats[::-1] if output.endswith(f".{f}")), "rnj")
+    count = jrn.convert_journal(Path(journal), Path(output), fmt)
+    log.info(f"converted {count} entries to {output}")
+
+
+@click.command(name="resume", cls=Command, help="""Resumes an interrupted rename/prepend/organize run from its write-ahead journal (--wal)\n
+Only the planned moves without an applied record are considered, the tree is not walked again.
+
+i.e.: python renamer.py resume ./test/rename-journal_test_1677664708.rnj
+""")
+@click.argument("journal", type=click.Path(exists=True, dir_okay=False))
+@opt.quiet_opt()
+@opt.dryrun_opt()
+@opt.jobs_opt()
+def resume_command(
+    journal: str,
+    dryrun: bool,
+    quiet: bool,
+    jobs: int,
+):
+    from pathlib import Path
+    from renamer import executor
+    from renamer import journal as jrn
+
+    journal = Path(journal)
+    fmt = jrn.detect_format(journal)
+    if fmt == "yaml":
+        log.error(f"{journal} is not a write-ahead journal!")
+        exit(2)
+
+    staging, moves = jrn.read_pending(journal)
+    if not quiet:
+        log.info(f"you asked to resume '{journal}': {len(staging) + len(moves)} pending moves")
+
+    with jrn.open_journal(journal, fmt, resume=True) as out_file:
+        # moves applied before the crash but not yet recorded are recorded now
+        pending = []
+        for moves_map in (staging, moves):
+            # temporary names are created by the staging moves still to do
+            staged = {str(r) for todo in pending for r in todo.values()}
+            todo = {}
+            for f, r in moves_map.items():
+                if f in staged or os.path.lexists(f):
+                    todo[Path(f)] = Path(r)
+                elif os.path.lexists(r):
+                    if not dryrun: out_file.append(f, r)
+                else:
+                    log.warning(f" - skipping {f} [doesn't exist]")
+            pending.append(todo)
+
+        if dryrun:
+            log.warning("DRY_RUN active: no rename done.")
+            for todo in pending:
+                for f, r in todo.items():
+                    log.info(f" - renaming {f} -> {r}")
+            return
+
+        executor.make_folders({r.parent for todo in pending for r in todo.values()}, jobs, True, out_file)
+        for todo in pending:
+            executor.apply_moves(todo, jobs, quiet, out_file)
@@ -0,0 +1,119 @@
+import os, errno, shutil, filecmp, logging
+from pathlib import Path
+from typing import Iterable
+from renamer.defaults import dedupe_modes
+from renamer.metrics import metrics, timed
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, reflinks are Linux only anyway
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+FICLONE = 0x40049409  # linux/fs.h: the target shares the extents of the source
+_NO_CLONE = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL}
+
+
+class DedupeStats:
+    __slots__ = ("linked", "bytes_saved", "skipped")
+
+    def __init__(self):
+        self.linked = 0
+        self.bytes_saved = 0
+        self.skipped = 0
+
+    def __str__(self):
+        return f"linked: {self.linked}, saved: {self.bytes_saved} bytes, skipped: {self.skipped}"
+
+
+def link_copy(keep: Path, copy: Path):
+    """Replaces `copy` with a hardlink to `keep` (same filesystem only)"""
+    temp = copy.with_name(f".{copy.name}.dedupe")
+    os.link(keep, temp)
+    try:
+        os.replace(temp, copy)
+    except OSError:
+        os.remove(temp)
+        raise
+
+
+def clone_copy(keep: Path, copy: Path):
+    """Replaces `copy` with a reflink (copy on write clone) of `keep`, keeping the
+    metadata of `copy`. Fails on filesystems without reflinks, no data is copied."""
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported on this platform")
+    temp = copy.with_name(f".{copy.name}.dedupe")
+    fd_in = os.open(keep, os.O_RDONLY)
+    try:
+        fd_out = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            fcntl.ioctl(fd_out, FICLONE, fd_in)
+        finally:
+            os.close(fd_out)
+        shutil.copystat(copy, temp)
+        os.replace(temp, copy)
+    except OSError:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+    finally:
+        os.close(fd_in)
+
+
+@timed("dedupe")
+def dedupe(groups: Iterable[tuple[str, list[dict]]], mode: str = "hardlink", dryrun: bool = False,
+           quiet: bool = False) -> DedupeStats:
+    """Replaces the copies of each group of a find-duplicates report (see
+    report.read_report) with links to the first file of the group. Only groups
+    of full content hashes are considered; a copy is linked only if it is still
+    the file of the report (inode, size) and its bytes match the kept file."""
+    if mode not in dedupe_modes:
+        raise Exception(f"Invalid dedupe mode {mode}")
+    action = link_copy if mode == "hardlink" else clone_copy
+    stats = DedupeStats()
+    for kind, records in groups:
+        if kind != "full":
+            log.warning(f"skipping a group of {len(records)} files: '{kind}' groups are not verified duplicates")
+            stats.skipped += len(records)
+            continue
+        keep = Path(records[0]["path"])
+        try:
+            kept = keep.stat()
+        except OSError as e:
+            log.warning(f"skipping the copies of '{keep}': {e}")
+            stats.skipped += len(records) - 1
+            continue
+        freed = set()  # copies hardlinked together free their bytes once
+        for r in records[1:]:
+            copy = Path(r["path"])
+            try:
+                st = copy.stat()
+                if (st.st_dev, st.st_ino) == (kept.st_dev, kept.st_ino):
+                    continue  # already a hardlink of the kept file
+                if (st.st_ino, st.st_size) != (r["inode"], r["size"]) or st.st_size != kept.st_size:
+                    raise Exception("changed since the report")
+                if mode == "hardlink" and st.st_dev != kept.st_dev:
+                    raise Exception("on another filesystem")
+                if not filecmp.cmp(keep, copy, shallow=False):
+                    raise Exception(f"content differs from '{keep}'")
+                if not dryrun:
+                    action(keep, copy)
+            except OSError as e:
+                reason = "no reflink support" if mode == "reflink" and e.errno in _NO_CLONE else e
+                log.warning(f"can't {mode} '{copy}': {reason}")
+                stats.skipped += 1
+                continue
+            except Exception as e:
+                log.warning(f"can't {mode} '{copy}': {e}")
+                stats.skipped += 1
+                continue
+            if not quiet:
+                log.info(f" - {copy} -> {mode} of {keep}")
+            stats.linked += 1
+            if (st.st_dev, st.st_ino) not in freed:
+                freed.add((st.st_dev, st.st_ino))
+                stats.bytes_saved += st.st_size
+    metrics.add("files_deduped", stats.linked)
+    metrics.add("bytes_saved", stats.bytes_saved)
+    return stats
@@ -1,4 +1,16 @@
 # Define your programmatic "hardcoded" default config here
+
+# choices and defaults of the command options: kept here, so that --help doesn't
+# import the modules using them
+folder_time_matchers = ["MONTH", "YEAR"]
+journal_formats = ["yaml", "rnj", "rnj.gz"]
+hash_modes = ["size", "partial", "full"]
+similar_modes = ["dhash", "phash"]  # perceptual hashes of images, see similar.find_similar
+hash_algorithms = ["blake2b", "xxhash"]
+report_formats = ["text", "jsonl", "csv"]
+dedupe_modes = ["hardlink", "reflink"]
+DEFAULT_MAX_ENTRIES = 5_000_000  # digests kept by the hash cache
+
 DEFAULT_LOGGING_DICT = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -21,5 +33,8 @@ DEFAULT_LOGGING_DICT = {
             "level": "DEBUG",
             "handlers": ["consoleHandler"],
         },
+        "PIL": {  # Pillow logs every plugin it loads at DEBUG level
+            "level": "INFO",
+        },
     },
-}
\ No newline at end of file
+}
@@ -0,0 +1,404 @@
+import os, stat, errno, shutil, logging, threading
+from pathlib import Path
+from collections import deque
+from typing import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from renamer import hashing
+from renamer.metrics import metrics, timed, Progress
+
+log = logging.getLogger(__name__)
+
+CHUNK = 10000
+WINDOW = 4  # moves in flight per worker, ahead of the consumer
+COPY_BUFFER = 1024 * 1024
+# errors telling that a zero-copy syscall can't be used for these files
+_NO_ZERO_COPY = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSOCK, errno.EBADF}
+
+
+def plan_waves(moves: dict[Path, Path]) -> tuple[list[list[Path]], list[Path]]:
+    """Splits moves in waves that can run concurrently.
+
+    A move whose target is the source of another move must wait for that move,
+    so it goes in a later wave. Moves that are part of a cycle (a->b, b->a) can't
+    be ordered and are returned apart. Sources keep the moves order inside a wave.
+    """
+    level = {}
+    for src in moves:
+        # follow the chain until a target that is not a pending source
+        chain = []
+        cur = src
+        while cur in moves and cur not in level and cur not in chain:
+            chain.append(cur)
+            cur = moves[cur]
+        if cur in chain:
+            base = None  # cycle
+        elif cur in level:
+            base = level[cur]
+        else:
+            base = -1
+        for s in reversed(chain):
+            if base is not None:
+                base += 1
+            level[s] = base
+
+    waves = []
+    cycles = []
+    for src in moves:
+        lvl = level[src]
+        if lvl is None:
+            cycles.append(src)
+            continue
+        while len(waves) <= lvl:
+            waves.append([])
+        waves[lvl].append(src)
+    return waves, cycles
+
+
+def move_file(src: Path, target: Path, verify: bool = False) -> bool:
+    """Renames src to target. When they are on different filesystems (EXDEV) the
+    file is copied (zero-copy where possible) and the source removed once the
+    copy is complete. Returns True when the file was copied."""
+    try:
+        os.rename(src, target)
+        return False
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    copy_file(src, target, verify)
+    os.unlink(src)
+    return True
+
+
+def copy_file(src: Path, target: Path, verify: bool = False):
+    """Copies src to a temporary name next to target, then renames it in place,
+    so target is either missing or complete. With `verify` the content of both
+    files is hashed and compared before the rename."""
+    tmp = Path(target).with_name(f".renamer-copy-{Path(target).name}")
+    with open(src, "rb", buffering=0) as fin:
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            with open(fd, "wb", buffering=0) as fout:
+                stream_copy(fin.fileno(), fout.fileno(), os.fstat(fin.fileno()).st_size)
+                os.fsync(fout.fileno())
+            shutil.copystat(src, tmp)
+            if verify and hashing.full_digest(src, "blake2b") != hashing.full_digest(tmp, "blake2b"):
+                raise OSError(errno.EIO, f"copy of '{src}' doesn't match the source")
+            os.replace(tmp, target)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+
+def stream_copy(fd_in: int, fd_out: int, size: int) -> int:
+    """Copies `size` bytes with copy_file_range (in kernel, reflinks where the
+    filesystem supports them), then sendfile, then a plain read/write loop."""
+    done = 0
+    copy_range = getattr(os, "copy_file_range", None)
+    sendfile = getattr(os, "sendfile", None)
+    while done < size:
+        try:
+            if copy_range:
+                n = copy_range(fd_in, fd_out, size - done, done, done)
+            else:
+                # the other methods use the file positions of the output (or both)
+                os.lseek(fd_out, done, os.SEEK_SET)
+                if sendfile:
+                    n = sendfile(fd_out, fd_in, done, size - done)
+                else:
+                    os.lseek(fd_in, done, os.SEEK_SET)
+                    n = os.write(fd_out, os.read(fd_in, min(COPY_BUFFER, size - done)))
+        except OSError as e:
+            if e.errno not in _NO_ZERO_COPY or not (copy_range or sendfile):
+                raise
+            # fall back to the next method for the rest of the file
+            if copy_range:
+                copy_range = None
+            else:
+                sendfile = None
+            continue
+        if n == 0:  # the source got shorter
+            break
+        done += n
+    return done
+
+
+@timed("mkdir")
+def make_folders(folders, jobs: int = 1, quiet: bool = False, journal=None):
+    """Creates the given folders once each (deepest ones only, parents are implied).
+    Every folder created, parents included, is recorded in `journal` so that
+    restore can remove it."""
+    folders = set(folders)
+    leaves = {f for f in folders if f not in {p for g in folders for p in g.parents}}
+    missing = [f for f in sorted(leaves) if not f.is_dir()]
+    created = {}
+    for folder in missing:
+        # parents are checked before any folder is created
+        for p in (folder, *folder.parents):
+            if p in created or p.is_dir():
+                break
+            created[p] = None
+
+    def mkdir(folder: Path):
+        folder.mkdir(parents=True, exist_ok=True)
+        if not quiet: log.info(f"CREATED FOLDER: {folder.absolute()}")
+
+    with ThreadPoolExecutor(jobs) as pool:
+        list(pool.map(mkdir, missing))
+    if journal:
+        for folder in sorted(created):
+            if folder.is_dir():
+                journal.mkdir(folder)
+    metrics.add("folders_created", len(missing))
+
+
+def restore_waves(moves: list[tuple]) -> list[list[tuple]]:
+    """Groups (current, original) moves, given in replay order, in waves of
+    independent moves: a move waits for the last earlier move vacating its
+    target and for the one that put its file in place. Unlike plan_waves this
+    never sees cycles, a path reused by the run (i.e. temporary names) is just
+    a later wave."""
+    vacated = {}  # path -> wave of the last move from it
+    filled = {}   # path -> wave of the last move to it
+    waves = []
+    for move in moves:
+        src, dst = move
+        level = max(vacated.get(dst, -1), filled.get(src, -1)) + 1
+        vacated[src] = level
+        filled[dst] = level
+        if level == len(waves):
+            waves.append([])
+        waves[level].append(move)
+    return waves
+
+
+@timed("restore")
+def restore_moves(moves: list[tuple], jobs: int = 1, quiet: bool = False, dryrun: bool = False) -> int:
+    """Moves files back, wave by wave on `jobs` worker threads. A file is moved
+    only if it's still a regular file and its original name is free (unless
+    `dryrun`). Returns the number of restored files."""
+    def restore(move: tuple) -> bool:
+        src, dst = move
+        try:
+            # a single stat tells both existence and type
+            if not stat.S_ISREG(os.stat(src).st_mode):
+                if not quiet: log.info(f" - skipping {src} [not a file]")
+                return False
+        except FileNotFoundError:
+            if not quiet: log.info(f" - skipping {src} [doesn't exist]")
+            return False
+        if not dryrun and os.path.lexists(dst):
+            log.warning(f" - skipping {src}: '{dst}' already exists")
+            return False
+        if not quiet: log.info(f" - renaming {src} -> {os.path.basename(dst)}")
+        if dryrun:
+            return True
+        try:
+            # a move to another filesystem is a copy back
+            move_file(Path(src), Path(dst))
+            return True
+        except OSError as e:
+            log.error(f" - an error occurred while restoring {src}: {e}")
+            return False
+
+    progress = Progress(len(moves), "restored", float("inf") if quiet else 5.0)
+    restored = 0
+    with ThreadPoolExecutor(jobs) as pool:
+        for wave in restore_waves(moves):
+            for ok in pool.map(restore, wave):
+                restored += ok
+                progress.update()
+    if not quiet: progress.finish()
+    metrics.add("restored", restored)
+    metrics.add("skipped", len(moves) - restored)
+    return restored
+
+
+def remove_folders(folders, quiet: bool = False, dryrun: bool = False) -> int:
+    """Removes the given folders when empty, deepest first. A dry run removes
+    nothing, but reports the folders that would be removed."""
+    removed = 0
+    gone = set()  # dry run: folders that would be removed, their parents can be too
+    for folder in sorted(set(folders), key=lambda f: len(Path(f).parts), reverse=True):
+        try:
+            if not dryrun:
+                os.rmdir(folder)
+            else:
+                with os.scandir(folder) as it:
+                    if any(entry.path not in gone for entry in it):
+                        raise OSError(f"{folder} is not empty")
+                gone.add(os.path.join(os.path.dirname(folder), os.path.basename(folder)))
+            removed += 1
+            if not quiet: log.info(f" - removed folder {folder}")
+        except FileNotFoundError:
+            pass
+        except OSError:
+            if not quiet: log.info(f" - keeping folder {folder} [not empty]")
+    metrics.add("folders_removed", removed)
+    return removed
+
+
+class MoveResult:
+    """Outcome of a planned move: `src` is moved to `dst` (`origin` is the original
+    path when src is a temporary name), `copied` when across filesystems"""
+
+    __slots__ = ("src", "dst", "origin", "done", "copied", "error")
+
+    def __init__(self, src: Path, dst: Path, origin: Path = None, done: bool = False, copied: bool = False,
+                 error: str = None):
+        self.src = src
+        self.dst = dst
+        self.origin = origin if origin is not None else src
+        self.done = done
+        self.copied = copied
+        self.error = error
+
+    def __repr__(self):
+        return f"MoveResult({self.origin} -> {self.dst}, done={self.done}, error={self.error!r})"
+
+
+def apply_plan(plan, jobs: int = 1, quiet: bool = False, journal=None, verify: bool = False) -> dict[Path, bool]:
+    """Applies a functions.RenamePlan, returns the outcome of every move (see iter_plan)"""
+    return {r.src: r.done for r in iter_plan(plan, jobs, quiet, journal, verify)}
+
+
+def iter_plan(plan, jobs: int = 1, quiet: bool = False, journal=None, verify: bool = False) -> Iterator[MoveResult]:
+    """Applies a functions.RenamePlan: cycle breakers first, then the other moves.
+    Targets were already checked by the planner, so no per-file exists() is done.
+    Moves to another filesystem are copies (see move_file), checked with `verify`.
+
+    Moves whose target is not the source of another move can run in any order:
+    they are streamed from the plan in chunks of CHUNK. The chained ones (few)
+    run last, ordered in waves. Results are yielded as moves complete.
+    """
+    staged = apply_moves(plan.staging, jobs, True, journal, check_target=False)
+    # a source whose temporary rename failed is still in place: the moves into it,
+    # and transitively the rest of its cycle, are cancelled (targets aren't checked)
+    failed = {src for src, ok in staged.items() if not ok}
+    chunk = {}
+    chained = {}
+    for src, ren in plan.moves.items():
+        origin = plan.origins.get(src)
+        if origin in failed:
+            yield MoveResult(src, ren, origin, error="temporary rename failed")
+            continue
+        if ren in failed:
+            failed.add(src)
+            log.warning(f"can't rename '{src}' to '{ren}': '{ren}' was not moved")
+            yield MoveResult(src, ren, origin, error=f"'{ren}' was not moved")
+            continue
+        if src in plan.chained:
+            chained[src] = ren
+            continue
+        chunk[src] = ren
+        if len(chunk) >= CHUNK:
+            yield from _track(iter_moves(chunk, jobs, quiet, journal, False, plan.origins, verify), failed)
+            chunk = {}
+    yield from _track(iter_moves(chunk, jobs, quiet, journal, False, plan.origins, verify), failed)
+
+    # chained moves into a file that stayed in place are cancelled, up the chain
+    by_target = {ren: src for src, ren in chained.items()}
+    blocked = [ren for ren in by_target if ren in failed]
+    while blocked:
+        ren = blocked.pop()
+        src = by_target.pop(ren, None)
+        if src is None:
+            continue
+        del chained[src]
+        failed.add(src)
+        log.warning(f"can't rename '{src}' to '{ren}': '{ren}' was not moved")
+        yield MoveResult(src, ren, plan.origins.get(src), error=f"'{ren}' was not moved")
+        blocked.append(src)
+    yield from iter_moves(chained, jobs, quiet, journal, False, plan.origins, verify)
+
+
+def _track(results: Iterator[MoveResult], failed: set) -> Iterator[MoveResult]:
+    for r in results:
+        if not r.done:
+            failed.add(r.src)
+        yield r
+
+
+def apply_moves(moves: dict[Path, Path], jobs: int = 1, quiet: bool = False, journal=None,
+                check_target: bool = True, origins: dict[Path, Path] = None, verify: bool = False) -> dict[Path, bool]:
+    """Renames every source to its target, returns the outcome of every move in
+    the moves order (see iter_moves)"""
+    done = dict.fromkeys(moves, False)
+    for r in iter_moves(moves, jobs, quiet, journal, check_target, origins, verify):
+        done[r.src] = r.done
+    return done
+
+
+@timed("rename")
+def iter_moves(moves: dict[Path, Path], jobs: int = 1, quiet: bool = False, journal=None,
+               check_target: bool = True, origins: dict[Path, Path] = None, verify: bool = False) -> Iterator[MoveResult]:
+    """Renames every source to its target using `jobs` worker threads.
+
+    Waves from plan_waves run one after the other, moves inside a wave run
+    concurrently. Every applied move is appended to `journal` (a
+    journal.JournalWriter) as soon as it is done, so the journal keeps the
+    execution order and can be replayed backwards. Results are yielded in the
+    wave order; at most WINDOW moves per worker run ahead of the consumer.
+    """
+    origins = origins or {}
+    waves, cycles = plan_waves(moves)
+    for src in cycles:
+        log.warning(f"can't rename '{src}' to '{moves[src]}': circular renaming")
+        yield MoveResult(src, moves[src], origins.get(src), error="circular renaming")
+
+    done = {}
+    lock = threading.Lock()
+
+    def move(src: Path) -> MoveResult:
+        target = moves[src]
+        result = MoveResult(src, target, origins.get(src))
+        if not quiet: log.info(f" - renaming {result.origin} -> {target.name}")
+        if target in moves and not done.get(target, True):
+            # the file in the way couldn't be moved (its wave already ran)
+            result.error = f"'{target}' was not moved"
+            log.warning(f"can't rename '{src}' to '{target}': {result.error}")
+            return result
+        try:
+            if check_target and target.exists():
+                result.error = "destination already exists"
+                log.warning(f"can't rename '{src}' to '{target}': destination already exists!")
+                return result
+            result.copied = move_file(src, target, verify)
+        except OSError as e:
+            result.error = str(e)
+            log.error(f"can't rename '{src}' to '{target}': {e}")
+            return result
+        result.done = True
+        if journal:
+            with lock:
+                journal.append(src, target)
+        return result
+
+    renamed = copied = skipped = 0
+    try:
+        with ThreadPoolExecutor(jobs) as pool:
+            for wave in waves:
+                for result in _bounded_map(pool, move, wave, jobs * WINDOW):
+                    done[result.src] = result.done
+                    renamed += result.done
+                    copied += result.copied
+                    skipped += not result.done
+                    yield result
+    finally:
+        metrics.add("renamed", renamed)
+        metrics.add("skipped", skipped + len(cycles))
+        metrics.add("copied", copied)
+
+
+def _bounded_map(pool, fn, items, window: int) -> Iterator:
+    """pool.map keeping at most `window` calls in flight, so a slow consumer
+    slows the workers down instead of piling up results"""
+    pending = deque()
+    for item in items:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(pool.submit(fn, item))
+    while pending:
+        yield pending.popleft().result()
@@ -1,10 +1,20 @@
-import os, re, datetime
+import os, re, fnmatch, datetime, logging, contextlib, itertools, functools, queue, threading
 from pathlib import Path
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+from renamer import hashing
+from renamer.cache import HashCache
+from renamer.defaults import folder_time_matchers
+from renamer.metadata import MetaStore, file_meta
+from renamer.metrics import metrics, timed
+from renamer.pathmap import PathMap, FolderTable
+from renamer.sizeindex import SizeIndex
+
+log = logging.getLogger(__name__)
 
 
 params_pattern = re.compile("(\\$)([0-9]+|\\{date\\})", re.DOTALL)
-folder_time_matchers = ["MONTH", "YEAR"]
 
 
 def compile_matcher(matcher: str, regexp: bool):
@@ -14,12 +24,141 @@ def compile_matcher(matcher: str, regexp: bool):
         return re.compile(f"(.*)({matcher})(.*)", re.IGNORECASE)
 
 
-def find_files(base: Path, pattern: re.Pattern = re.compile(".*")) -> lsit(Path):
-    return [
-        path.resolve()
-        for path in base.rglob("*")
-        if path.is_file() and pattern.match(path.name)
-    ]
+class WalkFilter:
+    """Rules applied by walk_files while walking, before any stat:
+
+    - exclude: folder globs, an excluded folder is never entered
+    - include: folder globs, files are taken only in matching folders (and below),
+      folders that can't lead to a matching one are not entered
+    - names: file name globs, the other files are skipped
+    - max_depth: folder levels walked below the base (0: only the base folder)
+    - substrings: folders and files whose absolute path contains one of them
+      (lower case) are left out, as find-duplicates' -e always did
+
+    Globs with a '/' are matched against the path relative to the base, the
+    others against the name. Matching is case insensitive.
+    """
+
+    __slots__ = ("spec", "max_depth", "substrings", "root_inside", "_exclude_name", "_exclude_path",
+                 "_include_name", "_include_path", "_include_parts", "_names")
+
+    def __init__(self, exclude=(), include=(), names=(), max_depth: int = None, substrings=()):
+        self.spec = (tuple(exclude), tuple(include), tuple(names), max_depth)
+        self.max_depth = max_depth
+        self.substrings = [s.lower() for s in substrings]
+        self._exclude_name, self._exclude_path = _split_globs(exclude)
+        self._include_name, self._include_path = _split_globs(include)
+        # per include path glob, a matcher per level, to know which folders can lead to it
+        self._include_parts = [[_glob(p) for p in g.strip("/").split("/")] for g in include if "/" in g.strip("/")]
+        self._names = _glob(*names) if names else None
+        self.root_inside = not include
+
+    def with_substrings(self, substrings) -> "WalkFilter":
+        return WalkFilter(*self.spec, substrings=list(self.substrings) + list(substrings))
+
+    def folder(self, path: str, rel: str, name: str, depth: int, inside: bool) -> bool:
+        """None if the folder is not entered, otherwise whether its files are taken"""
+        if self.max_depth is not None and depth > self.max_depth:
+            return None
+        if (self._exclude_name and self._exclude_name(name)) or (self._exclude_path and self._exclude_path(rel)):
+            return None
+        if self.substrings and _contains(path, self.substrings):
+            return None
+        if inside or (self._include_name and self._include_name(name)) or \
+                (self._include_path and self._include_path(rel)):
+            return True
+        if self._include_name:
+            return False  # a matching folder can be anywhere below
+        parts = rel.split("/")
+        for globs in self._include_parts:
+            if len(globs) > depth and all(g(p) for g, p in zip(globs, parts)):
+                return False
+        return None
+
+    def file(self, path: str, name: str) -> bool:
+        if self._names and not self._names(name):
+            return False
+        return not (self.substrings and _contains(path, self.substrings))
+
+
+def make_walk_filter(exclude=(), include=(), names=(), max_depth: int = None, substrings=()) -> WalkFilter:
+    """A WalkFilter, None when there is no rule (the walk is not filtered)"""
+    if not (exclude or include or names or substrings) and max_depth is None:
+        return None
+    return WalkFilter(exclude, include, names, max_depth, substrings)
+
+
+def _glob(*patterns: str):
+    return re.compile("|".join(fnmatch.translate(p) for p in patterns), re.IGNORECASE).match
+
+
+def _split_globs(patterns) -> tuple:
+    names = [p for p in patterns if "/" not in p.strip("/")]
+    paths = [p.strip("/") for p in patterns if "/" in p.strip("/")]
+    return (_glob(*names) if names else None), (_glob(*paths) if paths else None)
+
+
+def _contains(path: str, substrings: list) -> bool:
+    path = path.lower()
+    return any(s in path for s in substrings)
+
+
+def walk_files(base: Path, pattern: re.Pattern = None, walk_filter: WalkFilter = None) -> Iterator[os.DirEntry]:
+    """Walks `base` with os.scandir yielding file entries whose name matches `pattern`.
+
+    Entries are yielded in sorted path order, one directory listing at a time, so
+    callers can consume them without holding the whole tree in memory. Symlinked
+    folders are not followed (as in Path.rglob). With a `walk_filter` pruned
+    folders are never listed and file names are checked before any stat.
+    """
+    inside = walk_filter.root_inside if walk_filter else True
+    stack = [(_sorted_entries(os.fspath(base)), "", 0, inside)]
+    while stack:
+        entries, rel, depth, inside = stack[-1]
+        entry = next(entries, None)
+        if entry is None:
+            stack.pop()
+            continue
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                if walk_filter is None:
+                    stack.append((_sorted_entries(entry.path), rel, depth, inside))
+                    continue
+                sub = f"{rel}/{entry.name}" if rel else entry.name
+                sub_inside = walk_filter.folder(entry.path, sub, entry.name, depth + 1, inside)
+                if sub_inside is None:
+                    metrics.add("dirs_pruned")
+                else:
+                    stack.append((_sorted_entries(entry.path), sub, depth + 1, sub_inside))
+            elif inside and (pattern is None or pattern.match(entry.name)) and \
+                    (walk_filter is None or walk_filter.file(entry.path, entry.name)) and entry.is_file():
+                yield entry
+        except OSError as e:
+            log.warning(f"skipping '{entry.path}': {e}")
+
+
+def _sorted_entries(folder: str) -> Iterator[os.DirEntry]:
+    try:
+        with os.scandir(folder) as it:
+            entries = list(it)
+    except OSError as e:
+        log.warning(f"can't read folder '{folder}': {e}")
+        return iter(())
+    metrics.add("dirs_scanned")
+    metrics.add("entries_scanned", len(entries))
+    entries.sort(key=lambda e: e.name)
+    return iter(entries)
+
+
+def find_files(base: Path, pattern: re.Pattern = re.compile(".*"), store: MetaStore = None,
+               walk_filter: WalkFilter = None) -> Iterator[Path]:
+    """Yields matching files, recording their metadata in `store` if provided"""
+    # base is resolved once, children paths are built from it (no per-file resolve)
+    for entry in walk_files(Path(base).resolve(), pattern, walk_filter):
+        path = Path(entry.path)
+        if store is not None:
+            store.add(path, entry.stat())
+        yield path
 
 
 def rename_filename(file: Path, matcher: re.Pattern, replace_str: str) -> Path:
@@ -28,27 +167,93 @@ def rename_filename(file: Path, matcher: re.Pattern, replace_str: str) -> Path:
         return file
 
     rename = f"{m.group(1)}{replace_str}{m.group(3)}"
-    return file.parent.joinpath(rename).resolve()
+    return _join_name(file, rename)
 
 
-def rename_filename_regex(file: Path, matcher: re.Pattern, replace_str: str) -> Path:
+def rename_filename_regex(file: Path, matcher: re.Pattern, replace_str, store: MetaStore = None) -> Path:
+    """`replace_str` is a ReplaceTemplate or a string (compiled on the fly, counters restart).
+    Metadata tokens read the file metadata from `store` when provided."""
     m = matcher.match(file.name)
     if m is None:
         return file
 
-    params_in_replace_str = extract_params(replace_str)
-    rename = replace_str
-
-    for par in params_in_replace_str:
-        if par == "{date}":
-            date = datetime.datetime.fromtimestamp(file.stat().st_birthtime)
-            rename = rename.replace("${date}", date.strftime("%Y%m%d_%H%M%S"))
+    template = replace_str if isinstance(replace_str, ReplaceTemplate) else compile_template(replace_str)
+    return _join_name(file, template.render(file, m, store))
+
+
+def _join_name(file: Path, name: str) -> Path:
+    # file comes resolved from find_files: resolving again is needed only for names with folders
+    target = file.parent.joinpath(name)
+    return target.resolve() if os.sep in name or (os.altsep and os.altsep in name) else target
+
+
+# Replace templates: $N or ${N} for regexp groups ($0 is the whole filename) and
+# ${token} / ${token:N} for file metadata, N being the zero-padding width
+template_pattern = re.compile(r"\$(?:([0-9]+)|\{([0-9]+|[a-z]+)(?::([0-9]+))?\})")
+template_tokens = ["date", "mtime", "size", "ext", "counter"]
+_LITERAL, _GROUP, _TOKEN = 0, 1, 2
+
+
+class ReplaceTemplate:
+    """A replace string parsed once into literal chunks, group references and
+    metadata tokens. Greedy $NN parsing means $10 is group 10, use ${1}0 for
+    group 1 followed by 0. The file is stat'ed once per render, only if needed."""
+
+    __slots__ = ("program", "max_group", "needs_stat", "counter")
+
+    def __init__(self, program: tuple):
+        self.program = program
+        self.max_group = max((arg for kind, arg, _ in program if kind == _GROUP), default=0)
+        self.needs_stat = any(kind == _TOKEN and arg in ("date", "mtime", "size") for kind, arg, _ in program)
+        self.counter = 0
+
+    def render(self, file: Path, m: re.Match, store: MetaStore = None) -> str:
+        meta = file_meta(file, store) if self.needs_stat else None
+        self.counter += 1
+        out = []
+        for kind, arg, width in self.program:
+            if kind == _LITERAL:
+                out.append(arg)
+                continue
+            if kind == _GROUP:
+                value = (m.group(arg) or "") if arg > 0 else file.name
+            elif arg == "date":
+                value = datetime.datetime.fromtimestamp(meta.birthtime).strftime("%Y%m%d_%H%M%S")
+            elif arg == "mtime":
+                value = datetime.datetime.fromtimestamp(meta.mtime).strftime("%Y%m%d_%H%M%S")
+            elif arg == "size":
+                value = str(meta.size)
+            elif arg == "ext":
+                value = file.suffix[1:]
+            else:
+                value = str(self.counter)
+            out.append(value.zfill(width) if width else value)
+        return "".join(out)
+
+
+def compile_template(replace_str: str) -> ReplaceTemplate:
+    return ReplaceTemplate(_parse_template(replace_str or ""))
+
+
+@functools.lru_cache(maxsize=64)
+def _parse_template(replace_str: str) -> tuple:
+    program = []
+    pos = 0
+    for t in template_pattern.finditer(replace_str):
+        if t.start() > pos:
+            program.append((_LITERAL, replace_str[pos:t.start()], 0))
+        ref = t.group(1) or t.group(2)
+        width = int(t.group(3)) if t.group(3) else 0
+        if ref.isdigit():
+            program.append((_GROUP, int(ref), width))
+        elif ref in template_tokens:
+            program.append((_TOKEN, ref, width))
         else:
-            pos = int(par)
-            replace_val = m.groups()[pos-1] if pos > 0 else file.name
-            rename = rename.replace(f"${pos}", replace_val)
-
-    return file.parent.joinpath(rename).resolve()
+            raise Exception(f"Invalid token ${{{ref}}} in replace string, valid ones are {template_tokens}")
+        pos = t.end()
+    if pos < len(replace_str):
+        program.append((_LITERAL, replace_str[pos:], 0))
+    return tuple(program)
 
 
 def extract_params(replace_str):
@@ -63,94 +268,461 @@ def extract_params(replace_str):
     return set(params_list)
 
 
-def time_extractor(file_path:Path, matcher:str) -> Path:
-    date = datetime.datetime.fromtimestamp(file_path.stat().st_birthtime)
+def time_extractor(file_path:Path, matcher:str, store: MetaStore = None) -> Path:
+    return _time_folder(file_meta(file_path, store).birthtime, matcher)
+
+
+def media_time_extractor(file_path:Path, matcher:str, store: MetaStore = None) -> Path:
+    """Capture time read by media.with_capture_times, birthtime when there is none"""
+    meta = file_meta(file_path, store)
+    return _time_folder(meta.taken or meta.birthtime, matcher)
+
+
+def _time_folder(timestamp: float, matcher: str) -> Path:
+    date = datetime.datetime.fromtimestamp(timestamp)
     out = Path(date.strftime("%Y"))
     if matcher.upper() == "MONTH":
         out = out.joinpath(date.strftime("%m"))
     return out
     
 
-def regex_extractor(file:Path, matcher:str):
-    pattern = re.compile(matcher)
-    m = pattern.search(file.name)
-    if m:
-        if len(m.groups()) > 0:
-            return Path(m.group(1))
-        else: 
-            return Path(m.group())
-    else:
+class FolderMatcher:
+    """Organize expressions: the first expression (in the given order) found in the
+    filename wins. The folder name is the first group of that expression, or its
+    whole match. Several expressions are compiled into a single alternation when
+    it keeps their meaning, otherwise they are tried one after the other."""
+
+    __slots__ = ("patterns", "combined", "folder_groups")
+
+    def __init__(self, expressions: tuple):
+        try:
+            self.patterns = [re.compile(expression) for expression in expressions]
+        except re.error as e:
+            raise Exception(f"Invalid folder expressions {expressions}: {e}")
+        self.combined = None
+        self.folder_groups = {}
+        # groups are renumbered in the alternation: backreferences would point elsewhere
+        if len(self.patterns) < 2 or any(_backreference.search(e) for e in expressions):
+            return
+        parts = []
+        group = 1
+        for expression, pattern in zip(expressions, self.patterns):
+            # lazy prefix: each alternative can match anywhere in the name,
+            # the following ones are tried only if it doesn't match at all
+            parts.append(f"(?s:.*?)({expression})")
+            self.folder_groups[group] = group + 1 if pattern.groups else group
+            group += 1 + pattern.groups
+        try:
+            self.combined = re.compile("|".join(parts))
+        except re.error:
+            # inline global flags, a group name used twice...
+            self.folder_groups = {}
+
+    def folder(self, name: str) -> Path:
+        if self.combined is not None:
+            m = self.combined.match(name)
+            if not m:
+                return Path("_Unmatched")
+            # the wrapper of the matching expression is the last group closed
+            return Path(m.group(self.folder_groups[m.lastindex]))
+        for pattern in self.patterns:
+            m = pattern.search(name)
+            if m:
+                return Path(m.group(1) if pattern.groups else m.group())
         return Path("_Unmatched")
 
-    
+
+_backreference = re.compile(r"\\[1-9]|\(\?P=")
+
+
+@functools.lru_cache(maxsize=64)
+def compile_folder_matcher(expressions) -> FolderMatcher:
+    if isinstance(expressions, str):
+        expressions = (expressions,)
+    return FolderMatcher(tuple(expressions))
+
+
+def regex_extractor(file:Path, matcher, store: MetaStore = None):
+    if not isinstance(matcher, FolderMatcher):
+        matcher = compile_folder_matcher(matcher)
+    return matcher.folder(file.name)
+
 
 matchers = {
-    "time": lambda f,m: time_extractor(f,m),
-    "regex": lambda f,m: regex_extractor(f,m),
+    "time": time_extractor,
+    "media": media_time_extractor,
+    "regex": regex_extractor,
 }
 
 
-def extract_folder(file: Path, type:str, matcher:str):
-    if not file:
-        raise Exception(f"Invalid empty path provided for folder extraction")
-
+def folder_extractor(type: str):
+    """Returns the extractor function for a criteria, to be looked up once per run"""
     if not type or (type.lower()) not in matchers.keys():
         raise Exception(f"Invalid type {type} for folder matcher")
-    
-    extractor = matchers[type]
-    return extractor(file, matcher)
+    return matchers[type.lower()]
 
 
-def find_duplicates(folder_a, folder_b, exclude:tuple):
-    file_map = defaultdict(list)
-    exclude_list = [x.lower() for x in exclude ]
-    
-    folders = [Path(folder_a), Path(folder_b)] if folder_a != folder_b else Path(folder_a)
-    for folder in folders:
-        if not folder.is_dir():
-            raise Exception(f"{folder} is not a valid directory.")
-            
-        # rglob("*") finds all files recursively
-        for file_path in folder.rglob("*"):
-            if file_path.is_file() and not is_excluded(file_path, exclude_list):
-        
-                # Extract metadata
-                creation_date = file_path.stat().st_birthtime
-                name = file_path.name
-                size = file_path.stat().st_size
-                
-                # Use metadata as the unique key
-                # key = (name, size, creation_date)
-                key = (size, creation_date)
-                file_map[key].append(file_path.resolve())
-
-    # Filter out entries that only appeared once
-    duplicates = {k[0]: v for k, v in file_map.items() if len(v) > 1}
-    
-    return duplicates
+def extract_folder(file: Path, type:str, matcher, store: MetaStore = None):
+    if not file:
+        raise Exception(f"Invalid empty path provided for folder extraction")
+    return folder_extractor(type)(file, matcher, store)
+
+
+def find_duplicates(roots: list, exclude: tuple = (), hash_mode: str = "full", algorithm: str = "blake2b",
+                    stats: hashing.HashStats = None, cache: HashCache = None,
+                    jobs: int = 1, processes: bool = False, store: MetaStore = None,
+                    walk_filter: WalkFilter = None, shards: int = 1) -> dict[tuple, list[Path]]:
+    """Finds files with the same content in `roots`, returns {(size, digest): [paths]}
+    (see iter_duplicates)"""
+    return dict(iter_duplicates(roots, exclude, hash_mode, algorithm, stats, cache, jobs, processes, store,
+                                walk_filter, shards))
+
+
+def iter_duplicates(roots: list, exclude: tuple = (), hash_mode: str = "full", algorithm: str = "blake2b",
+                    stats: hashing.HashStats = None, cache: HashCache = None,
+                    jobs: int = 1, processes: bool = False, store: MetaStore = None,
+                    walk_filter: WalkFilter = None, shards: int = 1) -> Iterator[tuple[tuple, list[Path]]]:
+    """Finds files with the same content, narrowing candidates stage by stage:
+    size buckets first, then a partial hash (head/tail), then a full hash.
+    `hash_mode` tells at which stage to stop. Yields ((size, digest), [paths]).
+    Digests of unchanged files are read from `cache` when provided. The metadata
+    of the candidates is recorded in `store` (a private one is used with a cache)
+    and holds the files of a group when it is yielded, so that a consumer doesn't
+    stat them again. `exclude` (path substrings) and `walk_filter` rules are
+    applied during the walk.
+
+    All the roots go in one size index, so a group has every copy across them,
+    listed in root then walk order. With jobs > 1 the roots are walked in parallel
+    (a worker each), stat and hash calls run on a thread pool (or hashing on a
+    process pool if `processes` is set): the output doesn't depend on the number
+    of workers. With shards > 1 the index is spilled to a temporary file and
+    hashed one size range at a time, groups are yielded shard by shard.
+    """
+    if hash_mode not in hashing.hash_modes:
+        raise Exception(f"Invalid hash mode {hash_mode}")
+    stats = stats if stats is not None else hashing.HashStats()
+    if exclude:
+        walk_filter = walk_filter.with_substrings(exclude) if walk_filter else WalkFilter(substrings=exclude)
+    roots = distinct_roots(roots)
+
+    index = SizeIndex(spill=shards > 1)
+    read = defaultdict(int)  # distinct bytes read per candidate
+    with contextlib.ExitStack() as stack:
+        stack.callback(index.close)
+        stat_pool = stack.enter_context(ThreadPoolExecutor(jobs)) if jobs > 1 else None
+        hash_pool = stat_pool
+        if jobs > 1 and processes:
+            from concurrent.futures import ProcessPoolExecutor  # pulls in multiprocessing
+            hash_pool = stack.enter_context(ProcessPoolExecutor(jobs))
+        walk_pool = None
+        if jobs > 1 and len(roots) > 1:
+            walk_pool = stack.enter_context(ThreadPoolExecutor(min(jobs, len(roots))))
+
+        if store is None and cache is not None:
+            store = MetaStore()
+        # a spilled index keeps the metadata itself, the store gets it a shard at a time
+        walk_store = None if index.spilled else store
+        with metrics.phase("scan"):
+            for root, batch in _walk_roots(roots, walk_filter, stat_pool, walk_pool):
+                for entry, st in batch:
+                    file_path = Path(entry.path)
+                    stats.files += 1
+                    stats.bytes_total += st.st_size
+                    index.add(root, file_path, st)
+                    if walk_store is not None:
+                        walk_store.add(file_path, st)
+
+        for candidates in index.shards(shards, store):
+            if store is not None and not index.spilled:
+                # sizes that only appeared once are never read, their metadata is dropped
+                store.records = {f: store.records[f] for files in candidates.values() for f in files}
+            if hash_mode in ("partial", "full"):
+                candidates = _hash_stage(candidates, "partial", algorithm, stats, cache, store, read, hash_pool)
+            if hash_mode == "full":
+                candidates = _hash_stage(candidates, "full", algorithm, stats, cache, store, read, hash_pool)
+            yield from candidates.items()
+
+    stats.bytes_distinct = sum(read.values())
+    stats.bytes_skipped = stats.bytes_total - stats.bytes_distinct
+    metrics.add("files_scanned", stats.files)
+    metrics.add("bytes_hashed", stats.bytes_read)
+    metrics.add("cache_hits", stats.cache_hits)
+
+
+def distinct_roots(roots: list) -> list[Path]:
+    """Resolved roots in the given order: repeated roots and roots inside another
+    one are left out, so that no file is walked twice"""
+    resolved = []
+    for root in roots:
+        root = Path(root)
+        if not root.is_dir():
+            raise Exception(f"{root} is not a valid directory.")
+        resolved.append(root.resolve())
+    if not resolved:
+        raise Exception("at least one directory is needed")
+    distinct = []
+    for root in resolved:
+        outer = next((r for r in resolved if r in root.parents), None)
+        if outer is not None:
+            log.warning(f"'{root}' is inside '{outer}', it is walked once")
+        elif root not in distinct:
+            distinct.append(root)
+    return distinct
+
+
+STAT_BATCH = 1024
+
+
+def _stat_entries(entries: Iterator[os.DirEntry], executor) -> Iterator[tuple]:
+    if executor is None:
+        for entry in entries:
+            yield entry, entry.stat()
+        return
+
+    # bounded batches keep the walk streaming while stat calls overlap
+    for batch in iter(lambda: list(itertools.islice(entries, STAT_BATCH)), []):
+        yield from zip(batch, executor.map(os.DirEntry.stat, batch))
+
+
+def _walk_roots(roots: list[Path], walk_filter: WalkFilter, stat_pool, walk_pool) -> Iterator[tuple]:
+    """Yields (root index, [(entry, stat)]) batches. With a `walk_pool` every root
+    is walked by its own worker and batches come in arrival order."""
+    def batches(i: int, stop: threading.Event = None) -> Iterator[tuple]:
+        entries = _stat_entries(walk_files(roots[i], walk_filter=walk_filter), stat_pool)
+        for batch in iter(lambda: list(itertools.islice(entries, STAT_BATCH)), []):
+            if stop is not None and stop.is_set():
+                return
+            yield i, batch
+
+    if walk_pool is None:
+        for i in range(len(roots)):
+            yield from batches(i)
+        return
+
+    results = queue.SimpleQueue()
+    stop = threading.Event()
+
+    def walk(i: int):
+        try:
+            for item in batches(i, stop):
+                results.put(item)
+        finally:
+            results.put((i, None))
+
+    futures = [walk_pool.submit(walk, i) for i in range(len(roots))]
+    try:
+        running = len(roots)
+        while running:
+            i, batch = results.get()
+            if batch is None:
+                running -= 1
+            else:
+                yield i, batch
+    finally:
+        stop.set()
+    for future in futures:
+        future.result()  # raises the error of a failed walk
+
+
+@timed("hash")
+def _hash_stage(candidates: dict, kind: str, algorithm: str, stats: hashing.HashStats, cache: HashCache,
+                store: MetaStore, read: dict, executor) -> dict[tuple, list[Path]]:
+    items = [(size, digest, f) for (size, digest), files in candidates.items() for f in files]
+    digests = [None] * len(items)
+
+    # cached digests are resolved first, only misses are submitted to the workers
+    todo = []
+    for i, (size, digest, f) in enumerate(items):
+        if kind == "full" and size <= 2 * hashing.PARTIAL_CHUNK:
+            digests[i] = digest  # already hashed entirely by the partial stage
+            continue
+        cached = _cached_digest(cache, _signature(store, f), kind, algorithm, stats)
+        if cached is not None:
+            digests[i] = cached
+        else:
+            todo.append(i)
 
+    jobs = [(kind, items[i][2], items[i][0], algorithm) for i in todo]
+    results = executor.map(hashing.hash_job, jobs, chunksize=64) if executor else map(hashing.hash_job, jobs)
+    for i, (digest, n, error) in zip(todo, results):
+        f = items[i][2]
+        stats.bytes_read += n
+        read[f] = max(read[f], n)
+        if error:
+            log.warning(f"can't hash '{f}': {error}")
+            continue
+        digests[i] = digest
+        _cache_digest(cache, _signature(store, f), kind, algorithm, digest)
 
-def is_excluded(file: Path, exclude: list):
-    for e in exclude:
-        if e in f"{file.absolute()}".lower(): 
-            return True
-    return False
+    out = defaultdict(list)
+    for (size, _, f), digest in zip(items, digests):
+        if digest is not None:
+            out[(size, digest)].append(f)
+    return {k: v for k, v in out.items() if len(v) > 1}
 
 
-def manage_name_conflicts(rename_map: dict[Path, Path]) -> dict[Path, Path]:
-    if not rename_map:
-        return {}
+def _signature(store: MetaStore, file: Path) -> tuple:
+    meta = store.records.get(file) if store is not None else None
+    return meta.signature if meta else None
+
+
+def _cached_digest(cache: HashCache, signature: tuple, kind: str, algorithm: str, stats: hashing.HashStats):
+    if cache is None or signature is None:
+        return None
+    digest = cache.get(signature, kind, algorithm)
+    if digest is not None:
+        stats.cache_hits += 1
+    return digest
 
-    # Group sources by target
-    index = defaultdict(list)
-    for src, ren in rename_map.items():
-        index[ren].append(src)
 
-    out = dict(rename_map)
+def _cache_digest(cache: HashCache, signature: tuple, kind: str, algorithm: str, digest: str):
+    if cache is not None and signature is not None:
+        cache.put(signature, kind, algorithm, digest)
 
-    # Handle duplicates
-    for rename, items in index.items():
-        for i, item in enumerate(items[1:], start=1):  # skip the first
-            out[item] = rename.parent / f"{rename.stem}_{i:03d}{rename.suffix}"
 
-    return out
\ No newline at end of file
+def manage_name_conflicts(rename_map: dict[Path, Path]) -> dict[Path, Path]:
+    if not rename_map:
+        return {}
+    return plan_renames(rename_map, check_disk=False).targets
+
+
+class RenamePlan:
+    """Result of plan_renames:
+    - targets: source -> final path, conflicts already resolved (what the journal records)
+    - staging: moves to temporary names breaking rename cycles, applied first
+    - moves: the remaining moves, sources in staging are replaced by their temporary name
+    - origins: temporary name -> original source
+    - chained: sources of the moves whose target is the source of another move
+    targets and moves are PathMaps sharing the same folders, the other ones are
+    small dicts/sets (cycles and chains only).
+    """
+
+    def __init__(self, folders: FolderTable = None, spill_after: int = None):
+        folders = folders if folders is not None else FolderTable()
+        self.targets = PathMap(folders, spill_after)
+        self.moves = PathMap(folders, spill_after)
+        self.staging = {}
+        self.origins = {}
+        self.chained = set()
+
+    def changes(self) -> Iterator[tuple[Path, Path]]:
+        """(source, final path) of the files that are actually moved"""
+        return ((src, ren) for src, ren in self.targets.items() if src != ren)
+
+    def close(self):
+        self.targets.close()
+        self.moves.close()
+
+
+@timed("plan")
+def plan_renames(rename_map, check_disk: bool = True, spill_after: int = None) -> RenamePlan:
+    """Builds the rename graph once and resolves every conflict up front:
+    duplicated targets and targets taken by files that are not moving get a
+    _NNN suffix (the first one keeps its name), chains (a->b, b->c) are left
+    to the executor ordering and cycles (a->b, b->a) get a temporary name.
+    Files on disk are checked with one listing per target folder.
+
+    `rename_map` is a dict or a PathMap (whose folders and spill threshold are
+    reused). The planner works on (folder id, name) pairs and keeps per-folder
+    name sets only, never a Path per entry: those sets stay in memory even when
+    the entries are spilled.
+    """
+    if isinstance(rename_map, PathMap):
+        entries = rename_map
+        spill_after = spill_after or rename_map.spill_after
+    else:
+        entries = PathMap(spill_after=spill_after)
+        for src, ren in rename_map.items():
+            entries.add(src, ren)
+    folders = entries.folders
+    plan = RenamePlan(folders, spill_after)
+    listings = {}
+
+    def on_disk(folder: int) -> set:
+        if not check_disk:
+            return set()
+        if folder not in listings:
+            try:
+                listings[folder] = set(os.listdir(folders[folder]))
+            except OSError:
+                listings[folder] = set()
+        return listings[folder]
+
+    moving = defaultdict(set)    # folder id -> names moving away
+    assigned = defaultdict(set)  # folder id -> names taken by a planned target
+    for sd, sn, td, tn in entries.entries():
+        if sd == td and sn == tn:
+            assigned[sd].add(sn)
+        else:
+            moving[sd].add(sn)
+
+    def is_free(folder: int, name: str) -> bool:
+        if name in assigned[folder]:
+            return False
+        return name in moving[folder] or name not in on_disk(folder)
+
+    next_suffix = {}  # avoids probing again the suffixes already taken
+    for sd, sn, td, tn in entries.entries():
+        if sn not in moving[sd]:
+            plan.targets.add_entry(sd, sn, sd, sn)
+            continue
+        name = tn
+        i = next_suffix.get((td, tn), 0)
+        while not is_free(td, name):
+            i += 1
+            base = Path(tn)
+            name = f"{base.stem}_{i:03d}{base.suffix}"
+        next_suffix[(td, tn)] = i
+        if td == sd and name == sn:
+            # a suffixed name can end up being the current one
+            moving[sd].discard(sn)
+        plan.targets.add_entry(sd, sn, td, name)
+        assigned[td].add(name)
+
+    # moves whose target is another moving source: the only ones that can form cycles
+    chained = {}
+    for sd, sn, td, tn in plan.targets.entries():
+        if (sd != td or sn != tn) and tn in moving[td]:
+            chained[(sd, sn)] = (td, tn)
+    breakers = {cycle[0] for cycle in find_cycles(chained)}
+
+    for sd, sn, td, tn in plan.targets.entries():
+        if sd == td and sn == tn:
+            continue
+        if (sd, sn) in breakers:
+            i = 0
+            while not is_free(sd, tmp := f".renamer-tmp-{i}-{sn}") or tmp in moving[sd]:
+                i += 1
+            assigned[sd].add(tmp)
+            src, tmp_path = folders[sd] / sn, folders[sd] / tmp
+            plan.staging[src] = tmp_path
+            plan.origins[tmp_path] = src
+            plan.moves.add_entry(sd, tmp, td, tn)
+            plan.chained.add(tmp_path)
+        else:
+            plan.moves.add_entry(sd, sn, td, tn)
+            if (sd, sn) in chained:
+                plan.chained.add(folders[sd] / sn)
+    if entries is not rename_map:
+        entries.close()
+    return plan
+
+
+def find_cycles(moves: dict[Path, Path]) -> list[list[Path]]:
+    """Finds the cycles of a rename graph in O(n), every node has at most one target"""
+    cycles = []
+    state = {}  # 1: on current path, 2: done
+    for start in moves:
+        if start in state:
+            continue
+        path = []
+        cur = start
+        while cur in moves and cur not in state:
+            state[cur] = 1
+            path.append(cur)
+            cur = moves[cur]
+        if state.get(cur) == 1:
+            cycles.append(path[path.index(cur):])
+        for node in path:
+            state[node] = 2
+    return cycles
@@ -0,0 +1,87 @@
+import hashlib
+from pathlib import Path
+from renamer.defaults import hash_modes, similar_modes, hash_algorithms
+
+try:
+    import xxhash
+except ImportError:  # optional, blake2b is always available
+    xxhash = None
+
+
+PARTIAL_CHUNK = 4 * 1024
+READ_BUFFER = 1024 * 1024
+
+
+class HashStats:
+    """Counters about how many bytes the duplicate engine had to read: bytes_read is
+    the I/O done (a file can be read by the partial and the full stage), bytes_distinct
+    the bytes of the files read at least once, bytes_skipped the other ones"""
+
+    def __init__(self):
+        self.files = 0
+        self.bytes_total = 0
+        self.bytes_read = 0
+        self.bytes_distinct = 0
+        self.bytes_skipped = 0
+        self.cache_hits = 0
+
+    def __str__(self):
+        return (f"files: {self.files}, bytes read: {self.bytes_distinct} ({self.bytes_read} of I/O), "
+                f"bytes skipped: {self.bytes_skipped} of {self.bytes_total}, cache hits: {self.cache_hits}")
+
+
+def new_hasher(algorithm: str):
+    if algorithm == "xxhash":
+        if xxhash is None:
+            raise Exception("xxhash algorithm requested but the 'xxhash' package is not installed")
+        return xxhash.xxh3_128()
+    if algorithm == "blake2b":
+        return hashlib.blake2b(digest_size=20)
+    raise Exception(f"Invalid hash algorithm {algorithm}")
+
+
+def partial_digest(file: Path, size: int, algorithm: str, stats: HashStats = None) -> str:
+    """Hashes the first and last PARTIAL_CHUNK bytes of a file (the whole file if it is smaller)"""
+    if size <= 2 * PARTIAL_CHUNK:
+        return full_digest(file, algorithm, stats)
+
+    hasher = new_hasher(algorithm)
+    with open(file, "rb") as f:
+        hasher.update(f.read(PARTIAL_CHUNK))
+        f.seek(size - PARTIAL_CHUNK)
+        hasher.update(f.read(PARTIAL_CHUNK))
+    if stats:
+        stats.bytes_read += 2 * PARTIAL_CHUNK
+    return hasher.hexdigest()
+
+
+def full_digest(file: Path, algorithm: str, stats: HashStats = None) -> str:
+    """Streams the whole file through the hasher using a fixed size buffer"""
+    hasher = new_hasher(algorithm)
+    read = 0
+    buffer = bytearray(READ_BUFFER)
+    view = memoryview(buffer)
+    with open(file, "rb", buffering=0) as f:
+        while n := f.readinto(buffer):
+            hasher.update(view[:n])
+            read += n
+    if stats:
+        stats.bytes_read += read
+    return hasher.hexdigest()
+
+
+def hash_job(job: tuple) -> tuple:
+    """Worker entry point, job is (kind, file, size, algorithm).
+    Returns (digest, bytes_read, error): errors are returned, not raised, so that
+    a single unreadable file doesn't stop an executor map.
+    """
+    kind, file, size, algorithm = job
+    stats = HashStats()
+    try:
+        if kind == "partial":
+            digest = partial_digest(file, size, algorithm, stats)
+        else:
+            digest = full_digest(file, algorithm, stats)
+    except OSError as e:
+        return None, stats.bytes_read, str(e)
+    return digest, stats.bytes_read, None
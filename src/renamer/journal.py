@@ -0,0 +1,272 @@
+import os, re, gzip, zlib, struct, logging
+from pathlib import Path
+from typing import Iterator
+from renamer.defaults import journal_formats
+from renamer.metrics import timed
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"RNJ\x01"
+GZIP_MAGIC = b"\x1f\x8b"
+# MOVE records an applied rename, INTENT/STAGE a planned one (write-ahead mode),
+# MKDIR a folder created by the run (removed by restore when empty)
+MOVE = 1
+INTENT = 2
+STAGE = 3
+MKDIR = 4
+
+# record: type, source length, target length, source, target
+_HEAD = struct.Struct("<BII")
+_yaml_line = re.compile(r"^(.*?): (/.*|[A-Za-z]:\\.*)$")
+_journal_name = re.compile(r"[a-z]+-journal_.*_[0-9]+\.(yaml|rnj|rnj\.gz)")
+_YAML_MKDIR = "mkdir"  # sources are absolute, so this can't be a file
+
+DEFAULT_SYNC_EVERY = 1000
+
+
+def journal_path(directory: Path, operation: str, fmt: str, ts: int) -> Path:
+    return directory.joinpath(f"{operation}-journal_{directory.name}_{ts}.{fmt}")
+
+
+def is_journal(path: Path) -> bool:
+    """Whether `path` is named as the run journals of journal_path"""
+    return _journal_name.fullmatch(os.path.basename(path)) is not None
+
+
+def open_journal(path: Path, fmt: str = "yaml", sync_every: int = DEFAULT_SYNC_EVERY, resume: bool = False):
+    if fmt == "yaml":
+        return YamlJournalWriter(path, sync_every)
+    if fmt in ("rnj", "rnj.gz"):
+        return BinaryJournalWriter(path, fmt == "rnj.gz", sync_every, resume)
+    raise Exception(f"Invalid journal format {fmt}")
+
+
+class JournalWriter:
+    """Append-only journal writer: entries are flushed and fsync'ed every `sync_every`
+    appends (group commit) and on close, instead of once per entry."""
+
+    def __init__(self, path: Path, file, sync_every: int):
+        self.path = Path(path)
+        self.file = file
+        self.sync_every = sync_every
+        self.pending = 0
+
+    def append(self, src, dst, kind: int = MOVE):
+        self.write_entry(src, dst, kind)
+        self.pending += 1
+        if self.pending >= self.sync_every:
+            self.sync()
+
+    def mkdir(self, folder):
+        self.append(folder, "", MKDIR)
+
+    def write_entry(self, src, dst, kind: int = MOVE):
+        raise NotImplementedError
+
+    @timed("journal_sync")
+    def sync(self):
+        self.file.flush()
+        os.fsync(self._fileno())
+        self.pending = 0
+
+    def _fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class YamlJournalWriter(JournalWriter):
+    """Legacy text journal, one `source: target` line per entry"""
+
+    def __init__(self, path: Path, sync_every: int = DEFAULT_SYNC_EVERY):
+        super().__init__(path, open(path, "w", encoding="utf-8"), sync_every)
+
+    def write_entry(self, src, dst, kind: int = MOVE):
+        if kind == MKDIR:
+            self.file.write(f"{_YAML_MKDIR}: {src}\n")
+        else:
+            self.file.write(f"{src}: {dst}\n")
+
+
+class BinaryJournalWriter(JournalWriter):
+    """Length-prefixed records, optionally gzip compressed.
+    With `resume` records are appended to an existing journal. A compressed one
+    is rewritten first: a crash leaves its gzip stream unterminated, and data
+    appended after it could not be read back."""
+
+    def __init__(self, path: Path, compress: bool = False, sync_every: int = DEFAULT_SYNC_EVERY,
+                 resume: bool = False):
+        if resume and compress:
+            raw = open(f"{path}.resume", "wb")
+            file = gzip.GzipFile(fileobj=raw, mode="wb")
+            file.write(MAGIC)
+            for kind, src, dst in read_journal(path, True):
+                file.write(encode_record(kind, src, dst))
+        else:
+            raw = open(path, "ab" if resume else "wb")
+            file = gzip.GzipFile(fileobj=raw, mode="wb") if compress else raw
+            if resume:
+                # drop a record left half written by a crash
+                with open(path, "rb") as f:
+                    raw.truncate(_valid_end(f))
+            else:
+                file.write(MAGIC)
+        self.raw = raw
+        super().__init__(path, file, sync_every)
+        if resume and compress:
+            # the valid records are on disk before the original is replaced
+            self.sync()
+            os.replace(raw.name, path)
+
+    def write_entry(self, src, dst, kind: int = MOVE):
+        self.file.write(encode_record(kind, src, dst))
+
+    def write_intents(self, plan):
+        """Write-ahead: records every move of a functions.RenamePlan before applying it"""
+        for src, dst in plan.staging.items():
+            self.write_entry(src, dst, STAGE)
+        for src, dst in plan.moves.items():
+            self.write_entry(src, dst, INTENT)
+        self.sync()
+
+    def _fileno(self):
+        return self.raw.fileno()
+
+    def sync(self):
+        if self.file is not self.raw:
+            self.file.flush()  # gzip: emits the compressed block
+        super().sync()
+
+    def close(self):
+        super().close()
+        if not self.raw.closed:
+            self.raw.close()
+
+
+def encode_record(kind: int, src, dst) -> bytes:
+    a = os.fsencode(str(src))
+    b = os.fsencode(str(dst))
+    return b"".join((_HEAD.pack(kind, len(a), len(b)), a, b))
+
+
+def detect_format(path: Path) -> str:
+    with open(path, "rb") as f:
+        magic = f.read(len(MAGIC))
+    if magic == MAGIC:
+        return "rnj"
+    if magic.startswith(GZIP_MAGIC):
+        return "rnj.gz"
+    return "yaml"
+
+
+def read_journal(path: Path, with_kind: bool = False) -> Iterator[tuple]:
+    """Streams (source, target) entries in the order they were written"""
+    fmt = detect_format(path)
+    if fmt == "yaml":
+        for src, dst in _read_yaml(path):
+            kind = MOVE
+            if src == _YAML_MKDIR:
+                kind, src, dst = MKDIR, dst, ""
+            yield (kind, src, dst) if with_kind else (src, dst)
+        return
+
+    opener = gzip.open if fmt == "rnj.gz" else open
+    with opener(path, "rb") as f:
+        f.read(len(MAGIC))
+        while head := _read(f, _HEAD.size):
+            if len(head) < _HEAD.size:
+                log.warning(f"truncated record at the end of {path}")
+                return
+            kind, la, lb = _HEAD.unpack(head)
+            body = _read(f, la + lb)
+            if len(body) < la + lb:
+                log.warning(f"truncated record at the end of {path}")
+                return
+            src, dst = os.fsdecode(body[:la]), os.fsdecode(body[la:])
+            yield (kind, src, dst) if with_kind else (src, dst)
+
+
+def _read(f, size: int) -> bytes:
+    try:
+        return f.read(size)
+    except (EOFError, zlib.error, gzip.BadGzipFile):  # gzip stream cut by a crash
+        return b""
+
+
+def _valid_end(f) -> int:
+    """End offset of the last complete record: a crash can leave a partial one"""
+    end = f.seek(0, os.SEEK_END)
+    f.seek(len(MAGIC))
+    pos = len(MAGIC)
+    while len(head := f.read(_HEAD.size)) == _HEAD.size:
+        _, la, lb = _HEAD.unpack(head)
+        if pos + _HEAD.size + la + lb > end:
+            break
+        pos += _HEAD.size + la + lb
+        f.seek(pos)
+    if pos < end:
+        log.warning(f"ignoring truncated record at the end of {f.name}")
+    return pos
+
+
+def _read_yaml(path: Path) -> Iterator[tuple]:
+    with open(path, "r", encoding="utf-8") as journal_file:
+        for line in journal_file:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            # targets are absolute, the separator is the first ': ' before one
+            m = _yaml_line.match(line)
+            if m:
+                yield m.group(1).strip(), m.group(2).strip()
+            else:
+                log.warning(f"invalid journal line: {line}")
+
+
+def read_pending(path: Path) -> tuple[dict, dict]:
+    """Returns the (staging, moves) intents of a write-ahead journal that have no
+    matching applied record yet, in the original order."""
+    staging, moves = {}, {}
+    for kind, src, dst in read_journal(path, True):
+        if kind == STAGE:
+            staging[src] = dst
+        elif kind == INTENT:
+            moves[src] = dst
+        elif staging.get(src) == dst:
+            del staging[src]
+        elif moves.get(src) == dst:
+            del moves[src]
+    return staging, moves
+
+
+def read_restore(path: Path) -> tuple[list, list]:
+    """Returns what a restore needs: the applied (target, source) moves, last
+    to first, and the folders created by the run"""
+    moves, folders = [], []
+    for kind, src, dst in read_journal(path, True):
+        if kind == MOVE:
+            moves.append((dst, src))
+        elif kind == MKDIR:
+            folders.append(src)
+    moves.reverse()
+    return moves, folders
+
+
+def convert_journal(src_path: Path, dst_path: Path, fmt: str = "rnj") -> int:
+    """Converts a journal (i.e. a legacy .yaml one) to the given format, returns the entries count"""
+    count = 0
+    with open_journal(dst_path, fmt) as out:
+        for kind, src, dst in read_journal(src_path, True):
+            if kind in (MOVE, MKDIR):
+                out.append(src, dst, kind)
+                count += 1
+    return count
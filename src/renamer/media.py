@@ -0,0 +1,257 @@
+import struct, logging, datetime, itertools
+from pathlib import Path
+from typing import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from renamer.cache import HashCache
+from renamer.metadata import MetaStore
+
+log = logging.getLogger(__name__)
+
+# bump when the parsers change, so that cached capture dates are computed again
+PARSER_VERSION = "media-v1"
+CACHE_KIND = "capture_date"
+
+MAX_HEADER = 256 * 1024   # JPEG metadata segments are searched in the first bytes only
+MAX_EXIF = 64 * 1024      # an EXIF block can't be bigger than a JPEG segment
+BATCH = 256
+
+jpeg_extensions = {".jpg", ".jpeg", ".jpe"}
+heif_extensions = {".heic", ".heif", ".hif", ".avif"}
+mp4_extensions = {".mp4", ".m4v", ".mov", ".3gp", ".3g2"}
+
+_MP4_EPOCH = datetime.datetime(1904, 1, 1, tzinfo=datetime.timezone.utc).timestamp()
+
+
+def read_capture_time(file: Path) -> float:
+    """Returns the capture time (timestamp) stored in JPEG/HEIF/MP4 headers or None.
+    Only box/segment headers and the metadata block are read, never the media data."""
+    suffix = file.suffix.lower()
+    try:
+        with open(file, "rb") as f:
+            if suffix in jpeg_extensions:
+                return _jpeg_time(f)
+            if suffix in heif_extensions:
+                return _heif_time(f)
+            if suffix in mp4_extensions:
+                return _mp4_time(f)
+    except (OSError, struct.error, ValueError, IndexError) as e:
+        log.debug(f"can't read capture date of '{file}': {e}")
+    return None
+
+
+def with_capture_times(files: Iterator[Path], store: MetaStore, jobs: int = 1,
+                       cache: HashCache = None) -> Iterator[Path]:
+    """Passes files through, setting FileMeta.taken in `store` for each of them.
+    Files are processed in batches: cached dates first, the others are read
+    by `jobs` worker threads."""
+    with ThreadPoolExecutor(jobs) as pool:
+        for batch in iter(lambda: list(itertools.islice(files, BATCH)), []):
+            todo = []
+            for path in batch:
+                meta = store.get(path)
+                if path.suffix.lower() not in jpeg_extensions | heif_extensions | mp4_extensions:
+                    continue
+                cached = cache.get(meta.signature, CACHE_KIND, PARSER_VERSION) if cache else None
+                if cached is not None:
+                    meta.taken = float(cached) if cached else None
+                else:
+                    todo.append(path)
+            for path, taken in zip(todo, pool.map(read_capture_time, todo)):
+                meta = store.get(path)
+                meta.taken = taken
+                if cache:
+                    cache.put(meta.signature, CACHE_KIND, PARSER_VERSION, "" if taken is None else repr(taken))
+            yield from batch
+
+
+# JPEG: EXIF is in an APP1 segment before the image data
+
+def _jpeg_time(f) -> float:
+    if f.read(2) != b"\xff\xd8":
+        return None
+    pos = 2
+    while pos < MAX_HEADER:
+        marker = f.read(4)
+        if len(marker) < 4 or marker[0] != 0xFF:
+            return None
+        if marker[1] in (0xD9, 0xDA):  # end of image, start of scan: no metadata after
+            return None
+        (length,) = struct.unpack(">H", marker[2:])
+        if marker[1] == 0xE1:
+            data = f.read(length - 2)
+            if data.startswith(b"Exif\x00\x00"):
+                return _tiff_time(data[6:])
+        else:
+            f.seek(length - 2, 1)
+        pos += 2 + length
+    return None
+
+
+# HEIF: the Exif item is located through the meta box (iinf + iloc)
+
+def _heif_time(f) -> float:
+    end = f.seek(0, 2)
+    meta = _find_box(f, 0, end, b"meta")
+    if not meta:
+        return None
+    start, stop = meta[0] + 4, meta[1]  # meta is a full box
+    iinf = _find_box(f, start, stop, b"iinf")
+    iloc = _find_box(f, start, stop, b"iloc")
+    if not iinf or not iloc:
+        return None
+
+    exif_id = _heif_exif_item(f, *iinf)
+    if exif_id is None:
+        return None
+    extent = _heif_item_extent(f, *iloc, exif_id)
+    if extent is None:
+        return None
+    offset, length = extent
+    f.seek(offset)
+    data = f.read(min(length, MAX_EXIF))
+    (tiff_offset,) = struct.unpack(">I", data[:4])
+    return _tiff_time(data[4 + tiff_offset:])
+
+
+def _heif_exif_item(f, start: int, stop: int) -> int:
+    f.seek(start)
+    version = _read_exact(f, 4)[0]
+    count_size = 2 if version == 0 else 4
+    f.read(count_size)
+    for box, payload, box_end in _boxes(f, start + 4 + count_size, stop):
+        if box != b"infe":
+            continue
+        f.seek(payload)
+        version = _read_exact(f, 4)[0]
+        if version < 2:
+            continue
+        id_size = 2 if version == 2 else 4
+        item_id = int.from_bytes(f.read(id_size), "big")
+        f.read(2)  # protection index
+        if f.read(4) == b"Exif":
+            return item_id
+    return None
+
+
+def _heif_item_extent(f, start: int, stop: int, item_id: int) -> tuple:
+    f.seek(start)
+    version = _read_exact(f, 4)[0]
+    sizes = _read_exact(f, 2)
+    offset_size, length_size = sizes[0] >> 4, sizes[0] & 0x0F
+    base_offset_size, index_size = sizes[1] >> 4, (sizes[1] & 0x0F if version in (1, 2) else 0)
+    read_int = lambda n: int.from_bytes(f.read(n), "big") if n else 0
+    item_count = read_int(2 if version < 2 else 4)
+    for _ in range(item_count):
+        current = read_int(2 if version < 2 else 4)
+        if version in (1, 2):
+            read_int(2)  # construction method
+        read_int(2)  # data reference index
+        base_offset = read_int(base_offset_size)
+        extents = []
+        for _ in range(read_int(2)):
+            read_int(index_size)
+            extents.append((base_offset + read_int(offset_size), read_int(length_size)))
+        if current == item_id and extents:
+            return extents[0]
+    return None
+
+
+# MP4/QuickTime: creation time of the movie header (moov/mvhd), seconds since 1904 (UTC)
+
+def _mp4_time(f) -> float:
+    end = f.seek(0, 2)
+    moov = _find_box(f, 0, end, b"moov")
+    if not moov:
+        return None
+    mvhd = _find_box(f, *moov, b"mvhd")
+    if not mvhd:
+        return None
+    f.seek(mvhd[0])
+    version = _read_exact(f, 4)[0]
+    created = struct.unpack(">Q", f.read(8))[0] if version == 1 else struct.unpack(">I", f.read(4))[0]
+    return _MP4_EPOCH + created if created else None
+
+
+def _read_exact(f, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) < size:
+        raise ValueError("truncated header")
+    return data
+
+
+def _boxes(f, start: int, end: int):
+    """Yields (type, payload start, box end) of the ISO-BMFF boxes in [start, end), reading headers only"""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, box = struct.unpack(">I4s", f.read(8))
+        header = 8
+        if size == 1:
+            (size,) = struct.unpack(">Q", f.read(8))
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            return
+        yield box, pos + header, min(pos + size, end)
+        pos += size
+
+
+def _find_box(f, start: int, end: int, box_type: bytes) -> tuple:
+    for box, payload, box_end in _boxes(f, start, end):
+        if box == box_type:
+            return payload, box_end
+    return None
+
+
+# TIFF structure shared by JPEG and HEIF EXIF blocks
+
+_DATE_TAGS = (0x9003, 0x9004)   # DateTimeOriginal, DateTimeDigitized (EXIF IFD)
+_IFD0_DATE = 0x0132             # DateTime (IFD0)
+_EXIF_IFD = 0x8769
+
+
+def _tiff_time(data: bytes) -> float:
+    if data[:2] == b"II":
+        e = "<"
+    elif data[:2] == b"MM":
+        e = ">"
+    else:
+        return None
+    (ifd0,) = struct.unpack(e + "I", data[4:8])
+    tags = _ifd(data, ifd0, e)
+    if _EXIF_IFD in tags:
+        exif = _ifd(data, struct.unpack(e + "I", tags[_EXIF_IFD][2])[0], e)
+        for tag in _DATE_TAGS:
+            if tag in exif:
+                taken = _exif_date(data, exif[tag], e)
+                if taken:
+                    return taken
+    return _exif_date(data, tags[_IFD0_DATE], e) if _IFD0_DATE in tags else None
+
+
+def _ifd(data: bytes, offset: int, e: str) -> dict:
+    (count,) = struct.unpack(e + "H", data[offset:offset + 2])
+    tags = {}
+    for i in range(count):
+        entry = data[offset + 2 + i * 12: offset + 14 + i * 12]
+        if len(entry) < 12:
+            break
+        tag, kind, n = struct.unpack(e + "HHI", entry[:8])
+        tags[tag] = (kind, n, entry[8:12])
+    return tags
+
+
+def _exif_date(data: bytes, field: tuple, e: str) -> float:
+    kind, n, value = field
+    if kind != 2:  # ASCII
+        return None
+    if n > 4:
+        (offset,) = struct.unpack(e + "I", value)
+        value = data[offset:offset + n]
+    text = value[:n].split(b"\x00")[0].decode("ascii", "replace").strip()
+    try:
+        # EXIF dates are local times, as the filesystem ones used by organize
+        return datetime.datetime.strptime(text, "%Y:%m:%d %H:%M:%S").timestamp()
+    except ValueError:
+        return None
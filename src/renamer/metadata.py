@@ -0,0 +1,75 @@
+import os
+from pathlib import Path
+
+
+class FileMeta:
+    """Compact per-file metadata taken from a single stat call"""
+
+    __slots__ = ("dev", "ino", "size", "mtime_ns", "birthtime", "taken")
+
+    def __init__(self, dev: int, ino: int, size: int, mtime_ns: int, birthtime: float):
+        self.dev = dev
+        self.ino = ino
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.birthtime = birthtime
+        # capture time from the media headers, filled by media.with_capture_times
+        self.taken = None
+
+    @classmethod
+    def from_stat(cls, st: os.stat_result) -> "FileMeta":
+        # st_birthtime is not available on Linux: modification time is the closest fallback
+        birthtime = getattr(st, "st_birthtime", None)
+        if birthtime is None:
+            birthtime = st.st_mtime_ns / 1e9
+        return cls(st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, birthtime)
+
+    @property
+    def mtime(self) -> float:
+        return self.mtime_ns / 1e9
+
+    @property
+    def signature(self) -> tuple:
+        """(device, inode, size, mtime_ns): identifies a file content for caches"""
+        return self.dev, self.ino, self.size, self.mtime_ns
+
+
+class MetaStore:
+    """Per-run metadata store filled during the walk (see functions.find_files),
+    so that every file is stat'ed at most once per command."""
+
+    __slots__ = ("records",)
+
+    def __init__(self):
+        self.records = {}
+
+    def add(self, path: Path, st: os.stat_result) -> FileMeta:
+        meta = FileMeta.from_stat(st)
+        self.records[path] = meta
+        return meta
+
+    def get(self, path: Path) -> FileMeta:
+        meta = self.records.get(path)
+        if meta is None:
+            meta = self.add(path, path.stat())
+        return meta
+
+    def link(self, path: Path, original: Path):
+        """`path` (i.e. a planned name) gets the metadata of `original`"""
+        self.records[path] = self.get(original)
+
+    def discard(self, path: Path):
+        self.records.pop(path, None)
+
+    def clear(self):
+        self.records.clear()
+
+    def __contains__(self, path) -> bool:
+        return path in self.records
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+
+def file_meta(file: Path, store: MetaStore = None) -> FileMeta:
+    return store.get(file) if store is not None else FileMeta.from_stat(file.stat())
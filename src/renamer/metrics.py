@@ -0,0 +1,161 @@
+import time, json, inspect, logging, functools, threading
+from collections import defaultdict
+
+log = logging.getLogger(__name__)
+
+
+class _Phase:
+    __slots__ = ("metrics", "name", "started")
+
+    def __init__(self, metrics, name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.timers[self.name] += time.perf_counter() - self.started
+
+
+class _NoPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_PHASE = _NoPhase()
+
+
+class Metrics:
+    """Per-run phase timers and counters.
+
+    Disabled by default: phase() returns a shared no-op context manager and add()
+    returns immediately. Counters are meant to be added in bulk (per folder, per
+    phase), never per file, so enabled runs stay cheap as well.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.timers = defaultdict(float)
+        self.counters = defaultdict(int)
+        self._started = None
+        self._io = {}
+        self._lock = threading.Lock()  # counters are added by walk and move workers as well
+
+    def start(self):
+        self.enabled = True
+        self.timers.clear()
+        self.counters.clear()
+        self._io = _proc_io()
+        self._started = time.perf_counter()
+
+    def phase(self, name: str):
+        return _Phase(self, name) if self.enabled else _NO_PHASE
+
+    def add(self, name: str, n: int = 1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += n
+
+    def summary(self) -> dict:
+        out = {
+            "total_seconds": round(time.perf_counter() - self._started, 6) if self._started else 0,
+            "phases": {k: round(v, 6) for k, v in self.timers.items()},
+            "counters": dict(self.counters),
+        }
+        io = _proc_io()
+        if io and self._io:
+            out["counters"]["rw_syscalls"] = (io["syscr"] - self._io["syscr"]) + (io["syscw"] - self._io["syscw"])
+        return out
+
+    def report(self, json_path: str = None):
+        summary = self.summary()
+        if json_path:
+            with open(json_path, "w", encoding="utf-8") as out_file:
+                json.dump(summary, out_file, indent=2)
+            log.info(f"stats written to {json_path}")
+            return
+        log.info(f"STATS: total {summary['total_seconds']:.3f}s")
+        for k, v in summary["phases"].items():
+            log.info(f" - {k}: {v:.3f}s")
+        for k, v in summary["counters"].items():
+            log.info(f" - {k}: {v}")
+
+
+def timed(name: str):
+    """Decorator timing every call of a (coarse grained) function as phase `name`.
+    For generators the time spent producing items is timed, not the consumer's."""
+    def decorator(fn):
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generator(*args, **kwargs):
+                items = fn(*args, **kwargs)
+                if not metrics.enabled:
+                    return (yield from items)
+                try:
+                    while True:
+                        with metrics.phase(name):
+                            try:
+                                item = next(items)
+                            except StopIteration as stop:
+                                return stop.value
+                        yield item
+                finally:
+                    items.close()
+            return generator
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return fn(*args, **kwargs)
+            with metrics.phase(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Progress:
+    """Logs `done/total`, throughput and ETA of a long operation, at most once
+    every `every` seconds. Updates are meant to come from a single thread."""
+
+    def __init__(self, total: int, label: str, every: float = 5.0):
+        self.total = total
+        self.label = label
+        self.every = every
+        self.done = 0
+        self.started = self._last = time.perf_counter()
+
+    def update(self, n: int = 1):
+        self.done += n
+        now = time.perf_counter()
+        if now - self._last >= self.every:
+            self._last = now
+            self.log(now)
+
+    def log(self, now: float = None):
+        elapsed = (now or time.perf_counter()) - self.started
+        rate = self.done / elapsed if elapsed else 0
+        eta = (self.total - self.done) / rate if rate else 0
+        log.info(f"{self.label} {self.done}/{self.total} ({rate:.0f} files/s, ETA {eta:.0f}s)")
+
+    def finish(self):
+        if self.total:
+            self.log()
+
+
+def _proc_io() -> dict:
+    # read/write syscalls of the process, Linux only
+    try:
+        with open("/proc/self/io") as f:
+            return {k: int(v) for k, v in (line.split(":") for line in f)}
+    except OSError:
+        return {}
+
+
+metrics = Metrics()
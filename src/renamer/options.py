@@ -1,4 +1,5 @@
 import click
+from renamer import defaults
 
 
 def dryrun_opt():
@@ -39,4 +40,107 @@ def regexp_option():
         show_default=True,
         default=False,
         help="If set, matcher will be used as a regexp, exact match is used otherwise",
-    )
\ No newline at end of file
+    )
+def jobs_opt():
+    return click.option(
+        "-j",
+        "--jobs",
+        type=click.IntRange(min=1),
+        show_default=True,
+        default=1,
+        help="number of parallel workers",
+    )
+
+def journal_format_opt():
+    return click.option(
+        "--journal-format",
+        type=click.Choice(defaults.journal_formats),
+        show_default=True,
+        default="yaml",
+        help="journal format: legacy yaml, binary (rnj) or compressed binary (rnj.gz)",
+    )
+
+def wal_opt():
+    return click.option(
+        "--wal",
+        is_flag=True,
+        show_default=True,
+        default=False,
+        help="write-ahead journal: the whole plan is recorded before renaming, so an interrupted run can be resumed (binary journal only)",
+    )
+
+def watch_opt():
+    return click.option(
+        "--watch",
+        "watch_mode",
+        is_flag=True,
+        show_default=True,
+        default=False,
+        help="keep running: new files are processed as they arrive (inotify, polling where not available)",
+    )
+
+def state_opt():
+    return click.option(
+        "--state",
+        "state_path",
+        type=click.Path(dir_okay=False),
+        help="'last seen' state file: only the files created or moved in the tree since the previous run are processed",
+    )
+
+def interval_opt():
+    return click.option(
+        "--interval",
+        type=click.FloatRange(min=0.1),
+        show_default=True,
+        default=5.0,
+        help="with --watch, seconds of quiet before a batch of new files is processed (polling period without inotify)",
+    )
+
+def spill_opt():
+    return click.option(
+        "--spill-after",
+        type=click.IntRange(min=1000),
+        help="move the planned renames (paths) to a temporary SQLite file every this many entries; "
+             "the conflict check still keeps the file names of each target folder in memory",
+    )
+
+def verify_opt():
+    return click.option(
+        "--verify",
+        is_flag=True,
+        show_default=True,
+        default=False,
+        help="files copied to another filesystem are hashed and compared with the source before it is removed",
+    )
+
+def walk_filter_opts():
+    """--exclude-dir, --include-dir, --name and --max-depth, see functions.WalkFilter"""
+    options = [
+        click.option(
+            "--exclude-dir",
+            multiple=True,
+            help="folder glob (name, or path relative to DIRECTORY with a '/') never entered, i.e. '.git', '@eaDir'. Can be repeated",
+        ),
+        click.option(
+            "--include-dir",
+            multiple=True,
+            help="folder glob (name, or relative path with a '/'): only files in matching folders are taken. Can be repeated",
+        ),
+        click.option(
+            "--name",
+            "names",
+            multiple=True,
+            help="file name glob checked before anything else, i.e. '*.jpg'. Can be repeated",
+        ),
+        click.option(
+            "--max-depth",
+            type=click.IntRange(min=0),
+            help="folder levels walked below DIRECTORY (0: only DIRECTORY)",
+        ),
+    ]
+
+    def decorator(f):
+        for option in reversed(options):
+            f = option(f)
+        return f
+    return decorator
@@ -0,0 +1,168 @@
+import os, sqlite3, tempfile, weakref
+from array import array
+from pathlib import Path
+from typing import Iterator
+from collections.abc import Mapping, ItemsView, ValuesView
+
+
+class FolderTable:
+    """Interned folders: every folder Path is kept once, entries refer to it by index"""
+
+    __slots__ = ("paths", "ids")
+
+    def __init__(self):
+        self.paths = []
+        self.ids = {}
+
+    def intern(self, folder: Path) -> int:
+        i = self.ids.get(folder)
+        if i is None:
+            i = self.ids[folder] = len(self.paths)
+            self.paths.append(folder)
+        return i
+
+    def __getitem__(self, i: int) -> Path:
+        return self.paths[i]
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+
+class PathMap(Mapping):
+    """Append-only, ordered source -> target map for very large rename plans.
+
+    Entries are (folder id, name) pairs: folders are interned in a FolderTable
+    (shared by the maps of a plan), names are plain strings and folder ids live
+    in arrays, instead of two Path objects and a dict slot per entry. With
+    `spill_after`, entries are moved to a temporary SQLite file every
+    `spill_after` additions: at most that many entries are kept in memory. The
+    FolderTable still grows with the folders of the tree. Paths are built on the
+    fly while iterating.
+    """
+
+    def __init__(self, folders: FolderTable = None, spill_after: int = None):
+        self.folders = folders if folders is not None else FolderTable()
+        self.spill_after = spill_after
+        self._src_dir = array("I")
+        self._src_name = []
+        self._dst_dir = array("I")
+        self._dst_name = []
+        self._index = None  # {(folder id, name): position}, built by the first lookup
+        self._db = None
+        self._drop = None
+        self._spilled = 0
+        self._indexed = False
+
+    def add(self, src: Path, dst: Path):
+        """Appends an entry, sources are expected to be unique"""
+        intern = self.folders.intern
+        self.add_entry(intern(src.parent), src.name, intern(dst.parent), dst.name)
+
+    def add_entry(self, src_dir: int, src_name: str, dst_dir: int, dst_name: str):
+        self._src_dir.append(src_dir)
+        self._src_name.append(src_name)
+        self._dst_dir.append(dst_dir)
+        self._dst_name.append(dst_name)
+        if self._index is not None:
+            self._index[(src_dir, src_name)] = len(self._src_name) - 1
+        if self.spill_after and len(self._src_name) >= self.spill_after:
+            self._spill()
+
+    def entries(self) -> Iterator[tuple]:
+        """Streams (source folder id, source name, target folder id, target name)"""
+        if self._db:
+            yield from self._db.execute("SELECT src_dir, src_name, dst_dir, dst_name FROM entries ORDER BY rowid")
+        yield from zip(self._src_dir, self._src_name, self._dst_dir, self._dst_name)
+
+    def target_folders(self, moved_only: bool = False) -> set[Path]:
+        """Distinct target folders, without building the target paths. With
+        `moved_only` the folders of the entries staying in their folder are left out."""
+        if moved_only:
+            ids = {dst_dir for src_dir, _, dst_dir, _ in self.entries() if dst_dir != src_dir}
+            return {self.folders[i] for i in ids}
+        ids = set(self._dst_dir)
+        if self._db:
+            ids.update(row[0] for row in self._db.execute("SELECT DISTINCT dst_dir FROM entries"))
+        return {self.folders[i] for i in ids}
+
+    def _spill(self):
+        if self._db is None:
+            fd, path = tempfile.mkstemp(prefix="renamer-plan-", suffix=".sqlite")
+            os.close(fd)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode = OFF")
+            self._db.execute("PRAGMA synchronous = OFF")
+            self._db.execute("CREATE TABLE entries (src_dir INTEGER, src_name TEXT, dst_dir INTEGER, dst_name TEXT)")
+            self._drop = weakref.finalize(self, _drop_db, self._db, path)
+        self._db.executemany("INSERT INTO entries VALUES (?, ?, ?, ?)",
+                             zip(self._src_dir, self._src_name, self._dst_dir, self._dst_name))
+        self._db.commit()
+        self._spilled += len(self._src_name)
+        self._src_dir = array("I")
+        self._src_name = []
+        self._dst_dir = array("I")
+        self._dst_name = []
+        self._index = None
+
+    def _path(self, folder: int, name: str) -> Path:
+        return self.folders[folder] / name
+
+    def __getitem__(self, src: Path) -> Path:
+        folder = self.folders.ids.get(src.parent)
+        if folder is None:
+            raise KeyError(src)
+        key = (folder, src.name)
+        if self._index is None:
+            self._index = {k: i for i, k in enumerate(zip(self._src_dir, self._src_name))}
+        i = self._index.get(key)
+        if i is not None:
+            return self._path(self._dst_dir[i], self._dst_name[i])
+        if self._db:
+            if not self._indexed:
+                self._db.execute("CREATE INDEX IF NOT EXISTS entries_src ON entries (src_dir, src_name)")
+                self._indexed = True
+            row = self._db.execute("SELECT dst_dir, dst_name FROM entries WHERE src_dir = ? AND src_name = ?",
+                                   key).fetchone()
+            if row:
+                return self._path(*row)
+        raise KeyError(src)
+
+    def __iter__(self) -> Iterator[Path]:
+        for src_dir, src_name, _, _ in self.entries():
+            yield self._path(src_dir, src_name)
+
+    def __len__(self) -> int:
+        return self._spilled + len(self._src_name)
+
+    def items(self):
+        return _Items(self)
+
+    def values(self):
+        return _Values(self)
+
+    def close(self):
+        """Removes the spill file, if any"""
+        if self._drop:
+            self._drop()
+
+
+class _Items(ItemsView):
+    def __iter__(self):
+        path = self._mapping._path
+        for src_dir, src_name, dst_dir, dst_name in self._mapping.entries():
+            yield path(src_dir, src_name), path(dst_dir, dst_name)
+
+
+class _Values(ValuesView):
+    def __iter__(self):
+        path = self._mapping._path
+        for _, _, dst_dir, dst_name in self._mapping.entries():
+            yield path(dst_dir, dst_name)
+
+
+def _drop_db(db: sqlite3.Connection, path: str):
+    db.close()
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
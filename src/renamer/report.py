@@ -0,0 +1,110 @@
+import os, csv, json, logging, itertools
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterator
+from renamer.defaults import report_formats
+from renamer.metadata import FileMeta, MetaStore
+
+log = logging.getLogger(__name__)
+
+# one record per file of a group, groups are written as they are found
+FIELDS = ["group", "kind", "hash", "size", "inode", "root", "path"]
+
+
+def report_format(path, fmt: str = None) -> str:
+    """`fmt` if given, otherwise from the extension of `path` (text for anything else)"""
+    if fmt:
+        return fmt
+    return next((f for f in ("jsonl", "csv") if str(path).endswith(f".{f}")), "text")
+
+
+class ReportWriter:
+    """Streams duplicate groups to a report (none if `path` is None) and sums up, per
+    root, the bytes taken by the copies: within a group the first file is kept, the
+    other ones are wasted unless they are hardlinks of a file already counted.
+    Sizes and inodes come from the metadata of the walk in `store`, files missing
+    there are stat'ed. text is the legacy format, a line of comma separated paths
+    per group."""
+
+    __slots__ = ("path", "fmt", "roots", "store", "groups", "wasted", "copies", "_file", "_csv")
+
+    def __init__(self, path: Path, fmt: str, roots: list[Path], store: MetaStore = None):
+        if fmt not in report_formats:
+            raise Exception(f"Invalid report format {fmt}")
+        self.path = Path(path) if path else None
+        self.fmt = fmt
+        # the longest root first, in case a root is inside another one
+        self.roots = sorted((os.fspath(r) for r in roots), key=len, reverse=True)
+        self.store = store
+        self.groups = 0
+        self.wasted = defaultdict(int)
+        self.copies = defaultdict(int)
+        self._file = open(self.path, "w", encoding="utf-8", newline="") if self.path else None
+        self._csv = None
+        if self._file and fmt == "csv":
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(FIELDS)
+
+    def root_of(self, path) -> str:
+        path = os.fspath(path)
+        return next((r for r in self.roots if path.startswith(r.rstrip(os.sep) + os.sep)), "")
+
+    def write(self, kind: str, digest: str, files: list[Path]):
+        """Writes a group: `digest` is the hash shared by the files (None if sizes only)"""
+        self.groups += 1
+        seen = set()
+        records = []
+        for f in files:
+            meta = self.store.records.get(f) if self.store is not None else None
+            if meta is None:
+                try:
+                    meta = FileMeta.from_stat(os.stat(f))
+                except OSError as e:
+                    log.warning(f"can't stat '{f}': {e}")
+                    continue
+            root = self.root_of(f)
+            if seen and (meta.dev, meta.ino) not in seen:
+                self.wasted[root] += meta.size
+                self.copies[root] += 1
+            seen.add((meta.dev, meta.ino))
+            records.append((self.groups, kind, digest or "", meta.size, meta.ino, root, os.fspath(f)))
+
+        if self._file is None:
+            return
+        if self.fmt == "text":
+            self._file.write(f"{', '.join(r[-1] for r in records)}\n")
+        elif self.fmt == "jsonl":
+            self._file.writelines(f"{json.dumps(dict(zip(FIELDS, r)))}\n" for r in records)
+        else:
+            self._csv.writerows(records)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def read_report(path: Path) -> Iterator[tuple[str, list[dict]]]:
+    """Streams the groups of a jsonl or csv report: (kind, [records]), records are
+    dicts of FIELDS (size and inode as int)"""
+    fmt = report_format(path)
+    if fmt == "text":
+        # any extension: the first line tells the format
+        with open(path, encoding="utf-8") as f:
+            first = f.readline()
+        fmt = "jsonl" if first.startswith("{") else "csv" if first.strip() == ",".join(FIELDS) else "text"
+    if fmt == "text":
+        raise Exception(f"{path}: text reports can't be read back, use the jsonl or csv format")
+
+    with open(path, encoding="utf-8", newline="") as f:
+        records = (json.loads(line) for line in f if line.strip()) if fmt == "jsonl" else csv.DictReader(f)
+        for _, group in itertools.groupby(records, key=lambda r: r["group"]):
+            group = list(group)
+            for r in group:
+                r["size"], r["inode"] = int(r["size"]), int(r["inode"])
+            yield group[0]["kind"], group
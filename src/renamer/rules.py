@@ -0,0 +1,161 @@
+import logging
+from pathlib import Path
+from renamer import functions as func
+from renamer.metadata import MetaStore
+
+try:
+    import tomllib
+except ImportError:  # python < 3.11
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+log = logging.getLogger(__name__)
+
+rule_types = ["rename", "prepend", "organize"]
+
+
+class RenameRule:
+    """Same as the rename command: `replace` replaces `matcher` (a regexp if `regexp`)"""
+
+    __slots__ = ("matcher", "replace", "template")
+
+    def __init__(self, matcher: str, replace: str, regexp: bool = False):
+        self.matcher = func.compile_matcher(matcher, regexp)
+        self.replace = replace
+        self.template = func.compile_template(replace) if regexp else None
+        if self.template and self.template.max_group > self.matcher.groups:
+            raise Exception(f"replace string refers to group ${self.template.max_group}, "
+                            f"matcher has {self.matcher.groups} groups")
+
+    @property
+    def needs_stat(self) -> bool:
+        return bool(self.template and self.template.needs_stat)
+
+    def apply(self, file: Path, store: MetaStore) -> Path:
+        if self.template:
+            return func.rename_filename_regex(file, self.matcher, self.template, store)
+        return func.rename_filename(file, self.matcher, self.replace)
+
+
+class PrependRule:
+    """Same as the prepend command: `prefix` is prepended to names matching `matcher`"""
+
+    __slots__ = ("matcher", "prefix")
+    needs_stat = False
+
+    def __init__(self, matcher: str, prefix: str):
+        self.matcher = func.compile_matcher(matcher, True)
+        self.prefix = prefix
+
+    def apply(self, file: Path, store: MetaStore) -> Path:
+        if not self.matcher.match(file.name):
+            return file
+        return file.parent.joinpath(f"{self.prefix}{file.name}")
+
+
+class OrganizeRule:
+    """Same as the organize command: files are moved in `output`/<folder>, the
+    folder is the capture/creation time (`time`) or a piece of the name (`expression`)"""
+
+    __slots__ = ("criteria", "matcher", "extractor", "output", "time_source")
+
+    def __init__(self, output: Path, time: str = None, expression=None, time_source: str = "birthtime"):
+        if bool(time) == bool(expression):
+            raise Exception("exactly one of 'time' and 'expression' must be set")
+        if time and time.upper() not in func.folder_time_matchers:
+            raise Exception(f"invalid time '{time}', valid ones are {func.folder_time_matchers}")
+        if time_source not in ("birthtime", "media"):
+            raise Exception(f"invalid time_source '{time_source}'")
+        self.criteria = "time" if time else "regex"
+        if isinstance(expression, str):
+            expression = [expression]
+        self.matcher = time if time else func.compile_folder_matcher(tuple(expression))
+        self.output = output
+        self.time_source = time_source
+        # the capture time only when asked for: another rule of a chain can read it
+        self.extractor = func.folder_extractor("media" if self.uses_media else self.criteria)
+
+    @property
+    def needs_stat(self) -> bool:
+        return self.criteria == "time"
+
+    @property
+    def uses_media(self) -> bool:
+        return self.criteria == "time" and self.time_source == "media"
+
+    def apply(self, file: Path, store: MetaStore) -> Path:
+        folder = self.extractor(file, self.matcher, store)
+        return self.output.joinpath(folder).joinpath(file.name).resolve()
+
+
+def load_rules(path: Path, directory: Path = None) -> tuple[Path, list]:
+    """Reads a TOML rules file, returns the tree to work on and the rules.
+
+    directory = "./photos"      # optional, relative to the rules file
+
+    [[rule]]
+    type = "rename"             # rename: matcher, replace, regexp (default false)
+    matcher = "_([0-9]{8})"
+    replace = "_$1"
+    regexp = true
+
+    [[rule]]
+    type = "organize"           # organize: time (MONTH/YEAR) or expression (one or a list),
+    time = "MONTH"              # time_source (birthtime/media), output (relative to directory)
+    """
+    if tomllib is None:
+        raise Exception("reading rules requires python >= 3.11 or the tomli package")
+    path = Path(path)
+    with open(path, "rb") as rules_file:
+        try:
+            data = tomllib.load(rules_file)
+        except tomllib.TOMLDecodeError as e:
+            raise Exception(f"invalid rules file {path}: {e}")
+
+    if directory is None:
+        if "directory" not in data:
+            raise Exception(f"no directory given and none set in {path}")
+        directory = path.parent.joinpath(data["directory"])
+    directory = Path(directory).resolve()
+    if not directory.is_dir():
+        raise Exception(f"{directory} is not a folder")
+
+    rules = []
+    for i, spec in enumerate(data.get("rule", []), 1):
+        spec = dict(spec)
+        kind = str(spec.pop("type", "")).lower()
+        try:
+            if kind == "rename":
+                rules.append(RenameRule(spec.pop("matcher"), spec.pop("replace"), bool(spec.pop("regexp", False))))
+            elif kind == "prepend":
+                rules.append(PrependRule(spec.pop("matcher"), spec.pop("prefix")))
+            elif kind == "organize":
+                output = directory.joinpath(spec.pop("output", "."))
+                rules.append(OrganizeRule(output, spec.pop("time", None), spec.pop("expression", None),
+                                          str(spec.pop("time_source", "birthtime")).lower()))
+            else:
+                raise Exception(f"invalid type '{kind}', valid ones are {rule_types}")
+        except KeyError as e:
+            raise Exception(f"rule {i} ({kind}): missing {e}")
+        except Exception as e:
+            raise Exception(f"rule {i} ({kind}): {e}")
+        if spec:
+            raise Exception(f"rule {i} ({kind}): unknown keys {sorted(spec)}")
+
+    if not rules:
+        raise Exception(f"no [[rule]] in {path}")
+    return directory, rules
+
+
+def final_path(file: Path, rules: list, store: MetaStore = None) -> Path:
+    """Applies the rules chain to a file, each rule sees the name given by the previous ones"""
+    current = file
+    for rule in rules:
+        target = rule.apply(current, store)
+        if store is not None and target != current:
+            # metadata of the intermediate names is the one of the original file
+            store.link(target, file)
+        current = target
+    return current
@@ -0,0 +1,235 @@
+import os, logging, itertools
+from pathlib import Path
+from typing import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from renamer import hashing
+from renamer.cache import HashCache
+from renamer.functions import WalkFilter, distinct_roots, walk_files
+from renamer.metadata import FileMeta, MetaStore
+from renamer.metrics import metrics, timed
+
+try:
+    import numpy as np
+except ImportError:  # optional, only needed by the similar images mode
+    np = None
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+log = logging.getLogger(__name__)
+
+# bump when thumbnails or hashes change, so that cached hashes are computed again
+HASH_VERSION = "image-v1"
+BATCH = 256
+QUERY_SLICE = 65536  # index queries run on slices of hashes, to bound the candidate arrays
+TABLE_BITS = 20      # chunks up to this size get a bucket table instead of binary searches
+
+# thumbnail (width, height) per hash kind
+thumbnail_sizes = {"dhash": (9, 8), "phash": (32, 32)}
+image_extensions = {".jpg", ".jpeg", ".jpe", ".png", ".gif", ".bmp", ".tif", ".tiff", ".webp"}
+
+
+def _require():
+    if np is None or Image is None:
+        raise Exception("similar images mode requires the 'numpy' and 'Pillow' packages")
+
+
+def thumbnail(file: str, size: tuple) -> bytes:
+    """Grayscale pixels of the image scaled to `size`, None if it can't be decoded.
+    JPEGs are decoded at a reduced scale (draft mode), the full image is never built."""
+    try:
+        with Image.open(file) as im:
+            im.draft("L", (size[0] * 8, size[1] * 8))
+            return im.convert("L").resize(size, Image.Resampling.LANCZOS).tobytes()
+    except (OSError, ValueError, SyntaxError, Image.DecompressionBombError) as e:
+        log.debug(f"can't decode '{file}': {e}")
+        return None
+
+
+def dhash(pixels) -> "np.ndarray":
+    """Difference hashes of (N, 8, 9) thumbnails: a bit per horizontally adjacent pair"""
+    return _pack(pixels[:, :, 1:] > pixels[:, :, :-1])
+
+
+def phash(pixels) -> "np.ndarray":
+    """DCT hashes of (N, 32, 32) thumbnails: low 8x8 frequencies compared to their median"""
+    d = _dct_matrix(pixels.shape[1])
+    low = (d @ pixels.astype(np.float64) @ d.T)[:, :8, :8].reshape(len(pixels), 64)
+    median = np.median(low[:, 1:], axis=1)  # the DC term is left out
+    return _pack(low > median[:, None])
+
+
+hash_functions = {"dhash": dhash, "phash": phash}
+
+
+def _dct_matrix(n: int):
+    k = np.arange(n)[:, None]
+    d = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    d[0] /= np.sqrt(2)
+    return d
+
+
+def _pack(bits) -> "np.ndarray":
+    """(N, ...) booleans, 64 per row, to N uint64"""
+    packed = np.packbits(bits.reshape(len(bits), 64), axis=1)
+    return packed.view(">u8").ravel().astype(np.uint64)
+
+
+def _popcount(values) -> "np.ndarray":
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    counts = np.zeros(len(values), dtype=np.uint8)
+    for shift in range(0, 64, 8):
+        counts += _BYTE_BITS[(values >> np.uint64(shift)) & np.uint64(0xFF)]
+    return counts
+
+
+_BYTE_BITS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8) if np is not None else None
+
+
+@timed("image_hash")
+def image_hashes(files: list[tuple], kind: str, jobs: int = 1, cache: HashCache = None,
+                 stats: hashing.HashStats = None) -> Iterator[tuple]:
+    """Yields (path, hash) for (path, stat) pairs, images that can't be decoded are left out.
+    Cached hashes are used first; thumbnails of the others are made by `jobs` threads
+    (decoding releases the GIL) and hashed a batch at a time."""
+    size = thumbnail_sizes[kind]
+    files = iter(files)
+    with ThreadPoolExecutor(jobs) as pool:
+        for batch in iter(lambda: list(itertools.islice(files, BATCH)), []):
+            found = {}
+            todo = []
+            for path, st in batch:
+                signature = FileMeta.from_stat(st).signature
+                cached = cache.get(signature, kind, HASH_VERSION) if cache else None
+                if cached is None:
+                    todo.append((path, st, signature))
+                    continue
+                if stats:
+                    stats.cache_hits += 1
+                found[path] = int(cached, 16) if cached else None
+
+            thumbnails = list(pool.map(thumbnail, [os.fspath(p) for p, _, _ in todo], itertools.repeat(size)))
+            pixels = np.frombuffer(b"".join(t for t in thumbnails if t is not None), dtype=np.uint8)
+            hashes = iter(hash_functions[kind](pixels.reshape(-1, size[1], size[0])).tolist())
+            for (path, st, signature), t in zip(todo, thumbnails):
+                value = found[path] = next(hashes) if t is not None else None
+                if stats:
+                    stats.bytes_read += st.st_size
+                    stats.bytes_distinct += st.st_size
+                if cache:
+                    cache.put(signature, kind, HASH_VERSION, "" if value is None else f"{value:016x}")
+            # walk order is kept, whatever came from the cache
+            for path, _ in batch:
+                if found[path] is not None:
+                    yield path, found[path]
+
+
+@timed("image_index")
+def near_pairs(hashes, threshold: int) -> Iterator[tuple]:
+    """Yields (i, j) index arrays of the hash pairs (i < j) within `threshold` bits.
+
+    Multi-index hashing: hashes are split in m chunks, two hashes within t bits
+    have at least one chunk within t // m bits. Every chunk is sorted once, then
+    looked up for each flip of up to t // m bits: only candidates sharing a
+    (flipped) chunk are compared, with m chosen so that chunks are ~log2(N) bits.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    n = len(hashes)
+    if n < 2:
+        return
+    chunk_bits = max(8, min(32, int(n).bit_length()))
+    m = max(1, min(threshold + 1, -(-64 // chunk_bits)))
+    bounds = [round(i * 64 / m) for i in range(m + 1)]
+    radius = threshold // m
+
+    for lo_bit, hi_bit in zip(bounds, bounds[1:]):
+        width = hi_bit - lo_bit
+        keys = (hashes >> np.uint64(lo_bit)) & np.uint64((1 << width) - 1)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        if width <= TABLE_BITS:
+            # bucket bounds of every possible key: lookups are plain indexing
+            bucket_starts = np.searchsorted(sorted_keys, np.arange((1 << width) + 1, dtype=np.uint64))
+        flips = [sum(1 << b for b in bits) for r in range(radius + 1) for bits in itertools.combinations(range(width), r)]
+        for start in range(0, n, QUERY_SLICE):
+            query = keys[start:start + QUERY_SLICE]
+            for flip in flips:
+                flipped = query ^ np.uint64(flip)
+                if width <= TABLE_BITS:
+                    flipped = flipped.astype(np.intp)
+                    first = bucket_starts[flipped]
+                    counts = bucket_starts[flipped + 1] - first
+                else:
+                    first = np.searchsorted(sorted_keys, flipped, "left")
+                    counts = np.searchsorted(sorted_keys, flipped, "right") - first
+                total = int(counts.sum())
+                if not total:
+                    continue
+                i = np.repeat(np.arange(start, start + len(query)), counts)
+                offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                j = order[np.repeat(first, counts) + offsets]
+                keep = i < j
+                i, j = i[keep], j[keep]
+                keep = _popcount(hashes[i] ^ hashes[j]) <= threshold
+                metrics.add("image_candidates", len(keep))
+                if keep.any():
+                    yield i[keep], j[keep]
+
+
+def find_similar(roots: list, exclude: tuple = (), kind: str = "dhash", threshold: int = 6,
+                 stats: hashing.HashStats = None, cache: HashCache = None, jobs: int = 1,
+                 walk_filter: WalkFilter = None, store: MetaStore = None) -> dict[tuple, list[Path]]:
+    """Finds groups of similar images (resized, re-encoded copies...): images whose
+    `kind` perceptual hash (dhash, phash) differ by at most `threshold` bits end up
+    in the same group, across all `roots`. Returns {(kind, hash of the first image): [paths]}.
+    Hashes of unchanged files are read from `cache` when provided, the metadata of
+    the images is recorded in `store`."""
+    _require()
+    if kind not in hash_functions:
+        raise Exception(f"Invalid image hash {kind}")
+    stats = stats if stats is not None else hashing.HashStats()
+    if exclude:
+        walk_filter = walk_filter.with_substrings(exclude) if walk_filter else WalkFilter(substrings=exclude)
+
+    files = []
+    with metrics.phase("scan"):
+        for root in distinct_roots(roots):
+            for entry in walk_files(root, walk_filter=walk_filter):
+                if os.path.splitext(entry.name)[1].lower() in image_extensions:
+                    st = entry.stat()
+                    stats.files += 1
+                    stats.bytes_total += st.st_size
+                    files.append((Path(entry.path), st))
+                    if store is not None:
+                        store.add(files[-1][0], st)
+
+    paths, values = [], []
+    for path, value in image_hashes(files, kind, jobs, cache, stats):
+        paths.append(path)
+        values.append(value)
+    stats.bytes_skipped = stats.bytes_total - stats.bytes_distinct
+    if not paths:
+        return {}
+
+    # identical hashes are grouped upfront, only distinct ones go through the index
+    unique, inverse = np.unique(np.array(values, dtype=np.uint64), return_inverse=True)
+    parent = list(range(len(unique)))
+
+    def root(x: int) -> int:
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for i, j in near_pairs(unique, threshold):
+        for a, b in zip(i.tolist(), j.tolist()):
+            ra, rb = root(a), root(b)
+            if ra != rb:
+                parent[max(ra, rb)] = min(ra, rb)
+
+    groups = {}
+    for k, u in enumerate(inverse.ravel().tolist()):
+        groups.setdefault(root(u), []).append(k)
+    return {(kind, f"{values[g[0]]:016x}"): [paths[k] for k in g] for g in groups.values() if len(g) > 1}
@@ -0,0 +1,97 @@
+import os, sqlite3, tempfile, weakref
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterator
+from renamer.metadata import FileMeta, MetaStore
+from renamer.pathmap import _drop_db
+
+FLUSH = 10000  # rows buffered before a spilled index writes them
+
+
+class SizeIndex:
+    """Files of several roots grouped by size, the first stage of find_duplicates.
+
+    Paths are kept per root, so that a group lists them in root then walk order
+    whatever the order the roots were walked in. With `spill` the entries go to a
+    temporary SQLite file (with the stat fields of cache signatures) and candidates
+    are read back one size range at a time: only a shard is ever in memory.
+    """
+
+    __slots__ = ("_sizes", "_rows", "_db", "_drop", "__weakref__")
+
+    def __init__(self, spill: bool = False):
+        self._sizes = defaultdict(lambda: defaultdict(list))  # root -> size -> [paths]
+        self._rows = []
+        self._db = None
+        self._drop = None
+        if spill:
+            fd, path = tempfile.mkstemp(prefix="renamer-sizes-", suffix=".sqlite")
+            os.close(fd)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode = OFF")
+            self._db.execute("PRAGMA synchronous = OFF")
+            self._db.execute("CREATE TABLE files (root INTEGER, size INTEGER, dev INTEGER, ino INTEGER, "
+                             "mtime_ns INTEGER, path TEXT)")
+            self._drop = weakref.finalize(self, _drop_db, self._db, path)
+
+    @property
+    def spilled(self) -> bool:
+        return self._db is not None
+
+    def add(self, root: int, path: Path, st: os.stat_result):
+        if self._db is None:
+            self._sizes[root][st.st_size].append(path)
+            return
+        self._rows.append((root, st.st_size, st.st_dev, st.st_ino, st.st_mtime_ns, os.fspath(path)))
+        if len(self._rows) >= FLUSH:
+            self._flush()
+
+    def _flush(self):
+        self._db.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)", self._rows)
+        self._rows = []
+
+    def shards(self, n: int = 1, store: MetaStore = None) -> Iterator[dict[tuple, list[Path]]]:
+        """Yields the candidates ({(size, None): [paths]}, sizes seen more than once)
+        of `n` size ranges holding about the same number of files. In memory the
+        index is a single shard (consumed). Spilled candidates get their metadata
+        in `store`, cleared before each shard."""
+        if self._db is None:
+            merged = defaultdict(list)
+            for root in sorted(self._sizes):
+                for size, paths in self._sizes.pop(root).items():
+                    merged[size].extend(paths)
+            yield {(size, None): paths for size, paths in merged.items() if len(paths) > 1}
+            return
+
+        self._flush()
+        self._db.execute("CREATE INDEX files_size ON files (size)")
+        counts = self._db.execute("SELECT size, COUNT(*) FROM files GROUP BY size HAVING COUNT(*) > 1 "
+                                  "ORDER BY size").fetchall()
+        per_shard = -(-sum(c for _, c in counts) // max(1, n))
+        ranges, first, total = [], None, 0
+        for size, count in counts:
+            first = size if first is None else first
+            total += count
+            if total >= per_shard:
+                ranges.append((first, size))
+                first, total = None, 0
+        if first is not None:
+            ranges.append((first, counts[-1][0]))
+
+        for low, high in ranges:
+            if store is not None:
+                store.clear()
+            candidates = defaultdict(list)
+            rows = self._db.execute("SELECT size, dev, ino, mtime_ns, path FROM files WHERE size BETWEEN ? AND ? "
+                                    "ORDER BY root, rowid", (low, high))
+            for size, dev, ino, mtime_ns, path in rows:
+                path = Path(path)
+                candidates[(size, None)].append(path)
+                if store is not None:
+                    store.records[path] = FileMeta(dev, ino, size, mtime_ns, mtime_ns / 1e9)
+            yield {k: v for k, v in candidates.items() if len(v) > 1}
+
+    def close(self):
+        """Removes the spill file, if any"""
+        if self._drop:
+            self._drop()
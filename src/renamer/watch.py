@@ -0,0 +1,261 @@
+import os, re, json, time, struct, select, logging, ctypes, ctypes.util
+from pathlib import Path
+from typing import Iterator
+from renamer.functions import WalkFilter
+from renamer.journal import is_journal
+from renamer.metadata import MetaStore
+
+log = logging.getLogger(__name__)
+
+# filesystem timestamps come from a coarse clock: anything this close to a scan
+# is considered racy and looked at again on the next one
+RACY_NS = 1_000_000_000
+
+
+class WatchState:
+    """Persisted "last seen" state of a watched tree.
+
+    - since: start time (ns) of the last scan, older files were already seen
+    - dirs: {folder: [mtime_ns, [sub-folder names]]}, folders whose mtime didn't
+      change are not listed again
+    - outputs: {path: ctime_ns} of the files written by the last runs, so that
+      renamed/moved files are not taken as new arrivals
+    Paths in `ignore` (journal, state file) and the run journals of the folders in
+    `journals` are never returned, folders in `outside` are walked only to reach
+    included ones (see WalkFilter): none of them is saved.
+    """
+
+    def __init__(self, path: Path = None):
+        self.path = Path(path) if path else None
+        self.since = 0
+        self.dirs = {}
+        self.outputs = {}
+        self.ignore = set()
+        self.journals = set()
+        self.outside = set()
+        if self.path:
+            self.ignore.update({str(self.path.resolve()), str(self.path.resolve()) + ".tmp"})
+        if self.path and self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as state_file:
+                data = json.load(state_file)
+            self.since = data.get("since", 0)
+            self.dirs = data.get("dirs", {})
+            self.outputs = data.get("outputs", {})
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as state_file:
+            json.dump({"since": self.since, "dirs": self.dirs, "outputs": self.outputs}, state_file)
+        os.replace(tmp, self.path)
+
+    def is_output(self, path: str, st: os.stat_result) -> bool:
+        return path in self.ignore or self.outputs.get(path) == st.st_ctime_ns or \
+            (os.path.dirname(path) in self.journals and is_journal(path))
+
+    def record_outputs(self, paths):
+        """Remembers the files written by a run, forgets the ones older than the last scan"""
+        limit = self.since - RACY_NS
+        self.outputs = {p: c for p, c in self.outputs.items() if c >= limit}
+        for p in paths:
+            try:
+                self.outputs[str(p)] = os.stat(p).st_ctime_ns
+            except FileNotFoundError:
+                pass
+
+
+def new_files(base: Path, pattern: re.Pattern, state: WatchState, walk_filter: WalkFilter = None,
+              store: MetaStore = None) -> list[Path]:
+    """Polling scan: returns the files created, moved or renamed in the tree since
+    the last scan, listing only the folders whose mtime changed. The state is
+    updated (not saved). Folders pruned by `walk_filter` are not looked at. The
+    metadata of the returned files is recorded in `store`."""
+    started = time.time_ns()
+    since = state.since - RACY_NS if state.since else 0
+    dirs = {}
+    found = []
+    state.outside = set()
+    stack = [(str(base.resolve()), "", 0, walk_filter.root_inside if walk_filter else True)]
+    while stack:
+        folder, rel, depth, inside = stack.pop()
+        if not inside:
+            state.outside.add(folder)
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        known = state.dirs.get(folder)
+        if known and known[0] == mtime:
+            dirs[folder] = known
+            stack.extend(_subfolders(folder, rel, depth, inside, reversed(known[1]), walk_filter))
+            continue
+
+        subdirs = []
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    elif inside and pattern.match(entry.name) and \
+                            (walk_filter is None or walk_filter.file(entry.path, entry.name)) and entry.is_file():
+                        st = entry.stat()
+                        if st.st_ctime_ns >= since and not state.is_output(entry.path, st):
+                            found.append(Path(entry.path))
+                            if store is not None:
+                                store.add(found[-1], st)
+        except FileNotFoundError:
+            continue
+        # a folder changed during the scan is listed again the next time
+        dirs[folder] = [mtime if mtime < started - RACY_NS else 0, sorted(subdirs)]
+        stack.extend(_subfolders(folder, rel, depth, inside, sorted(subdirs, reverse=True), walk_filter))
+
+    state.dirs = dirs
+    state.since = started
+    found.sort()
+    return found
+
+
+def _subfolders(folder: str, rel: str, depth: int, inside: bool, names, walk_filter: WalkFilter) -> Iterator[tuple]:
+    for name in names:
+        path = os.path.join(folder, name)
+        if walk_filter is None:
+            yield path, rel, depth, inside
+            continue
+        sub = f"{rel}/{name}" if rel else name
+        sub_inside = walk_filter.folder(path, sub, name, depth + 1, inside)
+        if sub_inside is not None:
+            yield path, sub, depth + 1, sub_inside
+
+
+# inotify (Linux): only the events of the watched tree are read, no scan
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_ONLYDIR = 0x01000000
+_EVENT = struct.Struct("iIII")
+
+
+class Inotify:
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+        self.folders = set()
+
+    def add(self, folder: str):
+        if folder in self.folders:
+            return
+        wd = self._add_watch(self.fd, os.fsencode(folder), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR)
+        if wd < 0:
+            log.warning(f"can't watch {folder}: {os.strerror(ctypes.get_errno())}")
+            return
+        self.watches[wd] = folder
+        self.folders.add(folder)
+
+    def read(self, timeout: float) -> list[tuple]:
+        """Returns (mask, path) events, waiting at most `timeout` seconds for the first one"""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, size = _EVENT.unpack_from(data, pos)
+                name = data[pos + _EVENT.size: pos + _EVENT.size + size].rstrip(b"\x00")
+                pos += _EVENT.size + size
+                folder = self.watches.get(wd)
+                if mask & IN_Q_OVERFLOW:
+                    events.append((mask, None))
+                elif mask & IN_IGNORED:  # folder removed
+                    self.folders.discard(self.watches.pop(wd, None))
+                elif folder:
+                    events.append((mask, os.path.join(folder, os.fsdecode(name))))
+
+    def close(self):
+        os.close(self.fd)
+
+
+def watch(base: Path, pattern: re.Pattern, state: WatchState, interval: float = 5.0,
+          use_inotify: bool = True, walk_filter: WalkFilter = None, store: MetaStore = None) -> Iterator[list[Path]]:
+    """Yields batches of new files, forever. The first batch comes from a polling
+    scan (arrivals while not watching), then inotify events are collected until
+    the tree is quiet for `interval` seconds. Without inotify the tree is polled
+    every `interval` seconds. The caller saves the state once a batch is processed.
+    The metadata of the batch files is recorded in `store`."""
+    inotify = None
+    if use_inotify:
+        try:
+            inotify = Inotify()
+        except (OSError, AttributeError) as e:
+            log.warning(f"inotify not available ({e}), polling every {interval}s")
+
+    try:
+        while True:
+            batch = new_files(base, pattern, state, walk_filter, store)
+            if inotify:
+                for folder in state.dirs:
+                    inotify.add(folder)
+            if batch:
+                yield batch
+            else:
+                state.save()
+            if not inotify:
+                time.sleep(interval)
+                continue
+
+            while True:
+                started = time.time_ns()
+                batch = _collect(inotify, pattern, state, interval, walk_filter, store)
+                if batch is None:  # events were lost: fall back to a scan
+                    break
+                if batch:
+                    state.since = started
+                    yield batch
+    finally:
+        if inotify:
+            inotify.close()
+
+
+def _collect(inotify: Inotify, pattern: re.Pattern, state: WatchState, interval: float,
+             walk_filter: WalkFilter = None, store: MetaStore = None) -> list[Path]:
+    files = set()
+    events = inotify.read(None)
+    while events:
+        for mask, path in events:
+            if path is None:
+                return None
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # files can be added before the watch is: the new folder is scanned
+                    return None
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and pattern.match(os.path.basename(path)):
+                if os.path.dirname(path) in state.outside:
+                    continue
+                if walk_filter is None or walk_filter.file(path, os.path.basename(path)):
+                    files.add(path)
+        # wait for the burst of arrivals to settle
+        events = inotify.read(interval)
+
+    batch = []
+    for path in sorted(files):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if not state.is_output(path, st):
+            batch.append(Path(path))
+            if store is not None:
+                store.add(batch[-1], st)
+    return batch
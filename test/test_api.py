@@ -0,0 +1,49 @@
+import asyncio
+import renamer
+from renamer import api, executor
+
+
+def make_files(folder, names):
+    for name in names:
+        folder.joinpath(name).write_text(name)
+
+
+def test_pipeline_renames_and_organizes(tmp_path):
+    make_files(tmp_path, ["a_1.txt", "b_1.txt", "c.txt"])
+    rules = [renamer.RenameRule("_1", "_2"), renamer.OrganizeRule(tmp_path / "out", expression="^(a|b)")]
+
+    plan = renamer.validate(renamer.plan(renamer.scan(tmp_path), rules))
+    results = list(renamer.apply(plan, jobs=2))
+
+    assert all(r.done for r in results) and len(results) == 3
+    assert sorted(str(p.relative_to(tmp_path)) for p in tmp_path.rglob("*.txt")) == \
+        ["out/_Unmatched/c.txt", "out/a/a_2.txt", "out/b/b_2.txt"]
+
+
+def test_apply_is_lazy(tmp_path):
+    make_files(tmp_path, [f"f{i:03}.txt" for i in range(100)])
+    rule = api.PrependRule(".*", "p_")
+    plan = api.validate(api.plan(api.scan(tmp_path, rule.matcher), [rule]))
+
+    results = api.apply(plan, jobs=2)
+    first = next(results)
+    results.close()
+    moved = len(list(tmp_path.glob("p_*")))
+    # only the in-flight window ran, the rest of the plan is left untouched
+    assert first.done and 1 <= moved <= 2 * executor.WINDOW + 1
+    assert len(list(tmp_path.iterdir())) == 100
+
+
+def test_async_pipeline(tmp_path):
+    make_files(tmp_path, [f"f{i:03}_1.txt" for i in range(300)])
+    rule = api.RenameRule("_1", "_2")
+
+    async def run():
+        plan = await api.validate_async(api.plan(api.scan(tmp_path, rule.matcher), [rule]))
+        found = [f async for f in api.scan_async(tmp_path)]
+        done = [r.dst.name async for r in api.apply_async(plan, jobs=4, batch=16) if r.done]
+        return found, done
+
+    found, done = asyncio.run(run())
+    assert len(found) == 300 and len(done) == 300
+    assert sorted(done) == sorted(p.name for p in tmp_path.iterdir())
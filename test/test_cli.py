@@ -0,0 +1,106 @@
+import os, sys, time, subprocess, pytest
+from click.testing import CliRunner
+from renamer import functions as func
+from renamer import journal as jrn
+from renamer.renamer_cli import cli, commands
+
+HELP = "import sys; from renamer.renamer_cli import cli; cli(['{}', '--help'], standalone_mode=False); " \
+       "print(' '.join(sys.modules))"
+HEAVY = ["logging.config", "renamer.functions", "renamer.executor", "renamer.journal", "renamer.hashing",
+         "renamer.report", "renamer.dedupe", "renamer.cache", "sqlite3", "concurrent.futures", "pathlib"]
+
+
+def run_python(code: str) -> tuple[float, str]:
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    return time.perf_counter() - start, out
+
+
+@pytest.mark.parametrize("command", sorted(commands))
+def test_help_imports_no_heavy_modules(command):
+    modules = set(run_python(HELP.format(command))[1].split())
+    module = commands[command].split(":")[0]
+    assert module in modules
+    others = {m.split(":")[0] for m in commands.values()} - {module}
+    for heavy in HEAVY + sorted(others):
+        assert heavy not in modules
+
+
+def test_help_startup_time():
+    # best of a few cold runs, on top of importing click alone (the floor)
+    help_time = min(run_python(HELP.format("rename"))[0] for _ in range(5))
+    click_time = min(run_python("import click")[0] for _ in range(5))
+    assert help_time - click_time < 0.05
+
+
+def test_lazy_commands(tmp_path):
+    tmp_path.joinpath("a_1.txt").write_text("a")
+    result = CliRunner().invoke(cli, ["--help"])
+    assert all(name in result.output for name in commands)
+
+    result = CliRunner().invoke(cli, ["rename", "-c", str(tmp_path), "_1", "_2"])
+    assert result.exit_code == 0
+    assert [p.name for p in tmp_path.iterdir()] == ["a_2.txt"]
+
+
+@pytest.mark.parametrize("fmt", ["rnj", "rnj.gz"])
+def test_resume_and_restore_interrupted_run(tmp_path, fmt):
+    for name in ["a", "b", "c"]:
+        tmp_path.joinpath(f"{name}.txt").write_text(name)
+    a, b, c = (tmp_path / f"{n}.txt" for n in "abc")
+    plan = func.plan_renames({a: tmp_path / "x.txt", b: a, c: tmp_path / "y.txt"})
+    path = tmp_path / f"run.{fmt}"
+    # crash after the first move: the journal is never closed
+    journal = jrn.open_journal(path, fmt)
+    journal.write_intents(plan)
+    os.rename(a, tmp_path / "x.txt")
+    journal.append(a, tmp_path / "x.txt")
+    journal.sync()
+    crashed = path.read_bytes()
+    journal.close()
+    path.write_bytes(crashed)
+
+    result = CliRunner().invoke(cli, ["resume", str(path)])
+    assert result.exit_code == 0, result.output
+    assert {p.name: p.read_text() for p in tmp_path.glob("*.txt")} == {"x.txt": "a", "a.txt": "b", "y.txt": "c"}
+
+    result = CliRunner().invoke(cli, ["restore", str(path)])
+    assert result.exit_code == 0, result.output
+    assert {p.name: p.read_text() for p in tmp_path.glob("*.txt")} == {"a.txt": "a", "b.txt": "b", "c.txt": "c"}
+
+
+@pytest.mark.parametrize("incremental", [True, False])
+def test_earlier_journals_are_not_processed(tmp_path, incremental):
+    tree = tmp_path / "tree"
+    tree.mkdir()
+    tree.joinpath("a.txt").write_text("a")
+    state = ["--state", str(tmp_path / "state.json")] if incremental else []
+    result = CliRunner().invoke(cli, ["prepend", str(tree), "^[a-z]", "P_", *state])
+    assert result.exit_code == 0, result.output
+    time.sleep(1.1)  # journals are named after the second they were started in
+    tree.joinpath("b.txt").write_text("b")
+    result = CliRunner().invoke(cli, ["prepend", str(tree), "^[a-z]", "P_", *state])
+    assert result.exit_code == 0, result.output
+
+    names = sorted(p.name for p in tree.iterdir())
+    assert names[:2] == ["P_a.txt" if incremental else "P_P_a.txt", "P_b.txt"]
+    assert len(names) == 4 and all(n.startswith("rename-journal_tree_") for n in names[2:])
+
+
+def test_run_leaves_earlier_journals_in_place(tmp_path):
+    tree = tmp_path / "tree"
+    tree.mkdir()
+    rules = tmp_path / "rules.toml"
+    rules.write_text('[[rule]]\ntype = "organize"\nexpression = "^(.)"\n')
+    tree.joinpath("a.txt").write_text("a")
+    result = CliRunner().invoke(cli, ["run", str(rules), str(tree)])
+    assert result.exit_code == 0, result.output
+    first = [p.name for p in tree.glob("run-journal_*")]
+    time.sleep(1.1)  # journals are named after the second they were started in
+    tree.joinpath("b.txt").write_text("b")
+    result = CliRunner().invoke(cli, ["run", str(rules), str(tree)])
+    assert result.exit_code == 0, result.output
+
+    assert len(first) == 1 and tree.joinpath(first[0]).is_file()
+    assert len(list(tree.glob("run-journal_*"))) == 2
+    assert tree.joinpath("b", "b.txt").is_file() and not tree.joinpath("r").exists()
@@ -0,0 +1,157 @@
+import os, errno, pytest
+from renamer import executor
+from renamer import functions as func
+from pathlib import Path
+
+
+class ListJournal:
+    def __init__(self):
+        self.entries = []
+    def append(self, src, dst):
+        self.entries.append((src, dst))
+
+
+def test_plan_waves_chain_and_cycle():
+    moves = {
+        Path("a"): Path("b"),
+        Path("b"): Path("c"),
+        Path("x"): Path("y"),
+        Path("p"): Path("q"),
+        Path("q"): Path("p"),
+    }
+    waves, cycles = executor.plan_waves(moves)
+    assert waves == [[Path("b"), Path("x")], [Path("a")]]
+    assert cycles == [Path("p"), Path("q")]
+
+
+def test_apply_moves_respects_dependencies(tmp_path):
+    for name in ["a", "b", "c"]:
+        tmp_path.joinpath(name).write_text(name)
+    tmp_path.joinpath("taken").write_text("taken")
+    moves = {
+        tmp_path / "a": tmp_path / "b",
+        tmp_path / "b": tmp_path / "d",
+        tmp_path / "c": tmp_path / "taken",
+    }
+    journal = ListJournal()
+    result = executor.apply_moves(moves, jobs=4, quiet=True, journal=journal)
+
+    assert result == {tmp_path / "a": True, tmp_path / "b": True, tmp_path / "c": False}
+    assert tmp_path.joinpath("b").read_text() == "a"
+    assert tmp_path.joinpath("d").read_text() == "b"
+    assert tmp_path.joinpath("c").exists()
+    # journal keeps the execution order
+    assert journal.entries == [(tmp_path / "b", tmp_path / "d"), (tmp_path / "a", tmp_path / "b")]
+
+
+def test_make_folders(tmp_path):
+    executor.make_folders([tmp_path / "2026", tmp_path / "2026" / "02", tmp_path / "2025" / "12"], jobs=2, quiet=True)
+    assert tmp_path.joinpath("2026", "02").is_dir()
+    assert tmp_path.joinpath("2025", "12").is_dir()
+
+
+def test_apply_plan_swaps_files(tmp_path):
+    a, b = tmp_path / "a.txt", tmp_path / "b.txt"
+    a.write_text("a")
+    b.write_text("b")
+    journal = ListJournal()
+    plan = func.plan_renames({a: b, b: a})
+    result = executor.apply_plan(plan, jobs=2, quiet=True, journal=journal)
+
+    assert all(result.values())
+    assert a.read_text() == "b" and b.read_text() == "a"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.txt", "b.txt"]
+    tmp = plan.staging[a]
+    assert journal.entries == [(a, tmp), (b, a), (tmp, b)]
+
+
+def _cross_device(monkeypatch):
+    def rename(src, dst):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+    monkeypatch.setattr(executor.os, "rename", rename)
+
+
+def test_move_file_cross_device_copies(tmp_path, monkeypatch):
+    src, dst = tmp_path / "a.bin", tmp_path / "out" / "a.bin"
+    dst.parent.mkdir()
+    data = os.urandom(3 * 1024 * 1024 + 7)
+    src.write_bytes(data)
+    os.utime(src, (1_600_000_000, 1_600_000_000))
+    _cross_device(monkeypatch)
+    # no zero-copy syscall: plain read/write
+    monkeypatch.delattr(executor.os, "copy_file_range", raising=False)
+    monkeypatch.delattr(executor.os, "sendfile", raising=False)
+
+    assert executor.move_file(src, dst, verify=True)
+    assert not src.exists() and dst.read_bytes() == data
+    assert dst.stat().st_mtime == 1_600_000_000
+    assert os.listdir(dst.parent) == ["a.bin"]
+
+
+def test_move_file_failed_verification_keeps_source(tmp_path, monkeypatch):
+    src, dst = tmp_path / "a.bin", tmp_path / "b.bin"
+    src.write_bytes(b"content")
+    _cross_device(monkeypatch)
+    digests = iter(["x", "y"])
+    monkeypatch.setattr(executor.hashing, "full_digest", lambda f, a: next(digests))
+
+    with pytest.raises(OSError):
+        executor.move_file(src, dst, verify=True)
+    assert src.read_bytes() == b"content"
+    assert os.listdir(tmp_path) == ["a.bin"]
+
+
+def test_restore_waves_reused_temporary_name():
+    # swap journaled as a->tmp, b->a, tmp->b: replayed backwards
+    moves = [("b", "tmp"), ("a", "b"), ("tmp", "a"), ("x", "y")]
+    assert executor.restore_waves(moves) == [[("b", "tmp"), ("x", "y")], [("a", "b")], [("tmp", "a")]]
+
+
+def test_organize_plan_restored(tmp_path):
+    files = [tmp_path / f"{n}.txt" for n in ("a", "b")]
+    for f in files:
+        f.write_text(f.name)
+    plan = func.plan_renames({f: tmp_path / "2026" / "01" / f.name for f in files})
+    journal = ListJournal()
+    journal.mkdir = lambda folder: journal.entries.append(("mkdir", folder))
+    executor.make_folders(plan.moves.target_folders(), quiet=True, journal=journal)
+    executor.apply_plan(plan, jobs=2, quiet=True, journal=journal)
+    assert journal.entries[:2] == [("mkdir", tmp_path / "2026"), ("mkdir", tmp_path / "2026" / "01")]
+
+    moves = [(str(dst), str(src)) for src, dst in journal.entries[:1:-1]]
+    assert executor.restore_moves(moves, jobs=2, quiet=True) == 2
+    executor.remove_folders([str(f) for _, f in journal.entries[:2]], quiet=True)
+    assert sorted(os.listdir(tmp_path)) == ["a.txt", "b.txt"]
+
+
+def test_remove_folders_dryrun_keeps_folders_not_empty(tmp_path):
+    tmp_path.joinpath("x", "y").mkdir(parents=True)
+    tmp_path.joinpath("k").mkdir()
+    tmp_path.joinpath("k", "f.txt").write_text("f")
+    folders = [str(tmp_path / "x"), str(tmp_path / "x" / "y"), str(tmp_path / "k")]
+
+    # x is left empty once y is removed, k is not
+    assert executor.remove_folders(folders, quiet=True, dryrun=True) == 2
+    assert sorted(os.listdir(tmp_path)) == ["k", "x"]
+    assert executor.remove_folders(folders, quiet=True) == 2
+
+
+@pytest.mark.parametrize("names", [["a", "b"], ["a", "b", "c", "d"]])
+def test_apply_plan_failed_cycle_breaker_cancels_cycle(tmp_path, monkeypatch, names):
+    files = [tmp_path / f"{n}.txt" for n in names]
+    for f in files:
+        f.write_text(f.stem.upper())
+    move_file = executor.move_file
+
+    def failing(src, target, verify=False):
+        if target.name.startswith(".renamer-tmp"):
+            raise OSError(errno.EACCES, "Permission denied")
+        return move_file(src, target, verify)
+    monkeypatch.setattr(executor, "move_file", failing)
+
+    plan = func.plan_renames(dict(zip(files, files[1:] + files[:1])))
+    result = executor.apply_plan(plan, jobs=2, quiet=True)
+
+    assert not any(result.values())
+    # nothing was overwritten, every file is where it was
+    assert {f.name: f.read_text() for f in tmp_path.iterdir()} == {f.name: f.stem.upper() for f in files}
@@ -1,5 +1,6 @@
-import re, pytest, datetime
+import os, re, pytest, datetime
 from renamer import functions as func
+from renamer.metadata import MetaStore
 from types import SimpleNamespace
 from pathlib import Path
 
@@ -20,7 +21,7 @@ def test_extract_params_success():
 def test_rename_filename_regex_success(monkeypatch):
     dt_utc = datetime.datetime(2026, 2, 5, 8, 30, 0, tzinfo=datetime.timezone.utc)
     fixed_timestamp = int(dt_utc.timestamp())
-    fake_stat = SimpleNamespace(st_birthtime=fixed_timestamp)
+    fake_stat = SimpleNamespace(st_dev=1, st_ino=1, st_size=0, st_mtime_ns=0, st_birthtime=fixed_timestamp)
 
     def fake_stat_method(self):
         return fake_stat
@@ -46,40 +47,59 @@ def test_rename_filename_success(monkeypatch):
         f"Expected input parent '{input.parent}' to be equal to output parent '{out.parent}'"
 
 
-def test_find_files_mocked(monkeypatch):
-    class FakePath:
-        def __init__(self, name, is_file=True):
-            self.name = name
-            self._is_file = is_file
-        def is_file(self):
-            return self._is_file
-        def resolve(self):
-            return f"/mocked/path/{self.name}"
-    
-    fake_files = [
-        FakePath("a1.txt"),
-        FakePath("a2.csv"),
-        FakePath("b1.csv"),
-        FakePath("subdir", is_file=False),  # simulate a directory
-    ]
+def test_find_files_success(tmp_path):
+    tmp_path.joinpath("sub").mkdir()
+    for name in ["a2.csv", "a1.txt", "b1.csv", "sub/a3.txt"]:
+        tmp_path.joinpath(name).write_text("x")
+    tmp_path.joinpath("a_dir").mkdir()  # directories are never returned
+
+    result = func.find_files(tmp_path, re.compile(r"^a\d.*\.*"))
+    assert not isinstance(result, list), "find_files should stream its results"
+
+    base = tmp_path.resolve()
+    assert list(result) == [base / "a1.txt", base / "a2.csv", base / "sub" / "a3.txt"]
+
 
-    def fake_rglob(self, pattern):
-        return fake_files
+def test_walk_files_yields_sorted_entries(tmp_path):
+    for name in ["b", "a/z", "a/c", "a.txt"]:
+        tmp_path.joinpath(name).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.joinpath(name).write_text("x")
 
-    monkeypatch.setattr(Path, "rglob", fake_rglob)
+    paths = [Path(e.path) for e in func.walk_files(tmp_path)]
+    assert paths == sorted(paths)
+    assert len(paths) == 4
 
-    base = Path("/does/not/matter")
-    result = func.find_files(base, re.compile(r"^a\d.*\.*"))
 
-    assert len(result) == 2
-    assert "/mocked/path/a1.txt" in result
-    assert "/mocked/path/a2.csv" in result
+def test_walk_filter_prunes_folders(tmp_path, monkeypatch):
+    for name in [".git/x.jpg", "a/@eaDir/x.jpg", "a/b.jpg", "a/b.txt", "a/deep/c.jpg", "2024/01/d.jpg",
+                 "2024/raw/e.jpg", "other/f.jpg", "g.jpg"]:
+        tmp_path.joinpath(name).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.joinpath(name).write_text("x")
+    base = tmp_path.resolve()
+    listed = []
+    sorted_entries = func._sorted_entries
+    monkeypatch.setattr(func, "_sorted_entries", lambda folder: listed.append(folder) or sorted_entries(folder))
+
+    def walk(**rules):
+        listed.clear()
+        return [os.path.relpath(e.path, base) for e in func.walk_files(base, walk_filter=func.WalkFilter(**rules))]
+
+    assert walk(exclude=[".GIT", "@eaDir", "2024/raw"], names=["*.jpg"]) == \
+        ["2024/01/d.jpg", "a/b.jpg", "a/deep/c.jpg", "g.jpg", "other/f.jpg"]
+    assert str(base / ".git") not in listed and str(base / "a" / "@eaDir") not in listed
+    assert walk(max_depth=1, names=["*.jpg"]) == [".git/x.jpg", "a/b.jpg", "g.jpg", "other/f.jpg"]
+
+    # only folders that can lead to 2024/0* are entered
+    assert walk(include=["2024/0*"]) == ["2024/01/d.jpg"]
+    assert str(base / "a") not in listed and str(base / "2024" / "raw") not in listed
+    assert walk(include=["deep"]) == ["a/deep/c.jpg"]
+    assert func.make_walk_filter() is None
 
 
 def test_time_extractor_success(monkeypatch) -> Path:
     dt_utc = datetime.datetime(2026, 2, 5, 8, 30, 0, tzinfo=datetime.timezone.utc)
     fixed_timestamp = int(dt_utc.timestamp())
-    fake_stat = SimpleNamespace(st_birthtime=fixed_timestamp)
+    fake_stat = SimpleNamespace(st_dev=1, st_ino=1, st_size=0, st_mtime_ns=0, st_birthtime=fixed_timestamp)
 
     def fake_stat_method(self):
         return fake_stat
@@ -97,6 +117,28 @@ def test_regex_extractor_success(monkeypatch) -> Path:
     input = Path("some_filename_about_something.png")
     assert func.regex_extractor(input, ".*_(.+)\\..*").name == "something"
     assert func.regex_extractor(input, "^.{4}").name == "some"
+
+
+def test_folder_matcher_first_expression_wins():
+    matcher = func.compile_folder_matcher(("IMG_([0-9]{4})", "(?:VID|MOV)_([0-9]{4})", "screenshot"))
+    assert func.regex_extractor(Path("VID_2019_IMG_2020.mp4"), matcher).name == "2020"
+    assert func.regex_extractor(Path("MOV_2018.mov"), matcher).name == "2018"
+    assert func.regex_extractor(Path("a_screenshot.png"), matcher).name == "screenshot"
+    assert func.regex_extractor(Path("other.txt"), matcher).name == "_Unmatched"
+    assert func.compile_folder_matcher(("IMG_([0-9]{4})",)) is func.compile_folder_matcher(("IMG_([0-9]{4})",))
+
+
+@pytest.mark.parametrize("expressions,name,folder", [
+    (("(?i)img_([0-9]{4})",), "a_IMG_2020.jpg", "2020"),
+    ((r"(\w)_\1", "IMG_([0-9]{4})"), "b_a_a.jpg", "a"),
+    ((r"(\w)_\1", "IMG_([0-9]{4})"), "x_IMG_2020.jpg", "2020"),
+    (("(?P<y>[0-9]{4})_x", "IMG_(?P<y>[0-9]{4})"), "IMG_2020.jpg", "2020"),
+    (("(?i)img_([0-9]{4})", "VID"), "VID_img_2021.mp4", "2021"),
+])
+def test_folder_matcher_expressions_kept_as_written(expressions, name, folder):
+    # inline flags, backreferences and repeated group names work as with a single re.search
+    matcher = func.compile_folder_matcher(expressions)
+    assert func.regex_extractor(Path(name), matcher).name == folder
  
 
 def test_manage_name_conflicts_empty_map():
@@ -149,4 +191,73 @@ def test_manage_name_conflicts_nested_paths():
         Path("folder/b.txt"): Path("folder/file_001.txt"),
         Path("folder/c.txt"): Path("folder/file_002.txt"),
     }
-    assert result == expected
\ No newline at end of file
+    assert result == expected
+
+def test_plan_renames_existing_target(tmp_path):
+    for name in ["a.txt", "file.txt"]:
+        tmp_path.joinpath(name).write_text(name)
+    plan = func.plan_renames({tmp_path / "a.txt": tmp_path / "file.txt"})
+    assert plan.targets == {tmp_path / "a.txt": tmp_path / "file_001.txt"}
+    assert plan.staging == {}
+
+
+def test_plan_renames_chain_frees_target(tmp_path):
+    for name in ["a.txt", "b.txt"]:
+        tmp_path.joinpath(name).write_text(name)
+    rename_map = {tmp_path / "a.txt": tmp_path / "b.txt", tmp_path / "b.txt": tmp_path / "c.txt"}
+    plan = func.plan_renames(rename_map)
+    assert plan.targets == rename_map
+    assert plan.moves == rename_map
+
+
+def test_plan_renames_cycle_uses_temporary_name(tmp_path):
+    for name in ["a.txt", "b.txt"]:
+        tmp_path.joinpath(name).write_text(name)
+    a, b = tmp_path / "a.txt", tmp_path / "b.txt"
+    plan = func.plan_renames({a: b, b: a})
+    assert plan.targets == {a: b, b: a}
+    assert len(plan.staging) == 1
+    tmp = plan.staging[a]
+    assert plan.moves == {tmp: b, b: a}
+    assert plan.origins == {tmp: a}
+
+
+def test_find_cycles():
+    moves = {Path("a"): Path("b"), Path("b"): Path("c"), Path("c"): Path("a"), Path("x"): Path("a")}
+    assert func.find_cycles(moves) == [[Path("a"), Path("b"), Path("c")]]
+
+
+def test_replace_template_group_ambiguity():
+    matcher = re.compile("(a)(b)(c)(d)(e)(f)(g)(h)(i)(j)(k)")
+    m = matcher.match("abcdefghijk")
+    file = Path("abcdefghijk")
+    assert func.compile_template("$10_${1}0_$0").render(file, m) == "j_a0_abcdefghijk"
+
+
+def test_replace_template_tokens(monkeypatch):
+    fake_stat = SimpleNamespace(st_dev=1, st_ino=1, st_size=1234, st_mtime_ns=0, st_birthtime=0)
+    monkeypatch.setattr(Path, "stat", lambda self: fake_stat)
+
+    matcher = func.compile_matcher("(.*)\\.(.*)", True)
+    template = func.compile_template("${counter:3}_${size}_$1.${ext}")
+    out = [func.rename_filename_regex(Path(name), matcher, template).name for name in ["a.jpg", "b.png"]]
+    assert out == ["001_1234_a.jpg", "002_1234_b.png"]
+
+    with pytest.raises(Exception):
+        func.compile_template("${whatever}")
+
+
+def test_metadata_store_filled_by_walk(tmp_path, monkeypatch):
+    tmp_path.joinpath("a.jpg").write_text("a")
+    store = MetaStore()
+    files = list(func.find_files(tmp_path, store=store))
+    assert len(store) == 1
+
+    def no_stat(self):
+        raise AssertionError("file stat'ed twice")
+    monkeypatch.setattr(Path, "stat", no_stat)
+
+    assert func.time_extractor(files[0], "YEAR", store).name == \
+        datetime.datetime.fromtimestamp(store.get(files[0]).birthtime).strftime("%Y")
+    matcher = func.compile_matcher("(.*)", True)
+    assert func.rename_filename_regex(files[0], matcher, "${size}_$1", store).name == "1_a.jpg"
@@ -0,0 +1,133 @@
+import pytest
+from renamer import functions as func
+from renamer import hashing
+from renamer.cache import HashCache
+from pathlib import Path
+
+
+def write(path: Path, content: bytes) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    return path
+
+
+def test_partial_digest_reads_head_and_tail(tmp_path):
+    size = 10 * hashing.PARTIAL_CHUNK
+    a = write(tmp_path / "a.bin", b"x" * size)
+    stats = hashing.HashStats()
+    hashing.partial_digest(a, size, "blake2b", stats)
+    assert stats.bytes_read == 2 * hashing.PARTIAL_CHUNK
+
+
+def test_find_duplicates_by_content(tmp_path):
+    big = b"a" * (3 * hashing.PARTIAL_CHUNK)
+    # same size, same head and tail, different middle
+    other = big[:hashing.PARTIAL_CHUNK] + b"b" * hashing.PARTIAL_CHUNK + big[-hashing.PARTIAL_CHUNK:]
+    write(tmp_path / "one" / "big.bin", big)
+    write(tmp_path / "two" / "big_copy.bin", big)
+    write(tmp_path / "two" / "big_other.bin", other)
+    write(tmp_path / "one" / "small.txt", b"hello")
+    write(tmp_path / "two" / "small.txt", b"hello")
+    write(tmp_path / "two" / "unique.txt", b"world!")
+
+    stats = hashing.HashStats()
+    result = func.find_duplicates([tmp_path / "one", tmp_path / "two"], (), "full", "blake2b", stats)
+    groups = sorted([p.name for p in v] for v in result.values())
+    assert groups == [["big.bin", "big_copy.bin"], ["small.txt", "small.txt"]]
+    assert stats.files == 6
+    assert stats.bytes_skipped >= len(b"world!")
+    # the big files are read by both stages, their bytes are counted once
+    assert stats.bytes_distinct + stats.bytes_skipped == stats.bytes_total
+    assert stats.bytes_read > stats.bytes_distinct
+
+    partial = func.find_duplicates([tmp_path / "one", tmp_path / "two"], (), "partial")
+    assert sorted(len(v) for v in partial.values()) == [2, 3]
+
+
+def test_find_duplicates_single_folder(tmp_path):
+    write(tmp_path / "a.txt", b"same")
+    write(tmp_path / "sub" / "b.txt", b"same")
+    result = func.find_duplicates([tmp_path], ())
+    assert len(result) == 1
+
+
+def test_find_duplicates_excludes(tmp_path):
+    for name in ["a.txt", "node_modules/b.txt", "keep/c.txt", "keep/skip_d.txt", "e.bin"]:
+        write(tmp_path / name, b"same")
+    walk_filter = func.WalkFilter(exclude=["node_modules"], names=["*.txt"])
+    result = func.find_duplicates([tmp_path], ("SKIP_",), walk_filter=walk_filter)
+    assert [sorted(p.name for p in v) for v in result.values()] == [["a.txt", "c.txt"]]
+
+
+def test_find_duplicates_invalid_mode(tmp_path):
+    with pytest.raises(Exception):
+        func.find_duplicates([tmp_path], (), "whatever")
+
+
+def test_find_duplicates_with_cache(tmp_path):
+    content = b"c" * (3 * hashing.PARTIAL_CHUNK)
+    a = write(tmp_path / "data" / "a.bin", content)
+    write(tmp_path / "data" / "b.bin", content)
+    cache_path = tmp_path / "cache.sqlite"
+
+    with HashCache(cache_path) as cache:
+        first = hashing.HashStats()
+        func.find_duplicates([tmp_path / "data"], (), stats=first, cache=cache)
+    assert first.bytes_read > 0 and first.cache_hits == 0
+
+    with HashCache(cache_path) as cache:
+        second = hashing.HashStats()
+        result = func.find_duplicates([tmp_path / "data"], (), stats=second, cache=cache)
+    assert len(result) == 1
+    assert second.bytes_read == 0
+    assert second.bytes_skipped == second.bytes_total
+
+    # a changed file is a cache miss
+    a.write_bytes(b"d" * (3 * hashing.PARTIAL_CHUNK))
+    with HashCache(cache_path) as cache:
+        third = hashing.HashStats()
+        assert func.find_duplicates([tmp_path / "data"], (), stats=third, cache=cache) == {}
+    assert third.bytes_read > 0
+
+
+def test_hash_cache_evicts_least_recently_used(tmp_path):
+    with HashCache(tmp_path / "c.sqlite", max_entries=2) as cache:
+        cache.put((1, 1, 10, 100), "full", "blake2b", "old")
+    with HashCache(tmp_path / "c.sqlite", max_entries=2) as cache:
+        cache.put((1, 2, 10, 100), "full", "blake2b", "new")
+        cache.put((1, 3, 10, 100), "full", "blake2b", "newer")
+    with HashCache(tmp_path / "c.sqlite", max_entries=2) as cache:
+        assert cache.get((1, 1, 10, 100), "full", "blake2b") is None
+        assert cache.get((1, 3, 10, 100), "full", "blake2b") == "newer"
+
+
+@pytest.mark.parametrize("jobs,processes", [(4, False), (2, True)])
+def test_find_duplicates_parallel_is_deterministic(tmp_path, jobs, processes):
+    for i in range(30):
+        write(tmp_path / f"d{i % 3}" / f"f{i:02d}.bin", bytes([i % 5]) * (i % 5 + 1) * hashing.PARTIAL_CHUNK)
+
+    serial = func.find_duplicates([tmp_path], ())
+    parallel = func.find_duplicates([tmp_path], (), jobs=jobs, processes=processes)
+    assert list(serial.items()) == list(parallel.items())
+
+
+@pytest.mark.parametrize("jobs,shards", [(1, 1), (4, 1), (4, 3)])
+def test_find_duplicates_many_roots(tmp_path, jobs, shards):
+    for i in range(40):
+        write(tmp_path / f"disk{i % 4}" / f"f{i:02d}.bin", bytes([i % 5]) * (i % 5 + 1) * 100)
+    roots = [tmp_path / f"disk{d}" for d in range(4)]
+
+    with HashCache(tmp_path / "cache.sqlite") as cache:
+        # repeated and nested roots are walked once
+        result = func.find_duplicates(roots + [roots[0], roots[1] / "."], jobs=jobs, shards=shards, cache=cache)
+    assert sorted(len(v) for v in result.values()) == [8] * 5
+    # every group spans all the roots, in root then walk order
+    for files in result.values():
+        assert [f.parent.name for f in files] == sorted(f.parent.name for f in files)
+        assert {f.parent.name for f in files} == {"disk0", "disk1", "disk2", "disk3"}
+
+    serial = func.find_duplicates(roots)
+    assert sorted(map(tuple, result.values())) == sorted(map(tuple, serial.values()))
+    if shards == 1:
+        assert list(result.items()) == list(serial.items())
+    assert func.distinct_roots([roots[2], tmp_path, roots[2]]) == [tmp_path.resolve()]
@@ -0,0 +1,86 @@
+import pytest
+from types import SimpleNamespace
+from renamer import journal as jrn
+from pathlib import Path
+
+ENTRIES = [("/data/a.txt", "/data/b.txt"), ("/data/x: y.txt", "/data/z: w.txt"), ("/data/è.txt", "/data/e.txt")]
+
+
+@pytest.mark.parametrize("fmt", jrn.journal_formats)
+def test_journal_round_trip(tmp_path, fmt):
+    path = tmp_path / f"journal.{fmt}"
+    with jrn.open_journal(path, fmt, sync_every=2) as journal:
+        for src, dst in ENTRIES:
+            journal.append(src, dst)
+
+    assert jrn.detect_format(path) == fmt
+    assert list(jrn.read_journal(path)) == ENTRIES
+
+
+def test_binary_journal_truncated_record(tmp_path):
+    path = tmp_path / "journal.rnj"
+    with jrn.open_journal(path, "rnj") as journal:
+        for src, dst in ENTRIES:
+            journal.append(src, dst)
+    with open(path, "ab") as f:
+        f.write(jrn.encode_record(jrn.MOVE, "/data/c", "/data/d")[:-3])
+
+    assert list(jrn.read_journal(path)) == ENTRIES
+
+
+def test_convert_legacy_journal(tmp_path):
+    legacy = tmp_path / "journal.yaml"
+    legacy.write_text("".join(f"{src}: {dst}\n" for src, dst in ENTRIES), encoding="utf-8")
+
+    assert jrn.convert_journal(legacy, tmp_path / "journal.rnj.gz", "rnj.gz") == len(ENTRIES)
+    assert list(jrn.read_journal(tmp_path / "journal.rnj.gz")) == ENTRIES
+
+
+def test_read_pending_write_ahead_journal(tmp_path):
+    plan = SimpleNamespace(staging={"/d/a": "/d/tmp"}, moves={"/d/tmp": "/d/b", "/d/b": "/d/a", "/d/c": "/d/e"})
+    path = tmp_path / "journal.rnj"
+    with jrn.open_journal(path, "rnj") as journal:
+        journal.write_intents(plan)
+        journal.append("/d/a", "/d/tmp")
+        journal.append("/d/b", "/d/a")
+
+    staging, moves = jrn.read_pending(path)
+    assert staging == {}
+    assert moves == {"/d/tmp": "/d/b", "/d/c": "/d/e"}
+
+    with jrn.open_journal(path, "rnj", resume=True) as journal:
+        journal.append("/d/c", "/d/e")
+    assert jrn.read_pending(path) == ({}, {"/d/tmp": "/d/b"})
+    # restore only sees applied moves
+    assert jrn.read_restore(path) == ([("/d/e", "/d/c"), ("/d/a", "/d/b"), ("/d/tmp", "/d/a")], [])
+
+
+@pytest.mark.parametrize("fmt", jrn.journal_formats)
+def test_read_restore_with_created_folders(tmp_path, fmt):
+    path = tmp_path / f"journal.{fmt}"
+    with jrn.open_journal(path, fmt) as journal:
+        journal.mkdir("/data/2026")
+        for src, dst in ENTRIES:
+            journal.append(src, dst)
+
+    moves, folders = jrn.read_restore(path)
+    assert moves == [(dst, src) for src, dst in ENTRIES[::-1]]
+    assert folders == ["/data/2026"]
+
+
+@pytest.mark.parametrize("fmt", ["rnj", "rnj.gz"])
+def test_resume_after_crash(tmp_path, fmt):
+    path = tmp_path / f"journal.{fmt}"
+    journal = jrn.open_journal(path, fmt)
+    journal.append(*ENTRIES[0])
+    journal.sync()
+    crashed = path.read_bytes() + b"\x01\x02"  # never closed, a partial write at the end
+    journal.close()
+    path.write_bytes(crashed)
+
+    with jrn.open_journal(path, fmt, resume=True) as journal:
+        journal.append(*ENTRIES[1])
+    with jrn.open_journal(path, fmt, resume=True) as journal:
+        journal.append(*ENTRIES[2])
+    assert list(jrn.read_journal(path)) == ENTRIES
+    assert jrn.read_restore(path)[0] == [(dst, src) for src, dst in ENTRIES[::-1]]
@@ -0,0 +1,100 @@
+import struct, datetime
+from pathlib import Path
+from renamer import media
+from renamer.cache import HashCache
+from renamer.metadata import MetaStore
+
+
+def _tiff(date: str) -> bytes:
+    # big endian TIFF: IFD0 with a pointer to the EXIF IFD holding DateTimeOriginal
+    value = date.encode() + b"\x00"
+    exif_ifd = 8 + 2 + 12 + 4
+    date_offset = exif_ifd + 2 + 12 + 4
+    ifd0 = struct.pack(">H", 1) + struct.pack(">HHII", 0x8769, 4, 1, exif_ifd) + b"\x00" * 4
+    exif = struct.pack(">H", 1) + struct.pack(">HHII", 0x9003, 2, len(value), date_offset) + b"\x00" * 4
+    return b"MM\x00\x2a" + struct.pack(">I", 8) + ifd0 + exif + value
+
+
+def _box(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I", 8 + len(payload)) + kind + payload
+
+
+def make_jpeg(path: Path, date: str) -> Path:
+    app1 = b"Exif\x00\x00" + _tiff(date)
+    path.write_bytes(b"\xff\xd8" + b"\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1
+                     + b"\xff\xda" + b"\x00" * 1000)
+    return path
+
+
+def make_mp4(path: Path, created: int) -> Path:
+    mvhd = _box(b"mvhd", b"\x00" * 4 + struct.pack(">II", created, created) + b"\x00" * 88)
+    # moov after the media data, as written by most cameras
+    path.write_bytes(_box(b"ftyp", b"isom" + b"\x00" * 4) + _box(b"mdat", b"\x00" * 5000) + _box(b"moov", mvhd))
+    return path
+
+
+def make_heic(path: Path, date: str) -> Path:
+    exif = struct.pack(">I", 6) + b"Exif\x00\x00" + _tiff(date)
+    infe = _box(b"infe", b"\x02\x00\x00\x00" + struct.pack(">HH", 7, 0) + b"Exif")
+    iinf = _box(b"iinf", b"\x00" * 4 + struct.pack(">H", 1) + infe)
+    ftyp = _box(b"ftyp", b"heic" + b"\x00" * 4)
+
+    def build(offset):
+        iloc = _box(b"iloc", b"\x00" * 4 + bytes([0x44, 0x00]) + struct.pack(">HHHHII", 1, 7, 0, 1, offset, len(exif)))
+        return _box(b"meta", b"\x00" * 4 + iinf + iloc)
+
+    meta = build(0)
+    path.write_bytes(ftyp + build(len(ftyp) + len(meta)) + exif)
+    return path
+
+
+def _ts(date: str) -> float:
+    return datetime.datetime.strptime(date, "%Y:%m:%d %H:%M:%S").timestamp()
+
+
+def test_read_capture_time(tmp_path):
+    assert media.read_capture_time(make_jpeg(tmp_path / "a.jpg", "2019:07:14 10:30:00")) == _ts("2019:07:14 10:30:00")
+    assert media.read_capture_time(make_heic(tmp_path / "b.HEIC", "2021:01:02 03:04:05")) == _ts("2021:01:02 03:04:05")
+    created = 3_800_000_000  # seconds since 1904
+    expected = datetime.datetime(1904, 1, 1, tzinfo=datetime.timezone.utc).timestamp() + created
+    assert media.read_capture_time(make_mp4(tmp_path / "c.mp4", created)) == expected
+
+    tmp_path.joinpath("d.jpg").write_bytes(b"not a jpeg")
+    tmp_path.joinpath("e.txt").write_bytes(b"text")
+    assert media.read_capture_time(tmp_path / "d.jpg") is None
+    assert media.read_capture_time(tmp_path / "e.txt") is None
+
+
+def test_with_capture_times_cached(tmp_path, monkeypatch):
+    files = [make_jpeg(tmp_path / f"{i}.jpg", f"2020:0{i}:01 00:00:00") for i in range(1, 4)]
+    files.append(tmp_path / "notes.txt")
+    files[-1].write_text("x")
+
+    with HashCache(tmp_path / "cache.db") as cache:
+        store = MetaStore()
+        assert list(media.with_capture_times(iter(files), store, 2, cache)) == files
+        assert [store.get(f).taken for f in files] == [_ts(f"2020:0{i}:01 00:00:00") for i in range(1, 4)] + [None]
+
+    # second run: no file is parsed again
+    monkeypatch.setattr(media, "read_capture_time", lambda f: 1 / 0)
+    with HashCache(tmp_path / "cache.db") as cache:
+        store = MetaStore()
+        list(media.with_capture_times(iter(files), store, 2, cache))
+        assert store.get(files[0]).taken == _ts("2020:01:01 00:00:00")
+
+
+def test_truncated_headers(tmp_path):
+    # a moov box holding an empty mvhd box, an iinf/iloc without payload
+    tmp_path.joinpath("empty.mp4").write_bytes(_box(b"moov", _box(b"mvhd", b"")))
+    tmp_path.joinpath("empty.heic").write_bytes(_box(b"meta", b"\x00" * 4 + _box(b"iinf", b"") + _box(b"iloc", b"")))
+    files = [tmp_path / "empty.mp4", tmp_path / "empty.heic"]
+    # every prefix of valid files, cut inside the headers
+    for source in [make_heic(tmp_path / "src.heic", "2021:01:02 03:04:05"), make_mp4(tmp_path / "src.mp4", 1)]:
+        data = source.read_bytes()
+        for n in range(max(0, len(data) - 300), len(data)):
+            files.append(tmp_path / f"cut_{n}{source.suffix}")
+            files[-1].write_bytes(data[:n])
+
+    store = MetaStore()
+    assert list(media.with_capture_times(iter(files), store, jobs=2)) == files
+    assert store.get(files[0]).taken is None and store.get(files[1]).taken is None
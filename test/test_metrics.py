@@ -0,0 +1,27 @@
+from renamer import functions as func
+from renamer.metrics import Metrics, metrics
+
+
+def test_disabled_metrics_record_nothing():
+    m = Metrics()
+    with m.phase("scan"):
+        m.add("files", 3)
+    assert not m.timers and not m.counters
+
+
+def test_metrics_collects_phases_and_counters(tmp_path):
+    tmp_path.joinpath("sub").mkdir()
+    tmp_path.joinpath("sub", "a.txt").write_text("a")
+    tmp_path.joinpath("b.txt").write_text("b")
+
+    metrics.start()
+    try:
+        list(func.find_files(tmp_path))
+        func.plan_renames({tmp_path / "b.txt": tmp_path / "c.txt"})
+        summary = metrics.summary()
+    finally:
+        metrics.enabled = False
+
+    assert summary["counters"]["dirs_scanned"] == 2
+    assert summary["counters"]["entries_scanned"] == 3
+    assert "plan" in summary["phases"]
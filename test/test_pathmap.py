@@ -0,0 +1,36 @@
+import os
+from pathlib import Path
+from renamer import functions as func
+from renamer.pathmap import PathMap
+
+
+def test_path_map_spill(tmp_path):
+    entries = {tmp_path / f"d{i % 3}" / f"f{i}.txt": tmp_path / "out" / f"g{i}.txt" for i in range(2500)}
+    m = PathMap(spill_after=1000)
+    for src, dst in entries.items():
+        m.add(src, dst)
+
+    assert len(m) == 2500
+    assert len(m.folders) == 4  # folders are interned
+    assert m == entries and list(m) == list(entries)
+    assert m[tmp_path / "d1" / "f1.txt"] == tmp_path / "out" / "g1.txt"  # spilled
+    assert m[tmp_path / "d2" / "f2498.txt"] == tmp_path / "out" / "g2498.txt"  # in memory
+    assert m.target_folders() == {tmp_path / "out"}
+
+    spill_file = m._db.execute("PRAGMA database_list").fetchone()[2]
+    assert os.path.exists(spill_file)
+    m.close()
+    assert not os.path.exists(spill_file)
+
+
+def test_plan_renames_spilled_same_plan(tmp_path):
+    rename_map = {tmp_path / f"f{i}.txt": tmp_path / f"same_{i % 7}.txt" for i in range(3000)}
+    rename_map[tmp_path / "a"] = tmp_path / "b"
+    rename_map[tmp_path / "b"] = tmp_path / "a"
+    plan = func.plan_renames(rename_map)
+    spilled = func.plan_renames(rename_map, spill_after=1000)
+
+    assert spilled.targets._db is not None
+    assert dict(spilled.targets.items()) == dict(plan.targets.items())
+    assert dict(spilled.moves.items()) == dict(plan.moves.items())
+    assert spilled.staging == plan.staging and spilled.chained == plan.chained
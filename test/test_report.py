@@ -0,0 +1,48 @@
+import os, pytest
+from renamer import functions as func
+from renamer import report
+from renamer.dedupe import dedupe
+from renamer.metadata import MetaStore
+
+
+def write(path, content: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    return path
+
+
+@pytest.mark.parametrize("fmt,shards", [("jsonl", 1), ("csv", 2)])
+def test_report_roundtrip_and_wasted_bytes(tmp_path, monkeypatch, fmt, shards):
+    write(tmp_path / "a" / "x.bin", b"x" * 100)
+    write(tmp_path / "b" / "x.bin", b"x" * 100)
+    os.link(tmp_path / "b" / "x.bin", tmp_path / "b" / "x_link.bin")
+    write(tmp_path / "b" / "y.txt", b"yy")
+    write(tmp_path / "c" / "y.txt", b"yy")
+    roots = [tmp_path / "a", tmp_path / "b", tmp_path / "c"]
+    store = MetaStore()
+
+    with report.ReportWriter(tmp_path / f"report.{fmt}", fmt, roots, store) as writer:
+        for (_, digest), files in func.iter_duplicates(roots, store=store, shards=shards):
+            # sizes and inodes come from the walk
+            with monkeypatch.context() as m:
+                m.setattr(os, "stat", None)
+                writer.write("full", digest, files)
+    # hardlinks of a counted copy are not wasted
+    assert dict(writer.wasted) == {str(roots[1]): 100, str(roots[2]): 2}
+
+    groups = list(report.read_report(tmp_path / f"report.{fmt}"))
+    assert [len(records) for _, records in groups] == [3, 2]
+    assert groups[0][1][1]["root"] == str(roots[1]) and groups[0][1][1]["size"] == 100
+
+
+def test_dedupe_hardlinks_verified_copies(tmp_path):
+    keep = write(tmp_path / "keep.bin", b"same")
+    copy = write(tmp_path / "copy.bin", b"same")
+    changed = write(tmp_path / "changed.bin", b"same")
+    records = [{"path": str(p), "size": 4, "inode": p.stat().st_ino} for p in (keep, copy, changed)]
+    changed.write_bytes(b"diff")
+
+    stats = dedupe([("full", records), ("size", records)])
+    assert (stats.linked, stats.bytes_saved, stats.skipped) == (1, 4, 1 + 3)
+    assert copy.stat().st_ino == keep.stat().st_ino
+    assert changed.read_bytes() == b"diff"
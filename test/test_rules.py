@@ -0,0 +1,58 @@
+import datetime, pytest
+from pathlib import Path
+from renamer import rules
+from renamer.metadata import MetaStore
+
+RULES = """
+directory = "tree"
+
+[[rule]]
+type = "rename"
+matcher = "_2026"
+replace = "_X"
+
+[[rule]]
+type = "prepend"
+matcher = ".*IMG"
+prefix = "P_"
+
+[[rule]]
+type = "organize"
+expression = ["IMG_([0-9]+)_", "(DOC)"]
+output = "sorted"
+"""
+
+
+def test_load_rules_and_chain(tmp_path):
+    tmp_path.joinpath("tree").mkdir()
+    tmp_path.joinpath("rules.toml").write_text(RULES)
+    directory, chain = rules.load_rules(tmp_path / "rules.toml")
+    assert directory == tmp_path.joinpath("tree").resolve()
+    assert [type(r) for r in chain] == [rules.RenameRule, rules.PrependRule, rules.OrganizeRule]
+
+    assert rules.final_path(directory / "IMG_01_2026.jpg", chain) == directory / "sorted" / "01" / "P_IMG_01_X.jpg"
+    assert rules.final_path(directory / "DOC.txt", chain) == directory / "sorted" / "DOC" / "DOC.txt"
+
+
+def test_load_rules_errors(tmp_path):
+    tmp_path.joinpath("rules.toml").write_text('[[rule]]\ntype = "prepend"\nmatcher = "x"\n')
+    with pytest.raises(Exception, match="rule 1 \\(prepend\\): missing 'prefix'"):
+        rules.load_rules(tmp_path / "rules.toml", tmp_path)
+
+    tmp_path.joinpath("rules.toml").write_text('[[rule]]\ntype = "organize"\ntime = "MONTH"\nexpression = "x"\n')
+    with pytest.raises(Exception, match="exactly one of"):
+        rules.load_rules(tmp_path / "rules.toml", tmp_path)
+
+
+def test_organize_time_source_is_per_rule(tmp_path):
+    file = tmp_path / "a.jpg"
+    file.write_text("a")
+    store = MetaStore()
+    # a capture time read for another rule of the chain (2001)
+    store.get(file).taken = datetime.datetime(2001, 5, 1).timestamp()
+    birthtime = datetime.datetime.fromtimestamp(store.get(file).birthtime).strftime("%Y")
+
+    media = rules.OrganizeRule(tmp_path / "m", time="YEAR", time_source="media")
+    plain = rules.OrganizeRule(tmp_path / "b", time="YEAR")
+    assert media.apply(file, store) == (tmp_path / "m" / "2001" / "a.jpg").resolve()
+    assert plain.apply(file, store) == (tmp_path / "b" / birthtime / "a.jpg").resolve()
@@ -0,0 +1,47 @@
+import pytest
+from renamer import similar
+from renamer.cache import HashCache
+
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+
+
+def picture(seed: int, size: int = 256) -> "Image.Image":
+    """Smooth random shapes: perceptual hashes of different seeds are far apart"""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 255, (6, 6, 3), dtype=np.uint8)
+    return Image.fromarray(small).resize((size, size), Image.Resampling.BICUBIC)
+
+
+@pytest.mark.parametrize("kind", similar.hash_functions)
+def test_find_similar_groups_resized_copies(tmp_path, kind):
+    picture(1).save(tmp_path / "a.jpg", quality=90)
+    picture(1, 120).save(tmp_path / "a_small.png")
+    picture(1).save(tmp_path / "a_low.jpg", quality=30)
+    picture(2).save(tmp_path / "b.jpg")
+    tmp_path.joinpath("broken.jpg").write_bytes(b"not an image")
+
+    with HashCache(tmp_path / "cache.sqlite") as cache:
+        result = similar.find_similar([tmp_path], kind=kind, cache=cache)
+    assert [[p.name for p in v] for v in result.values()] == [["a.jpg", "a_low.jpg", "a_small.png"]]
+
+    with HashCache(tmp_path / "cache.sqlite") as cache:
+        again = similar.find_similar([tmp_path], kind=kind, cache=cache)
+        assert cache.hits == 5  # broken images are cached as well
+    assert again == result
+
+
+@pytest.mark.parametrize("table_bits", [20, 0])
+def test_near_pairs_matches_brute_force(monkeypatch, table_bits):
+    monkeypatch.setattr(similar, "TABLE_BITS", table_bits)
+    rng = np.random.default_rng(7)
+    hashes = rng.integers(0, 2**63, 1000, dtype=np.uint64)
+    for i in range(0, 180, 2):  # near copies, 0 to 8 bits apart
+        flips = rng.choice(64, i % 9, replace=False)
+        hashes[i + 1] = hashes[i] ^ np.uint64(sum(1 << int(b) for b in flips))
+
+    found = {(a, b) for i, j in similar.near_pairs(hashes, 6) for a, b in zip(i.tolist(), j.tolist())}
+    values = hashes.tolist()
+    expected = {(a, b) for a in range(len(values)) for b in range(a + 1, len(values))
+                if bin(values[a] ^ values[b]).count("1") <= 6}
+    assert found == expected and len(expected) >= 60
@@ -0,0 +1,72 @@
+import os, re, pytest
+from renamer import watch
+from renamer import functions as func
+from renamer.metadata import MetaStore
+
+ALL = re.compile(".*")
+
+
+def test_new_files_incremental(tmp_path):
+    tmp_path.joinpath("sub").mkdir()
+    tmp_path.joinpath("a.jpg").write_text("a")
+    tmp_path.joinpath("sub", "b.jpg").write_text("b")
+    state_file = tmp_path.parent / f"{tmp_path.name}-state.json"
+
+    state = watch.WatchState(state_file)
+    assert [p.name for p in watch.new_files(tmp_path, ALL, state)] == ["a.jpg", "b.jpg"]
+    state.save()
+
+    # renamed by the run: not an arrival
+    os.rename(tmp_path / "a.jpg", tmp_path / "P_a.jpg")
+    state.record_outputs([tmp_path / "P_a.jpg"])
+    state.save()
+    tmp_path.joinpath("sub", "c.jpg").write_text("c")
+
+    state = watch.WatchState(state_file)
+    state.since += watch.RACY_NS  # older files are out of the racy window
+    store = MetaStore()
+    found = watch.new_files(tmp_path, ALL, state, store=store)
+    assert [p.name for p in found] == ["c.jpg"]
+    # stat'ed once, by the scan
+    assert list(store.records) == found and store.records[found[0]].size == 1
+
+
+def test_new_files_skips_unchanged_folders(tmp_path, monkeypatch):
+    tmp_path.joinpath("sub").mkdir()
+    tmp_path.joinpath("sub", "b.jpg").write_text("b")
+    state = watch.WatchState()
+    watch.new_files(tmp_path, ALL, state)
+    folder = str(tmp_path / "sub")
+    state.dirs[folder][0] = os.stat(folder).st_mtime_ns  # as if scanned a while ago
+
+    listed = []
+    scandir = os.scandir
+    monkeypatch.setattr(watch.os, "scandir", lambda p: listed.append(p) or scandir(p))
+    watch.new_files(tmp_path, ALL, state)
+    assert folder not in listed
+
+
+def test_new_files_walk_filter(tmp_path):
+    for name in ["a.jpg", "@eaDir/b.jpg", "in/c.jpg", "in/c.txt"]:
+        tmp_path.joinpath(name).parent.mkdir(exist_ok=True)
+        tmp_path.joinpath(name).write_text("x")
+    state = watch.WatchState()
+    walk_filter = func.WalkFilter(exclude=["@eaDir"], include=["in"], names=["*.jpg"])
+    assert [p.name for p in watch.new_files(tmp_path, ALL, state, walk_filter)] == ["c.jpg"]
+    assert str((tmp_path / "@eaDir").resolve()) not in state.dirs
+    assert state.outside == {str(tmp_path.resolve())}
+
+
+def test_watch_inotify(tmp_path):
+    try:
+        watch.Inotify().close()
+    except (OSError, AttributeError):
+        pytest.skip("inotify not available")
+    tmp_path.joinpath("a.jpg").write_text("a")
+    batches = watch.watch(tmp_path, re.compile(r".*\.jpg"), watch.WatchState(), interval=0.1)
+    assert [p.name for p in next(batches)] == ["a.jpg"]
+
+    tmp_path.joinpath("b.jpg").write_text("b")
+    tmp_path.joinpath("b.txt").write_text("b")
+    assert [p.name for p in next(batches)] == ["b.jpg"]
+    batches.close()